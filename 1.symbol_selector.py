@@ -1,50 +1,152 @@
+import os
 import requests
 import json
-from pathlib import Path
+import time
+
+import numpy as np
+
+from round_state import RoundState, atomic_write
 
 API_URL = "https://api.mexc.com"
 SYMBOLS = ["DOGEUSDT", "SHIBUSDT"]
-symbol_score = {}
+# list：只評分 SYMBOLS；market：一次抓全市場 ticker，評分所有 USDT 交易對
+SELECT_MODE = os.environ.get("KILLCORE_SELECT_MODE", "list")
+TOP_K = int(os.environ.get("KILLCORE_SELECT_TOP_K", "10"))
+# stream：list 模式優先讀 kline_stream 接收器的即時行情，沒有或過期才打 REST
+KLINE_MODE = os.environ.get("KILLCORE_KLINE_MODE", "live")
+QUOTE_ASSET = "USDT"
+# 上一輪收尾時預先抓好的行情：此秒數內的快取直接沿用，不再打 REST（0 表示不預抓也不使用）
+TICKER_CACHE_SEC = float(os.environ.get("KILLCORE_TICKER_CACHE_SEC", "0"))
+TICKER_CACHE_FILE = "ticker_cache.json"
+# 排程用的讀寫宣告（見 stage_graph）；選幣結果目前只供報表參考，核心模組不依賴它
+STATE_READS = ("memory", "tickers")
+STATE_WRITES = ("selected_symbol",)
+
+session = requests.Session()
+
+
+def score_market(tickers, memory, top_k=TOP_K):
+    # 全市場一次向量化評分：chg * 5 + vol / 1e7 + mem_score，保留前 top_k
+    rows = [t for t in tickers if t.get("symbol", "").endswith(QUOTE_ASSET)]
+    if not rows:
+        return {}
+    symbols = np.array([t["symbol"] for t in rows])
+    vol = np.array([float(t.get("quoteVolume") or 0) for t in rows])
+    chg = np.abs(np.array([float(t.get("priceChangePercent") or 0) for t in rows]))
+    mem = np.array([memory.get(sym, {}).get("score", 0) for sym in symbols], dtype=np.float64)
+    total = np.round(chg * 5 + vol / 1e7 + mem, 2)
+    k = min(top_k, len(total))
+    top = np.argpartition(-total, k - 1)[:k]
+    return {
+        str(symbols[i]): {
+            "vol": round(float(vol[i]) / 1e6, 2),
+            "chg": round(float(chg[i]), 2),
+            "mem": round(float(mem[i]), 2),
+            "total": float(total[i])
+        }
+        for i in top
+    }
+
+
+def fetch_ticker(symbol, http=None):
+    r = (http or session).get(f"{API_URL}/api/v3/ticker/24hr?symbol={symbol}", timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+
+def fetch_market(http=None):
+    r = (http or session).get(f"{API_URL}/api/v3/ticker/24hr", timeout=10)
+    r.raise_for_status()
+    return r.json()
+
+
+def prefetch_tickers(root):
+    # 給排程器的預抓階段：依目前選幣模式抓好下一輪要用的行情
+    if TICKER_CACHE_SEC <= 0:
+        return 0
+    tickers = fetch_market() if SELECT_MODE == "market" else {s: fetch_ticker(s) for s in SYMBOLS}
+    atomic_write(root / TICKER_CACHE_FILE, json.dumps({"ts": time.time(), "mode": SELECT_MODE, "tickers": tickers}).encode())
+    return len(tickers)
 
-# 記憶權重讀取（如無則為 0）
-memory_path = Path("~/Killcore/king_memory.json").expanduser()
-memory = {}
-if memory_path.exists():
+
+def cached_tickers(root):
+    if TICKER_CACHE_SEC <= 0:
+        return None
+    try:
+        cache = json.loads((root / TICKER_CACHE_FILE).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if cache.get("mode") != SELECT_MODE or time.time() - cache.get("ts", 0) > TICKER_CACHE_SEC:
+        return None
+    return cache["tickers"]
+
+
+def score_list(memory, tickers, http=None):
+    # 只評分 SYMBOLS；tickers 為已取得的行情（快取或串流），缺的才打 REST
+    streamed = dict(tickers)
+    if KLINE_MODE == "stream":
+        from kline_stream import read_tickers
+        streamed.update(read_tickers())
+    symbol_score = {}
+    for symbol in SYMBOLS:
+        try:
+            data = streamed.get(symbol)
+            if data is None:
+                data = fetch_ticker(symbol, http)
+            vol = float(data.get("quoteVolume", 0))
+            chg = abs(float(data.get("priceChangePercent", 0)))
+            mem_score = memory.get(symbol, {}).get("score", 0)
+            total = round(chg * 5 + vol / 1e7 + mem_score, 2)
+            symbol_score[symbol] = {
+                "vol": round(vol / 1e6, 2),
+                "chg": round(chg, 2),
+                "mem": round(mem_score, 2),
+                "total": total
+            }
+        except Exception as e:
+            print(f"[錯誤] 無法獲取幣種 {symbol}：{e}")
+            raise
+    return symbol_score
+
+
+def run(state):
+    # 固定幣種的 king 不需評分，也不打 API
+    if state.symbol:
+        print(f"\n[Symbol Selector v1.1] 固定幣種：{state.symbol}")
+        state.save("selected_symbol", {"symbol": state.symbol, "candidates": [state.symbol]})
+        return
+
+    # 記憶權重讀取（如無則為 0）
     try:
-        memory = json.loads(memory_path.read_text())
+        memory = state.memory()
     except json.JSONDecodeError as e:
         print(f"[錯誤] king_memory.json 無法解析：{e}")
         raise
 
-for symbol in SYMBOLS:
-    try:
-        r = requests.get(f"{API_URL}/api/v3/ticker/24hr?symbol={symbol}", timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        vol = float(data.get("quoteVolume", 0))
-        chg = abs(float(data.get("priceChangePercent", 0)))
-        mem_score = memory.get(symbol, {}).get("score", 0)
-        total = round(chg * 5 + vol / 1e7 + mem_score, 2)
-        symbol_score[symbol] = {
-            "vol": round(vol / 1e6, 2),
-            "chg": round(chg, 2),
-            "mem": round(mem_score, 2),
-            "total": total
-        }
-    except Exception as e:
-        print(f"[錯誤] 無法獲取幣種 {symbol}：{e}")
-        raise
+    cached = cached_tickers(state.root)
+    if SELECT_MODE == "market":
+        symbol_score = score_market(cached if cached is not None else fetch_market(state.session), memory)
+        if not symbol_score:
+            # 全市場沒有符合條件的 USDT 交易對（例如 API 回傳空清單）：退回固定清單
+            print("[警告] 全市場行情沒有可評分的 USDT 交易對，改評分預設幣種")
+            symbol_score = score_list(memory, {}, state.session)
+    else:
+        symbol_score = score_list(memory, cached or {}, state.session)
+
+    # 排名
+    sorted_symbols = sorted(symbol_score.items(), key=lambda x: x[1]["total"], reverse=True)
+    selected = sorted_symbols[0][0]
+
+    # 顯示結果
+    print("\n[Symbol Selector v1.1]")
+    for sym, s in sorted_symbols:
+        print(f"{sym.ljust(10)}｜ 波動: {s['chg']}% ｜ 成交量: {s['vol']}M ｜ 記憶分數: {s['mem']} ｜ 總分: {s['total']}")
+    print(f"\n>>> 本輪建議交易幣種: {selected}")
 
-# 排名
-sorted_symbols = sorted(symbol_score.items(), key=lambda x: x[1]["total"], reverse=True)
-selected = sorted_symbols[0][0]
+    # 儲存 symbol 給核心模組使用
+    state.save("selected_symbol", {"symbol": selected, "candidates": [sym for sym, _ in sorted_symbols]})
 
-# 顯示結果
-print("\n[Symbol Selector v1.1]")
-for sym, s in sorted_symbols:
-    print(f"{sym.ljust(10)}｜ 波動: {s['chg']}% ｜ 成交量: {s['vol']}M ｜ 記憶分數: {s['mem']} ｜ 總分: {s['total']}")
-print(f"\n>>> 本輪建議交易幣種: {selected}")
 
-# 儲存 symbol 給核心模組使用
-symbol_path = Path("~/Killcore/selected_symbol.json").expanduser()
-symbol_path.write_text(json.dumps({"symbol": selected}, indent=2))
+if __name__ == "__main__":
+    with RoundState() as state:
+        run(state)
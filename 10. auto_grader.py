@@ -1,78 +1,101 @@
-import json
-from pathlib import Path
-from statistics import mean, stdev
+from rolling_stats import RING_SIZE, WINDOWS, build_stats, window_summary
+from round_state import RoundState
 
-mem_path = Path("~/Killcore/king_memory.json").expanduser()
-output_path = Path("~/Killcore/king_self_evaluation.json").expanduser()
+GRADE_WINDOW = 20  # 只分析最近 20 輪
 
-if not mem_path.exists():
-    raise FileNotFoundError("找不到 king_memory.json")
 
-memory = json.loads(mem_path.read_text())
-history = memory.get("history", [])[-20:]  # 只分析最近 20 輪
-evo_trace = memory.get("evolution_trace", [])[-5:]
-fail_stats = memory.get("fail_indicators_count", {})
+def trend_direction(summary, reverse=False):
+    if summary["n"] < 2:
+        return "下降"
+    first, last = (summary["last"], summary["first"]) if reverse else (summary["first"], summary["last"])
+    return "上升" if last > first else "下降"
 
-# --- 趨勢評估 ---
-returns = [r.get("return_pct", 0) for r in history]
-drawdowns = [r.get("drawdown", 100) for r in history]
-win_rates = [r.get("win_rate", 0) for r in history]
+def stability_score(summary):
+    return round(summary["std"], 2) if summary["n"] >= 2 else 0
 
-def trend_direction(data):
-    return "上升" if len(data) >= 2 and data[-1] > data[0] else "下降"
 
-def stability_score(data):
-    return round(stdev(data), 2) if len(data) >= 2 else 0
+def run(state):
+    memory = state.memory()
+    evo_trace = memory.tail("evolution_trace", 5)
+    fail_stats = memory.get("fail_indicators_count", {})
 
-trend_report = {
-    "return_trend": trend_direction(returns),
-    "drawdown_trend": trend_direction(drawdowns[::-1]),
-    "winrate_trend": trend_direction(win_rates),
-    "return_std": stability_score(returns),
-    "drawdown_avg": round(mean(drawdowns), 2) if drawdowns else 100,
-    "learning_score": memory.get("learning_score", 0),
-    "fail_count": sum(fail_stats.values())
-}
+    # --- 趨勢評估：讀 memory_recorder 逐輪維護的滾動統計，不重掃 history ---
+    stats = memory.get("rolling_stats") or build_stats(memory.tail("history", RING_SIZE))
+    returns = window_summary(stats, "return_pct", GRADE_WINDOW)
+    drawdowns = window_summary(stats, "drawdown", GRADE_WINDOW)
+    win_rates = window_summary(stats, "win_rate", GRADE_WINDOW)
 
-# --- 評分與標籤 ---
-score = 0
-if trend_report["return_trend"] == "上升": score += 2
-if trend_report["drawdown_trend"] == "下降": score += 2
-if trend_report["return_std"] < 3: score += 1
-if trend_report["learning_score"] >= 4: score += 1
-if trend_report["fail_count"] < 10: score += 1
+    trend_report = {
+        "return_trend": trend_direction(returns),
+        "drawdown_trend": trend_direction(drawdowns, reverse=True),
+        "winrate_trend": trend_direction(win_rates),
+        "return_std": stability_score(returns),
+        "drawdown_avg": round(drawdowns["mean"], 2) if drawdowns["n"] else 100,
+        "learning_score": memory.get("learning_score", 0),
+        "fail_count": sum(fail_stats.values())
+    }
 
-if score >= 6:
-    level = "S+（已達實戰）"
-    advice = "建議保守進化或微調風格以穩定實戰績效"
-elif score >= 4:
-    level = "A（穩定進化中）"
-    advice = "維持風格主軸，可調整進場與TP/SL參數"
-elif score >= 2:
-    level = "B（波動偏高）"
-    advice = "需觀察，考慮強化風險管理或改變策略"
-else:
-    level = "C（退化或失控）"
-    advice = "建議重置進化方向，並記錄錯誤模式"
+    # --- 多視窗長期趨勢 ---
+    horizons = {}
+    for w in WINDOWS:
+        horizons[str(w)] = {}
+        for metric in ("return_pct", "drawdown", "win_rate"):
+            summary = window_summary(stats, metric, w)
+            horizons[str(w)][metric] = {
+                "n": summary["n"],
+                "mean": round(summary["mean"], 4) if summary["n"] else None,
+                "std": round(summary["std"], 4),
+                "slope": round(summary["slope"], 4),
+            }
 
-# --- 產出 JSON 給模組 3 使用 ---
-result = {
-    "evolution_grade": level,
-    "trend_score": score,
-    "trend_report": trend_report,
-    "evolution_advice": advice,
-    "status_flag": "ok"
-}
-output_path.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    # --- 評分與標籤 ---
+    score = 0
+    if trend_report["return_trend"] == "上升": score += 2
+    if trend_report["drawdown_trend"] == "下降": score += 2
+    if trend_report["return_std"] < 3: score += 1
+    if trend_report["learning_score"] >= 4: score += 1
+    if trend_report["fail_count"] < 10: score += 1
 
-# CLI 顯示給人類參考
-print("— 模組 10：自我進化分析報告 —")
-print(f"狀態等級：{level}")
-print(f"趨勢分數：{score} 分")
-print("報酬趨勢：", trend_report["return_trend"])
-print("回撤趨勢：", trend_report["drawdown_trend"])
-print("勝率趨勢：", trend_report["winrate_trend"])
-print("報酬波動度：", trend_report["return_std"])
-print("學習力：", trend_report["learning_score"], "/ 5")
-print("失敗總數：", trend_report["fail_count"])
-print("建議行動：", advice)
+    if score >= 6:
+        level = "S+（已達實戰）"
+        advice = "建議保守進化或微調風格以穩定實戰績效"
+    elif score >= 4:
+        level = "A（穩定進化中）"
+        advice = "維持風格主軸，可調整進場與TP/SL參數"
+    elif score >= 2:
+        level = "B（波動偏高）"
+        advice = "需觀察，考慮強化風險管理或改變策略"
+    else:
+        level = "C（退化或失控）"
+        advice = "建議重置進化方向，並記錄錯誤模式"
+
+    # --- 產出 JSON 給模組 3 使用 ---
+    result = {
+        "evolution_grade": level,
+        "trend_score": score,
+        "trend_report": trend_report,
+        "horizons": horizons,
+        "evolution_advice": advice,
+        "status_flag": "ok"
+    }
+    state.save("evaluation", result)
+
+    # CLI 顯示給人類參考
+    print("— 模組 10：自我進化分析報告 —")
+    print(f"狀態等級：{level}")
+    print(f"趨勢分數：{score} 分")
+    print("報酬趨勢：", trend_report["return_trend"])
+    print("回撤趨勢：", trend_report["drawdown_trend"])
+    print("勝率趨勢：", trend_report["winrate_trend"])
+    print("報酬波動度：", trend_report["return_std"])
+    print("學習力：", trend_report["learning_score"], "/ 5")
+    print("失敗總數：", trend_report["fail_count"])
+    for w, h in horizons.items():
+        r = h["return_pct"]
+        print(f"近 {w} 輪報酬：平均 {r['mean']} ｜ 波動 {r['std']} ｜ 斜率 {r['slope']}（{r['n']} 輪）")
+    print("建議行動：", advice)
+
+
+if __name__ == "__main__":
+    with RoundState() as state:
+        run(state)
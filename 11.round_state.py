@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from memory_store import open_memory_store
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+KILLCORE_PATH = Path("~/Killcore").expanduser()
+# orjson：有安裝就用（輸出仍為 2 格縮排，逐行內容與 json 模組相同，封存的行切塊去重不受影響）；json：強制用標準庫
+JSON_LIB = os.environ.get("KILLCORE_JSON_LIB", "orjson")
+# 狀態檔解析失敗時，往回找最近幾輪封存中的同名檔還原
+RECOVER_ROUNDS = 5
+
+# 各模組共用的狀態檔（邏輯名稱 → 相對路徑）
+STATE_FILES = {
+    "king": "modules/king.json",
+    "performance": "king_performance.json",
+    "memory": "king_memory.json",
+    "evaluation": "king_self_evaluation.json",
+    "market": "market_status.json",
+    "symbol_memory": "symbol_memory.json",
+    "selected_symbol": "selected_symbol.json",
+    "population": "modules/population.json",
+    "indicators": "modules/indicator_state.json",
+}
+
+_MISSING = object()
+# 行程內的已解析快取：路徑 → (mtime_ns, 大小, inode, 資料)。只放本行程剛寫出的內容，
+# 下一個 RoundState（如編排器的下一輪）檔案未變時直接取用並接手該物件，不再重新解析
+_parsed = {}
+
+
+def dumps(data):
+    if orjson is not None and JSON_LIB == "orjson":
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode()
+
+
+def loads(raw):
+    if orjson is not None and JSON_LIB == "orjson":
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # 舊檔可能含 NaN 等 orjson 不接受的寫法，交給標準庫判斷
+    return json.loads(raw)
+
+
+def atomic_write(path, raw):
+    # 先寫同目錄暫存檔再 rename：中途當機只會留下舊檔或新檔，不會是半份
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(raw)
+    os.replace(tmp, path)
+
+
+class RoundState:
+    """單輪共用狀態：每個檔案最多解析一次，寫入延後到 flush() 一次落地。
+
+    load() 回傳的是快取中的同一個物件，模組修改後需呼叫 save() 才會標記寫回。
+    king_memory 一律經由 memory() 取得的記憶介面存取。
+    symbol 不為 None 時表示此命名空間的 king 固定交易該幣種（多 king 編排器使用）。
+    """
+
+    def __init__(self, root=KILLCORE_PATH, symbol=None, session=None):
+        self.root = Path(root)
+        self.symbol = symbol
+        # 本輪各模組打 API 用的 HTTP session；None 時用各模組自己的預設 session
+        self.session = session
+        self._cache = {}
+        self._dirty = set()
+        # 並行排程時多個模組同時 save；_cache / _dirty 的走訪與修改都在此鎖內
+        self._lock = threading.Lock()
+        self._memory = None
+        # 累計 JSON 讀寫位元組數（round_metrics 以前後差值算出各模組用量）
+        self.io = {"json_read_bytes": 0, "json_written_bytes": 0}
+
+    def path(self, key):
+        return self.root / STATE_FILES[key]
+
+    def exists(self, key):
+        return key in self._cache or self.path(key).exists()
+
+    def load(self, key, default=_MISSING):
+        if key in self._cache:
+            return self._cache[key]
+        path = self.path(key)
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            if default is _MISSING:
+                raise FileNotFoundError(f"找不到 {path.name}")
+            return default
+        hit = _parsed.pop(path, None)
+        if hit is not None and hit[:3] == (st.st_mtime_ns, st.st_size, st.st_ino):
+            data = hit[3]
+        else:
+            raw = path.read_bytes()
+            self.io["json_read_bytes"] += len(raw)
+            try:
+                data = loads(raw)
+            except json.JSONDecodeError:
+                data = self._recover(key)
+        with self._lock:
+            self._cache[key] = data
+        return data
+
+    def _recover(self, key):
+        # 檔案損毀：以最近一輪封存中的同名檔還原並標記寫回；找不到可用封存才拋出原錯誤
+        path = self.path(key)
+        archive_root = self.root / "archives"
+        if archive_root.exists():
+            from round_archive import RoundArchive
+            archive = RoundArchive(archive_root)
+            last = archive.last_round()
+            for round_num in range(last, max(last - RECOVER_ROUNDS, 0), -1):
+                try:
+                    data = loads(archive.read_file(round_num, path.name))
+                except (FileNotFoundError, KeyError, ValueError):
+                    continue
+                print(f"[警告] {path.name} 解析失敗，已由第 {round_num} 輪封存還原")
+                with self._lock:
+                    self._dirty.add(key)
+                return data
+        raise json.JSONDecodeError(f"{path.name} 解析失敗且無可用封存", path.read_text(errors="replace"), 0)
+
+    def save(self, key, data):
+        with self._lock:
+            self._cache[key] = data
+            self._dirty.add(key)
+
+    # === 常用狀態的存取介面（檢查為 dict，避免格式錯誤的檔案流進模組）===
+
+    def _typed(self, key, default):
+        data = self.load(key, default)
+        if not isinstance(data, dict):
+            raise ValueError(f"{self.path(key).name} 格式錯誤：應為物件，實為 {type(data).__name__}")
+        return data
+
+    def king(self, default=_MISSING):
+        return self._typed("king", default)
+
+    def performance(self, default=_MISSING):
+        return self._typed("performance", default)
+
+    def evaluation(self, default=_MISSING):
+        return self._typed("evaluation", default)
+
+    def memory(self, reset=False):
+        if self._memory is None or reset:
+            self._memory = open_memory_store(self, reset=reset)
+        return self._memory
+
+    def begin_stage(self, keys=None):
+        # 模組開始前替已 save 的狀態留一份序列化快照：模組可能直接改快取中的同一物件後才失敗，
+        # 失敗時以快照還原；未 save 過的狀態失敗時直接丟棄、回到檔案內容
+        with self._lock:
+            saved = {key: self._cache[key] for key in self._dirty
+                     if key in self._cache and (keys is None or key in keys)}
+        return {key: dumps(data) for key, data in saved.items()}
+
+    def end_stage(self, keys=None):
+        # keys：該模組宣告讀寫的狀態（並行排程時），未涉及記憶的模組不動記憶的 savepoint
+        if self._memory is not None and (keys is None or "memory" in keys):
+            self._memory.release()
+
+    def is_dirty(self, key):
+        return key in self._dirty
+
+    def invalidate_clean(self, keys=None, snapshot=None):
+        # 模組中途失敗時撤回它的修改，避免半途修改流到下一個模組與寫檔：
+        # 開始前已 save 的以 begin_stage() 快照還原，其餘丟棄快取（含本模組的 save）。
+        # 並行排程時只處理該模組宣告的狀態，不影響同時執行中的其他模組
+        snapshot = snapshot or {}
+        with self._lock:
+            for key in list(self._cache):
+                if keys is not None and key not in keys:
+                    continue
+                if key in snapshot:
+                    self._cache[key] = loads(snapshot[key])
+                else:
+                    self._cache.pop(key, None)
+                    self._dirty.discard(key)
+        if self._memory is not None and (keys is None or "memory" in keys):
+            self._memory.rollback()
+
+    def flush(self):
+        if self._memory is not None:
+            self._memory.commit()
+        with self._lock:
+            written = sorted(self._dirty)
+            for key in written:
+                path = self.path(key)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                raw = dumps(self._cache[key])
+                atomic_write(path, raw)
+                self.io["json_written_bytes"] += len(raw)
+                st = path.stat()
+                _parsed[path] = (st.st_mtime_ns, st.st_size, st.st_ino, self._cache[key])
+            self._dirty.clear()
+        return written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
@@ -0,0 +1,272 @@
+import numpy as np
+
+
+def klines_to_arrays(klines):
+    # MEXC /api/v3/klines：[openTime, open, high, low, close, volume, closeTime, quoteVolume]
+    raw = np.asarray([k[:6] for k in klines], dtype=np.float64)
+    return {
+        "open_time": raw[:, 0].astype(np.int64),
+        "open": raw[:, 1],
+        "high": raw[:, 2],
+        "low": raw[:, 3],
+        "close": raw[:, 4],
+        "volume": raw[:, 5],
+    }
+
+
+def moving_average(x, n):
+    # 簡單移動平均，前 n-1 根為 NaN
+    out = np.full(len(x), np.nan)
+    if n <= 0 or n > len(x):
+        return out
+    c = np.cumsum(np.insert(x, 0, 0.0))
+    out[n - 1:] = (c[n:] - c[:-n]) / n
+    return out
+
+
+def _segments(starts, ends):
+    # 展開多個 [start, end] 區間為 (bar 索引, 區間編號)，總成本 O(總長度)
+    lengths = ends - starts + 1
+    seg = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return starts[seg] + offsets, seg
+
+
+def _first_per_segment(mask, seg, n_seg):
+    # 每個區間第一個 True 的位置，無則 -1
+    first = np.full(n_seg, -1)
+    pos = np.flatnonzero(mask)
+    if len(pos):
+        segs, idx = np.unique(seg[pos], return_index=True)
+        first[segs] = pos[idx]
+    return first
+
+
+def delayed_fills(open_, close, entry_idx, last_bar, n_slices, execution_delay_ms=0, bar_ms=60_000):
+    """虛擬時鐘下的分批成交：第 k 批於第 entry_idx + k 根開盤送單，延遲 delay·(k+1)/n 後成交。
+
+    延遲沿 K 線時間軸往後推：跨過幾根就移到幾根之後，剩餘部分在該根內
+    由開盤價往收盤價線性內插。回傳 (成交根, 未含滑價的成交價, 根內偏移毫秒)，形狀皆為 (交易數, n_slices)。
+    """
+    k = np.arange(n_slices)
+    delay = execution_delay_ms * (k + 1) / n_slices
+    shift, offset = np.divmod(delay, bar_ms)
+    fill_bars = np.minimum(entry_idx[:, None] + k[None, :] + shift.astype(np.int64)[None, :], last_bar[:, None])
+    frac = np.broadcast_to(offset / bar_ms, fill_bars.shape)
+    px = open_[fill_bars] + frac * (close[fill_bars] - open_[fill_bars])
+    return fill_bars, px, np.broadcast_to(offset, fill_bars.shape)
+
+
+def _empty_trades():
+    return {
+        "entry_idx": np.zeros(0, dtype=np.int64),
+        "exit_idx": np.zeros(0, dtype=np.int64),
+        "entry_price": np.zeros(0),
+        "exit_price": np.zeros(0),
+        "return_pct": np.zeros(0),
+        "exit_reason": np.zeros(0, dtype="<U6"),
+        "signal_bar": np.zeros(0, dtype=np.int64),
+        "slice_bar": np.zeros((0, 0), dtype=np.int64),
+        "slice_price": np.zeros((0, 0)),
+        "slice_offset_ms": np.zeros((0, 0)),
+    }
+
+
+def backtest_ma_crossover(open_, high, low, close, ma_fast, ma_slow, sl_pct, tp_pct,
+                          fee_rate=0.001, slippage=0.0, entry_slices=(1.0,),
+                          capital=70.51,
+                          execution_delay_ms=0, bar_ms=60_000):
+    """MA 交叉做多回測（全陣列運算，無逐根 Python 迴圈）。
+
+    黃金交叉收盤後，分 len(entry_slices) 批於後續各根開盤價進場
+    （execution_delay_ms > 0 時改以 delayed_fills 的延遲成交價）；
+    全部批次成交後才檢查 SL / TP，先 SL 再 TP（同根同時觸及視為停損），
+    死亡交叉收盤後於下一根開盤出場，資料結束時以最後收盤價平倉。
+    """
+    open_, high, low, close = (np.asarray(a, dtype=np.float64) for a in (open_, high, low, close))
+    n = len(close)
+    ma_fast, ma_slow = int(ma_fast), int(ma_slow)
+    equity = np.full(n, float(capital))
+    trades = _empty_trades()
+
+    fast = moving_average(close, ma_fast)
+    slow = moving_average(close, ma_slow)
+    valid = ~(np.isnan(fast) | np.isnan(slow))
+    above = valid & (fast > slow)
+    prev_above = np.roll(above, 1)
+    prev_valid = np.roll(valid, 1)
+    if n:
+        prev_above[0] = prev_valid[0] = False
+    cross_up = np.flatnonzero(above & ~prev_above & prev_valid)
+    cross_down = np.flatnonzero(valid & prev_valid & ~above & prev_above)
+
+    # 進場為訊號的下一根；交叉必定上下交替，故每筆持倉區間互不重疊
+    cross_up = cross_up[cross_up + 1 < n]
+    if len(cross_up) == 0:
+        return _summarize(equity, trades, capital)
+    entry_idx = cross_up + 1
+    k = np.searchsorted(cross_down, cross_up, side="right")
+    has_signal = k < len(cross_down)
+    signal_bar = np.where(has_signal, cross_down[np.minimum(k, len(cross_down) - 1)], n - 1)
+    scan_end = signal_bar
+
+    # 分批進場價（以資金比例加權的平均成本）
+    weights = np.asarray(entry_slices, dtype=np.float64)
+    slice_bars, fill_px, fill_offset = delayed_fills(open_, close, entry_idx, scan_end, len(weights),
+                                                     execution_delay_ms, bar_ms)
+    slice_px = fill_px * (1 + slippage)
+    entry_price = weights.sum() / (weights / slice_px).sum(axis=1)
+    sl_level = entry_price * (1 - sl_pct / 100)
+    tp_level = entry_price * (1 + tp_pct / 100)
+
+    # 區間內找第一次觸及 SL / TP；平均成本含後續各批的成交價，故從最後一批成交的那根才開始檢查，
+    # 否則較早的 K 線會以尚未發生的成交價判定（前視）
+    scan_start = slice_bars[:, -1]
+    bars, seg = _segments(scan_start, scan_end)
+    m = len(entry_idx)
+    first_sl = _first_per_segment(low[bars] <= sl_level[seg], seg, m)
+    first_tp = _first_per_segment(high[bars] >= tp_level[seg], seg, m)
+    big = len(bars)
+    sl_pos = np.where(first_sl >= 0, first_sl, big)
+    tp_pos = np.where(first_tp >= 0, first_tp, big)
+    hit_pos = np.minimum(sl_pos, tp_pos)
+    hit = hit_pos < big
+    is_sl = hit & (sl_pos <= tp_pos)
+    hit_bar = bars[np.minimum(hit_pos, big - 1)]
+
+    signal_exit_bar = np.minimum(signal_bar + 1, n - 1)
+    exit_idx = np.where(hit, hit_bar, np.where(has_signal, signal_exit_bar, n - 1))
+    at_close = ~hit & (~has_signal | (signal_bar + 1 >= n))
+    raw_exit = np.where(at_close, close[exit_idx], open_[exit_idx])
+    # 跳空時以開盤價成交
+    raw_exit = np.where(is_sl, np.minimum(open_[exit_idx], sl_level), raw_exit)
+    raw_exit = np.where(hit & ~is_sl, np.maximum(open_[exit_idx], tp_level), raw_exit)
+    exit_price = raw_exit * (1 - slippage)
+    reason = np.where(is_sl, "sl", np.where(hit, "tp", np.where(has_signal, "signal", "end")))
+
+    multiple = (exit_price * (1 - fee_rate)) / (entry_price * (1 + fee_rate))
+    start_eq = capital * np.concatenate(([1.0], np.cumprod(multiple)[:-1]))
+
+    # 權益曲線：持倉中以收盤價評價，出場根記實現值，空手時沿用前值
+    marks = np.full(n, np.nan)
+    marks[0] = capital
+    hold_bars, hold_seg = _segments(entry_idx, np.maximum(exit_idx - 1, entry_idx))
+    inside = hold_bars < exit_idx[hold_seg]
+    hold_bars, hold_seg = hold_bars[inside], hold_seg[inside]
+    marks[hold_bars] = start_eq[hold_seg] * close[hold_bars] * (1 - fee_rate) / (entry_price[hold_seg] * (1 + fee_rate))
+    marks[exit_idx] = start_eq * multiple
+    filled = np.where(np.isnan(marks), 0, np.arange(n))
+    equity = marks[np.maximum.accumulate(filled)]
+
+    trades = {
+        "entry_idx": entry_idx,
+        "exit_idx": exit_idx,
+        "entry_price": entry_price,
+        "exit_price": exit_price,
+        "return_pct": (multiple - 1) * 100,
+        "exit_reason": reason,
+        "signal_bar": scan_end,
+        "slice_bar": slice_bars,
+        "slice_price": fill_px,
+        "slice_offset_ms": fill_offset,
+    }
+    return _summarize(equity, trades, capital)
+
+
+def _summarize(equity, trades, capital):
+    peak = np.maximum.accumulate(equity) if len(equity) else equity
+    drawdown = float(np.max(1 - equity / peak) * 100) if len(equity) else 0.0
+    # 逐筆交易 Sharpe（不年化）：逐根年化在 1m 下會放大到 ±25 之類的數值，且隨 K 線週期改變尺度
+    trade_count = len(trades["return_pct"])
+    std = trades["return_pct"].std() if trade_count > 1 else 0.0
+    sharpe = float(trades["return_pct"].mean() / std) if std > 0 else 0.0
+    final = float(equity[-1]) if len(equity) else float(capital)
+    return {
+        "equity": equity,
+        "trades": trades,
+        "return_pct": (final / capital - 1) * 100,
+        "net_profit": final - capital,
+        "drawdown": drawdown,
+        "sharpe": sharpe,
+        "win_rate": float((trades["return_pct"] > 0).mean() * 100) if trade_count else 0.0,
+        "trade_count": trade_count,
+    }
+
+
+
+def fitness(bt):
+    # 進化引擎與參數掃描共用的適應度：報酬扣掉一半回撤
+    return round(float(bt["return_pct"] - 0.5 * bt["drawdown"]), 4)
+
+
+def monte_carlo_returns(open_, close, trades, slice_weights, slippage, fee_rate, delay_ms,
+                        base_slippage=0.0, bar_ms=60_000, max_cells=4_000_000):
+    """以一次 NumPy 批次重新定價 N 條成交路徑，回傳每條路徑的總報酬 %（形狀 (N,)）。
+
+    進出場根與出場原因沿用基準回測的交易；每條路徑各自抽樣的是分批比例
+    slice_weights (N, S)、每批滑價 slippage (N, S)、手續費 fee_rate (N,) 與延遲 delay_ms (N,)。
+    出場滑價取該路徑各批滑價的平均。
+    """
+    open_, close = np.asarray(open_, dtype=np.float64), np.asarray(close, dtype=np.float64)
+    slice_weights, slippage = np.asarray(slice_weights, dtype=np.float64), np.asarray(slippage, dtype=np.float64)
+    fee_rate, delay_ms = np.asarray(fee_rate, dtype=np.float64), np.asarray(delay_ms, dtype=np.float64)
+    n_paths, n_slices = slippage.shape
+    m = len(trades["entry_idx"])
+    if m == 0:
+        return np.zeros(n_paths)
+    entry_idx = trades["entry_idx"].astype(np.int64)
+    last_bar = trades["signal_bar"].astype(np.int64)
+    raw_exit = trades["exit_price"] / (1 - base_slippage)
+    k = np.arange(n_slices)
+
+    out = np.empty(n_paths)
+    step = max(1, max_cells // (m * n_slices))
+    for a in range(0, n_paths, step):
+        b = min(a + step, n_paths)
+        delay = delay_ms[a:b, None] * (k + 1) / n_slices                        # (n, S)
+        shift, offset = np.divmod(delay, bar_ms)
+        bars = np.minimum(entry_idx[None, :, None] + k + shift.astype(np.int64)[:, None, :],
+                          last_bar[None, :, None])                                # (n, m, S)
+        frac = (offset / bar_ms)[:, None, :]
+        fill = (open_[bars] + frac * (close[bars] - open_[bars])) * (1 + slippage[a:b, None, :])
+        w = slice_weights[a:b, None, :]
+        entry = w.sum(axis=2) / (w / fill).sum(axis=2)                            # (n, m)
+        exit_ = raw_exit[None, :] * (1 - slippage[a:b].mean(axis=1))[:, None]
+        fee = fee_rate[a:b, None]
+        multiple = exit_ * (1 - fee) / (entry * (1 + fee))
+        out[a:b] = (np.prod(multiple, axis=1) - 1) * 100
+    return out
+
+
+def return_distribution(returns):
+    # 路徑報酬的分佈摘要
+    returns = np.asarray(returns, dtype=np.float64)
+    p5, p50, p95 = np.percentile(returns, [5, 50, 95])
+    return {
+        "paths": int(len(returns)),
+        "mean": round(float(returns.mean()), 4),
+        "std": round(float(returns.std()), 4),
+        "p5": round(float(p5), 4),
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "prob_loss": round(float((returns < 0).mean()), 4),
+    }
+
+
+def trades_to_records(trades, open_time=None):
+    # 轉成可寫入 JSON 的交易清單
+    records = []
+    for i in range(len(trades["return_pct"])):
+        rec = {
+            "entry_idx": int(trades["entry_idx"][i]),
+            "exit_idx": int(trades["exit_idx"][i]),
+            "entry_price": round(float(trades["entry_price"][i]), 8),
+            "exit_price": round(float(trades["exit_price"][i]), 8),
+            "return_pct": round(float(trades["return_pct"][i]), 4),
+            "exit_reason": str(trades["exit_reason"][i]),
+        }
+        if open_time is not None:
+            rec["entry_time"] = int(open_time[rec["entry_idx"]])
+            rec["exit_time"] = int(open_time[rec["exit_idx"]])
+        records.append(rec)
+    return records
@@ -0,0 +1,304 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import requests
+
+from column_store import ColumnStore
+
+API_URL = "https://api.mexc.com"
+STORE_PATH = Path("~/Killcore/klines").expanduser()
+STREAM_PATH = Path("~/Killcore/stream").expanduser()
+# live：每輪只補抓最後一根之後的新 K 線；replay：完全離線，依游標逐輪重播本地資料；
+# stream：讀 kline_stream 接收器維護的環狀緩衝，不打 API，緩衝不可用時退回 live
+KLINE_MODE = os.environ.get("KILLCORE_KLINE_MODE", "live")
+FETCH_LIMIT = 1000
+REPLAY_STEP = 1
+# 同一 K 線庫在此秒數內已同步過就不再打 API（多個 king 共用同一 symbol 時）
+SYNC_TTL_SEC = 5
+# 收盤後交易所落地 K 線的緩衝；最近一次同步晚於最新收盤加此秒數時不會有新 K 線，跨行程也不必再打 API
+SYNC_SETTLE_SEC = 2
+# 補跑歷史輪次時由 daemon 指定：視窗只取到此 open time（毫秒）為止
+AS_OF = os.environ.get("KILLCORE_AS_OF")
+# 環狀緩衝容量（根）；需涵蓋模擬器最大視窗 1000 根加上未收盤的一根
+STREAM_RING_SIZE = 2048
+# 接收器超過此秒數沒有更新視為斷線，改走 REST
+STREAM_STALE_SEC = 60
+RING_READ_RETRIES = 50
+
+# 欄位 → dtype；每欄一個 append-only 的原始二進位檔
+COLUMNS = {
+    "open_time": np.int64,
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.float64,
+}
+INTERVAL_MS = {
+    "1m": 60_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "60m": 3_600_000,
+    "4h": 14_400_000,
+    "1d": 86_400_000,
+}
+
+# 取窗預設的 HTTP session；呼叫端可以 http 參數改用自己的（多 king 編排器傳入共用連線池）
+session = requests.Session()
+_store_locks = {}
+_last_sync = {}
+_locks_guard = threading.Lock()
+
+
+class KlineStore(ColumnStore):
+    """單一 symbol / interval 的本地欄式 K 線庫。
+
+    只保存已收盤的 K 線；讀取以 np.memmap 映射，window() 回傳的是零拷貝切片。
+    欄檔的存放、修復與世代切換見 column_store。
+    """
+
+    def __init__(self, symbol, interval="1m", root=STORE_PATH):
+        self.symbol = symbol
+        self.interval = interval
+        super().__init__(Path(root) / f"{symbol}_{interval}", COLUMNS)
+
+    def last_open_time(self):
+        return self._last("open_time")
+
+    def append(self, klines):
+        # klines 為 API 原始格式；未收盤與已存在的 K 線會被略過
+        now_ms = int(time.time() * 1000)
+        last = self.last_open_time()
+        rows = [k for k in klines if int(k[6]) < now_ms and (last is None or int(k[0]) > last)]
+        if not rows:
+            return 0
+        raw = np.asarray([k[:6] for k in rows], dtype=np.float64)
+        order = np.argsort(raw[:, 0], kind="stable")
+        raw = raw[order]
+        # 串流接收器與各輪 REST 補抓可能分屬不同行程，以檔案鎖串行並在鎖內重新確認最後一根
+        with self.locked():
+            last = self.last_open_time()
+            if last is not None:
+                raw = raw[raw[:, 0] > last]
+            self._append({col: raw[:, i] for i, col in enumerate(COLUMNS)})
+        return len(raw)
+
+    def merge(self, raw):
+        # 併入任意時段的已收盤 K 線（歷史回補用）：raw 為 n × 6 陣列（COLUMNS 順序），
+        # 與本地資料依 open time 聯集（重複時保留本地），以新世代整批換入；重播游標依 open time 對齊
+        raw = np.asarray(raw, dtype=np.float64).reshape(-1, len(COLUMNS))
+        if not len(raw):
+            return 0
+        with self.locked():
+            self._maps = None
+            cols = self.columns()
+            existing = np.column_stack([np.asarray(cols[col], dtype=np.float64) for col in COLUMNS])
+            combined = np.concatenate([existing, raw])
+            _, first = np.unique(combined[:, 0], return_index=True)
+            merged = combined[first]
+            added = len(merged) - len(existing)
+            self._maps = None
+            if not added:
+                return 0
+            cursor_file = self.path / "replay_cursor"
+            if cursor_file.exists() and len(existing):
+                cursor = min(int(cursor_file.read_text()), len(existing))
+                if cursor:
+                    pos = np.searchsorted(merged[:, 0], existing[cursor - 1, 0], side="right")
+                    cursor_file.write_text(str(int(pos)))
+            self._swap({col: merged[:, i] for i, col in enumerate(COLUMNS)})
+        return added
+
+    def sync(self, limit=FETCH_LIMIT, session=requests):
+        # 只抓最後一根之後的 K 線；落後太多時分頁補齊
+        added = 0
+        while True:
+            url = f"{API_URL}/api/v3/klines?symbol={self.symbol}&interval={self.interval}&limit={limit}"
+            last = self.last_open_time()
+            if last is not None:
+                url += f"&startTime={last + 1}"
+            requested_at = int(time.time() * 1000)
+            res = session.get(url, timeout=10)
+            res.raise_for_status()
+            batch = res.json()
+            n = self.append(batch)
+            added += n
+            if last is None or n == 0 or len(batch) < limit:
+                (self.path / "synced_at").write_text(str(requested_at))
+                return added
+
+    def is_current(self, now_ms=None):
+        # 上次同步（請求送出時間）晚於最新一根收盤加落地緩衝：交易所端沒有本地還沒有的已收盤 K 線
+        try:
+            synced_at = int((self.path / "synced_at").read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        step = INTERVAL_MS.get(self.interval, INTERVAL_MS["1m"])
+        now_ms = time.time() * 1000 if now_ms is None else now_ms
+        return synced_at >= now_ms // step * step + SYNC_SETTLE_SEC * 1000
+
+    def index_of(self, open_time):
+        # 第一根 open time 大於指定時間的位置（二分搜尋 memmap）
+        return int(np.searchsorted(self.columns()["open_time"], open_time, side="right"))
+
+    def window(self, limit, end=None):
+        cols = self.columns()
+        n = len(cols["open_time"])
+        end = n if end is None else min(end, n)
+        start = max(end - limit, 0)
+        return {col: arr[start:end] for col, arr in cols.items()}
+
+    def replay_window(self, limit, advance=True):
+        # 游標記錄已重播到第幾根；advance 時前進 REPLAY_STEP 根，播完回傳 None
+        cursor_file = self.path / "replay_cursor"
+        cursor = int(cursor_file.read_text()) if cursor_file.exists() else min(limit, len(self))
+        if cursor > len(self) or not len(self):
+            return None
+        if advance:
+            cursor_file.write_text(str(cursor + REPLAY_STEP))
+        return self.window(limit, end=cursor)
+
+
+class KlineRing:
+    """固定容量的 K 線環狀緩衝，底層是一個 float64 memmap 檔：由 kline_stream 接收器寫入，各模組跨行程讀取。
+
+    表頭為 [seq, 寫入位置, 筆數, 最後更新毫秒]，其後是 capacity × 6 欄（COLUMNS 順序）。
+    寫入前後各把 seq 加一（寫入中為奇數），讀取端 seq 前後不一致就重讀。
+    最新一格可能是尚未收盤的 K 線，同一 open time 的推播會覆寫它。
+    """
+
+    HEADER = 4
+
+    def __init__(self, symbol, interval="1m", root=STREAM_PATH, capacity=STREAM_RING_SIZE):
+        self.symbol = symbol
+        self.interval = interval
+        self.file = Path(root) / f"{symbol}_{interval}.ring"
+        self.capacity = capacity
+        self._map = None
+
+    def _open(self, writable=False):
+        if self._map is None or (writable and not self._map.flags.writeable):
+            if not self.file.exists():
+                if not writable:
+                    return None
+                self.file.parent.mkdir(parents=True, exist_ok=True)
+                np.zeros(self.HEADER + self.capacity * len(COLUMNS)).tofile(self.file)
+            self._map = np.memmap(self.file, dtype=np.float64, mode="r+" if writable else "r")
+            self.capacity = (len(self._map) - self.HEADER) // len(COLUMNS)
+        return self._map
+
+    def _rows(self, m):
+        return m[self.HEADER:].reshape(self.capacity, len(COLUMNS))
+
+    def reset(self, bars):
+        # 以本地 K 線庫最後 capacity 根重新填滿（啟動與斷線重連後）
+        m = self._open(writable=True)
+        data = np.column_stack([np.asarray(bars[col], dtype=np.float64) for col in COLUMNS])[-self.capacity:]
+        m[0] += 1
+        self._rows(m)[:len(data)] = data
+        m[1], m[2], m[3] = len(data) % self.capacity, len(data), time.time() * 1000
+        m[0] += 1
+
+    def last(self):
+        m = self._open()
+        if m is None or not m[2]:
+            return None
+        return tuple(self._rows(m)[(int(m[1]) - 1) % self.capacity])
+
+    def upsert(self, row):
+        # row 依 COLUMNS 順序；與最新一格同 open time 時覆寫，否則前進一格
+        m = self._open(writable=True)
+        rows = self._rows(m)
+        head, count = int(m[1]), int(m[2])
+        m[0] += 1
+        if count and rows[(head - 1) % self.capacity, 0] == row[0]:
+            rows[(head - 1) % self.capacity] = row
+        else:
+            rows[head] = row
+            m[1], m[2] = (head + 1) % self.capacity, min(count + 1, self.capacity)
+        m[3] = time.time() * 1000
+        m[0] += 1
+
+    def window(self, limit, now_ms=None):
+        # 最近 limit 根已收盤的 K 線；緩衝不存在、過期、根數不足或有缺口時回傳 None
+        m = self._open()
+        if m is None:
+            return None
+        for _ in range(RING_READ_RETRIES):
+            seq = m[0]
+            if seq % 2:
+                time.sleep(0.001)
+                continue
+            head, count, updated = int(m[1]), int(m[2]), float(m[3])
+            n = min(limit + 1, count)
+            data = self._rows(m)[(head - n + np.arange(n)) % self.capacity]
+            if m[0] == seq:
+                break
+        else:
+            return None
+        now_ms = time.time() * 1000 if now_ms is None else now_ms
+        if now_ms - updated > STREAM_STALE_SEC * 1000:
+            return None
+        step = INTERVAL_MS.get(self.interval, INTERVAL_MS["1m"])
+        data = data[data[:, 0] + step <= now_ms][-limit:]
+        if len(data) < limit or np.any(np.diff(data[:, 0]) != step):
+            return None
+        return {col: data[:, i].astype(dtype) for i, (col, dtype) in enumerate(COLUMNS.items())}
+
+
+def _store_lock(key):
+    with _locks_guard:
+        return _store_locks.setdefault(key, threading.Lock())
+
+
+def load_window(symbol, interval, limit, mode=KLINE_MODE, advance=True, http=None):
+    # 模擬器與進化引擎共用的取窗入口；同一輪只應由一個模組推進重播游標
+    # 同一 symbol / interval 的同步與取窗以鎖串行，避免多執行緒重複寫入
+    key = (symbol, interval)
+    with _store_lock(key):
+        store = KlineStore(symbol, interval)
+        if mode == "replay":
+            return store.replay_window(limit, advance=advance)
+        if mode == "stream" and not AS_OF:
+            bars = KlineRing(symbol, interval).window(limit)
+            if bars is not None:
+                return bars
+            print(f"[Kline Store] {symbol} {interval} 串流緩衝不可用，改以 REST 補抓")
+        if time.monotonic() - _last_sync.get(key, float("-inf")) >= SYNC_TTL_SEC and not store.is_current():
+            try:
+                added = store.sync(session=http or session)
+                _last_sync[key] = time.monotonic()
+                print(f"[Kline Store] {symbol} {interval} 新增 {added} 根，共 {len(store)} 根")
+            except requests.RequestException as e:
+                print(f"[Kline Store] 更新失敗，改用本地資料：{e}")
+        end = store.index_of(int(AS_OF)) if AS_OF else None
+        return store.window(limit, end=end)
+
+
+def prefetch(pairs=None):
+    # 預先同步本地 K 線庫（預設全部），給下一輪用：同步後 is_current() 成立的庫，下一輪取窗不必再打 API
+    synced = 0
+    for symbol, interval in (stores() if pairs is None else pairs):
+        with _store_lock((symbol, interval)):
+            store = KlineStore(symbol, interval)
+            if store.is_current():
+                continue
+            try:
+                store.sync(session=session)
+                _last_sync[(symbol, interval)] = time.monotonic()
+                synced += 1
+            except requests.RequestException as e:
+                print(f"[Kline Store] {symbol} {interval} 預先同步失敗：{e}")
+    return synced
+
+
+def stores(root=STORE_PATH):
+    # 列出本地已有的 (symbol, interval)
+    root = Path(root)
+    if not root.exists():
+        return []
+    return [tuple(p.name.rsplit("_", 1)) for p in sorted(root.iterdir()) if p.is_dir() and "_" in p.name]
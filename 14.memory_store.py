@@ -0,0 +1,294 @@
+import json
+import os
+import sqlite3
+
+# json：沿用單一 king_memory.json；sqlite：king_memory.db，清單欄位逐筆 append 並以 (kind, seq) 索引
+MEMORY_BACKEND = os.environ.get("KILLCORE_MEMORY_BACKEND", "json")
+MEMORY_DB = "king_memory.db"
+
+# 會無限成長的清單欄位，其餘欄位視為單值
+LIST_FIELDS = ("history", "evolution_trace", "drift_history", "intent_summary", "style_history")
+
+
+def open_memory_store(state, reset=False):
+    if MEMORY_BACKEND == "sqlite":
+        return SqliteMemoryStore(state.root / MEMORY_DB, legacy_json=state.path("memory"), reset=reset)
+    return JsonMemoryStore(state, reset=reset)
+
+
+class JsonMemoryStore:
+    """king_memory.json 的記憶介面，整份在 RoundState 內快取，flush 時寫回。"""
+
+    def __init__(self, state, reset=False):
+        self.state = state
+        self.data = {} if reset else state.load("memory", {})
+        if reset:
+            state.save("memory", self.data)
+
+    def _touch(self):
+        self.state.save("memory", self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+        self._touch()
+
+    def setdefault(self, key, default):
+        # 新補的預設值也要寫回；清單欄位回傳副本，與 SQLite 後端一樣只能經由 append / extend 修改
+        if key not in self.data:
+            self.data[key] = default
+            self._touch()
+        return list(self.data[key]) if key in LIST_FIELDS else self.data[key]
+
+    def append(self, kind, record):
+        self.data.setdefault(kind, []).append(record)
+        self._touch()
+
+    def extend(self, kind, records):
+        self.data.setdefault(kind, []).extend(records)
+        self._touch()
+
+    def count(self, kind):
+        return len(self.data.get(kind, []))
+
+    def head(self, kind, n):
+        return self.data.get(kind, [])[:n]
+
+    def tail(self, kind, n):
+        return self.data.get(kind, [])[-n:] if n > 0 else []
+
+    def all(self, kind):
+        return list(self.data.get(kind, []))
+
+    def replace(self, kind, records):
+        self.data[kind] = list(records)
+        self._touch()
+
+    def delete(self, kind, rids):
+        rids = set(rids)
+        items = self.data.get(kind, [])
+        kept = [r for r in items if r.get("rid") not in rids]
+        if len(kept) != len(items):
+            self.data[kind] = kept
+            self._touch()
+        return len(items) - len(kept)
+
+    def trim(self, kind, keep):
+        items = self.data.get(kind, [])
+        removed = max(len(items) - keep, 0)
+        if removed:
+            self.data[kind] = items[removed:]
+            self._touch()
+        return removed
+
+    def to_dict(self):
+        return self.data
+
+    # JSON 後端的寫入由 RoundState.flush 統一處理
+    def release(self):
+        pass
+
+    def rollback(self):
+        # RoundState.invalidate_clean 已把快取還原成模組開始前的內容（或丟棄回到檔案），重新取用
+        self.data = self.state.load("memory", {})
+
+    def commit(self):
+        pass
+
+
+class SqliteMemoryStore:
+    """同一份邏輯結構存於 SQLite：清單欄位每筆一列，單值欄位以 JSON 存放。
+
+    每個模組的修改包在 SAVEPOINT 內，模組失敗時 rollback() 只撤回該模組；
+    commit() 於本輪 flush 時一次提交。
+    """
+
+    def __init__(self, path, legacy_json=None, reset=False):
+        self.path = path
+        is_new = not path.exists()
+        # 排程器可能在不同執行緒執行各模組；同一時間只有一個宣告寫入記憶的模組，故允許跨執行緒使用
+        self.conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                kind TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                body TEXT NOT NULL,
+                rid INTEGER,
+                PRIMARY KEY (kind, seq)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS kinds (
+                kind TEXT PRIMARY KEY,
+                next_seq INTEGER NOT NULL,
+                count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS fields (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        # rid：紀錄自帶的穩定編號（history 由 memory_recorder 指派），供 delete() 以索引刪除
+        if "rid" not in [row[1] for row in self.conn.execute("PRAGMA table_info(records)")]:
+            self.conn.execute("ALTER TABLE records ADD COLUMN rid INTEGER")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS records_rid ON records (kind, rid)")
+        self._fields = None
+        self._in_stage = False
+        if reset:
+            self._begin()
+            self.conn.execute("DELETE FROM records")
+            self.conn.execute("DELETE FROM kinds")
+            self.conn.execute("DELETE FROM fields")
+        elif is_new and legacy_json is not None and legacy_json.exists():
+            self._import(json.loads(legacy_json.read_text()))
+
+    def _begin(self):
+        # 外層 BEGIN 讓 RELEASE 不會直接提交
+        if not self._in_stage:
+            if not self.conn.in_transaction:
+                self.conn.execute("BEGIN")
+            self.conn.execute("SAVEPOINT stage")
+            self._in_stage = True
+
+    def _import(self, data):
+        # 首次啟用時匯入舊的 king_memory.json
+        self._begin()
+        for key, value in data.items():
+            if key in LIST_FIELDS and isinstance(value, list):
+                self.extend(key, value)
+            else:
+                self.set(key, value)
+        self.release()
+        self.commit()
+
+    def _load_fields(self):
+        if self._fields is None:
+            self._fields = {k: json.loads(v) for k, v in self.conn.execute("SELECT key, value FROM fields")}
+        return self._fields
+
+    def get(self, key, default=None):
+        return self._load_fields().get(key, default)
+
+    def set(self, key, value):
+        self._begin()
+        self._load_fields()[key] = value
+        self.conn.execute(
+            "INSERT INTO fields (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+
+    def setdefault(self, key, default):
+        if key in LIST_FIELDS:
+            # 清單欄位存於 records，沒有資料即為空清單；預設值有內容時補寫進去
+            if not self.count(key) and default:
+                self.extend(key, default)
+            return self.all(key)
+        fields = self._load_fields()
+        if key not in fields:
+            self.set(key, default)
+        return fields[key]
+
+    def _kind(self, kind):
+        row = self.conn.execute("SELECT next_seq, count FROM kinds WHERE kind = ?", (kind,)).fetchone()
+        return row if row else (0, 0)
+
+    def append(self, kind, record):
+        self.extend(kind, [record])
+
+    def extend(self, kind, records):
+        records = list(records)
+        if not records:
+            return
+        self._begin()
+        next_seq, count = self._kind(kind)
+        self.conn.executemany(
+            "INSERT INTO records (kind, seq, body, rid) VALUES (?, ?, ?, ?)",
+            [(kind, next_seq + i, json.dumps(r, ensure_ascii=False), r.get("rid") if isinstance(r, dict) else None)
+             for i, r in enumerate(records)],
+        )
+        self.conn.execute(
+            "INSERT INTO kinds (kind, next_seq, count) VALUES (?, ?, ?) "
+            "ON CONFLICT(kind) DO UPDATE SET next_seq = excluded.next_seq, count = excluded.count",
+            (kind, next_seq + len(records), count + len(records)),
+        )
+
+    def count(self, kind):
+        return self._kind(kind)[1]
+
+    def head(self, kind, n):
+        rows = self.conn.execute(
+            "SELECT body FROM records WHERE kind = ? ORDER BY seq LIMIT ?", (kind, n)
+        ).fetchall()
+        return [json.loads(b) for (b,) in rows]
+
+    def tail(self, kind, n):
+        if n <= 0:
+            return []
+        rows = self.conn.execute(
+            "SELECT body FROM records WHERE kind = ? ORDER BY seq DESC LIMIT ?", (kind, n)
+        ).fetchall()
+        return [json.loads(b) for (b,) in reversed(rows)]
+
+    def all(self, kind):
+        rows = self.conn.execute("SELECT body FROM records WHERE kind = ? ORDER BY seq", (kind,))
+        return [json.loads(b) for (b,) in rows]
+
+    def replace(self, kind, records):
+        self._begin()
+        self.conn.execute("DELETE FROM records WHERE kind = ?", (kind,))
+        self.conn.execute("DELETE FROM kinds WHERE kind = ?", (kind,))
+        self.extend(kind, records)
+
+    def delete(self, kind, rids):
+        # 依 rid 刪除，回傳實際刪除筆數
+        rids = list(rids)
+        if not rids:
+            return 0
+        self._begin()
+        before = self.conn.total_changes
+        self.conn.executemany("DELETE FROM records WHERE kind = ? AND rid = ?", [(kind, r) for r in rids])
+        removed = self.conn.total_changes - before
+        if removed:
+            self.conn.execute("UPDATE kinds SET count = count - ? WHERE kind = ?", (removed, kind))
+        return removed
+
+    def trim(self, kind, keep):
+        # 只保留最新 keep 筆，回傳刪除筆數
+        next_seq, count = self._kind(kind)
+        removed = max(count - keep, 0)
+        if not removed:
+            return 0
+        self._begin()
+        if keep > 0:
+            cutoff = self.conn.execute(
+                "SELECT seq FROM records WHERE kind = ? ORDER BY seq DESC LIMIT 1 OFFSET ?", (kind, keep - 1)
+            ).fetchone()[0]
+            self.conn.execute("DELETE FROM records WHERE kind = ? AND seq < ?", (kind, cutoff))
+        else:
+            self.conn.execute("DELETE FROM records WHERE kind = ?", (kind,))
+        self.conn.execute("UPDATE kinds SET count = ? WHERE kind = ?", (keep, kind))
+        return removed
+
+    def to_dict(self):
+        data = dict(self._load_fields())
+        for kind in LIST_FIELDS:
+            data[kind] = self.all(kind)
+        return data
+
+    def release(self):
+        if self._in_stage:
+            self.conn.execute("RELEASE stage")
+            self._in_stage = False
+
+    def rollback(self):
+        if self._in_stage:
+            self.conn.execute("ROLLBACK TO stage")
+            self.conn.execute("RELEASE stage")
+            self._in_stage = False
+            self._fields = None
+
+    def commit(self):
+        self.release()
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
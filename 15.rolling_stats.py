@@ -0,0 +1,95 @@
+import math
+
+# 同時維護的視窗長度（輪數）與統計欄位
+WINDOWS = (5, 20, 100, 1000)
+METRICS = {
+    "return_pct": 0,
+    "drawdown": 100,
+    "win_rate": 0,
+}
+RING_SIZE = max(WINDOWS)
+
+
+def empty_stats():
+    return {
+        "t": 0,
+        "metrics": {
+            m: {
+                "ring": [],
+                "total": {"n": 0, "mean": 0.0, "m2": 0.0},
+                "windows": {str(w): {"n": 0, "mean": 0.0, "m2": 0.0, "sum_ty": 0.0} for w in WINDOWS},
+            }
+            for m in METRICS
+        },
+    }
+
+
+def _value(record, metric):
+    v = record.get(metric)
+    return float(METRICS[metric] if v is None else v)
+
+
+def update_stats(stats, record):
+    # 每輪 O(len(WINDOWS))：Welford 累計、滑動視窗的 Welford 加減與迴歸用的 Σt·y
+    t = stats["t"]
+    for metric, ms in stats["metrics"].items():
+        x = _value(record, metric)
+        ring = ms["ring"]
+
+        total = ms["total"]
+        total["n"] += 1
+        delta = x - total["mean"]
+        total["mean"] += delta / total["n"]
+        total["m2"] += delta * (x - total["mean"])
+
+        for w, ws in ms["windows"].items():
+            w = int(w)
+            if ws["n"] < w:
+                ws["n"] += 1
+                delta = x - ws["mean"]
+                ws["mean"] += delta / ws["n"]
+                ws["m2"] += delta * (x - ws["mean"])
+            else:
+                old = ring[(t - w) % RING_SIZE]
+                old_mean = ws["mean"]
+                ws["mean"] += (x - old) / w
+                ws["m2"] = max(ws["m2"] + (x - old) * (x - ws["mean"] + old - old_mean), 0.0)
+                ws["sum_ty"] -= (t - w) * old
+            ws["sum_ty"] += t * x
+
+        if len(ring) < RING_SIZE:
+            ring.append(x)
+        else:
+            ring[t % RING_SIZE] = x
+    stats["t"] = t + 1
+    return stats
+
+
+def build_stats(history):
+    stats = empty_stats()
+    for record in history[-RING_SIZE:]:
+        update_stats(stats, record)
+    return stats
+
+
+def window_summary(stats, metric, window):
+    # O(1) 查詢單一視窗：平均、樣本標準差、最小平方斜率、首尾值
+    ms = stats["metrics"][metric]
+    ws = ms["windows"][str(window)]
+    n, t = ws["n"], stats["t"]
+    if n == 0:
+        return {"n": 0, "mean": None, "std": 0, "slope": 0, "first": None, "last": None}
+    first_t = t - n
+    sum_t = n * (first_t + t - 1) / 2
+    sum_tt = ((t - 1) * t * (2 * t - 1) - (first_t - 1) * first_t * (2 * first_t - 1)) / 6
+    sum_y = ws["mean"] * n
+    denom = n * sum_tt - sum_t * sum_t
+    slope = (n * ws["sum_ty"] - sum_t * sum_y) / denom if n >= 2 and denom else 0
+    return {
+        "n": n,
+        "mean": ws["mean"],
+        "std": math.sqrt(ws["m2"] / (n - 1)) if n >= 2 else 0,
+        "slope": slope,
+        "first": ms["ring"][first_t % RING_SIZE],
+        "last": ms["ring"][(t - 1) % RING_SIZE],
+    }
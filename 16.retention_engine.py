@@ -0,0 +1,134 @@
+import hashlib
+import heapq
+import re
+
+# 記憶保留引擎：以 (is_protected, score, -rid) 為鍵的最小堆維持至多 capacity 筆 history，
+# 分數只在插入時計算一次，血統保護集合隨新的進化節點（genome_cache 血統索引）逐筆更新。
+# 狀態為純 dict，存放於 king_memory 的 "retention" 欄位；集合一律存成 {鍵: 代數} 的 dict，
+# 載入後直接查詢，不必每筆重建 set。
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def empty_retention():
+    return {
+        "heap": [],
+        "live": {},
+        "by_gen": {},
+        "protected": {},
+        "seen_styles": {},
+        "seen_intents": {},
+        "trace_cursor": 0,
+        "history_cursor": -1,
+        "tiers": {"S": 0, "A": 0, "B": 0},
+    }
+
+
+def intent_key(intent):
+    # 意圖去掉數字後的樣板雜湊：族群進化的意圖含 fitness 數值，逐字比對幾乎每輪都是新意圖
+    if isinstance(intent, str):
+        intent = [intent]
+    template = "\n".join(_NUMBER.sub("#", str(i)) for i in intent)
+    return hashlib.sha1(template.encode()).hexdigest()[:16]
+
+
+def tier_of(score):
+    if score >= 4:
+        return "S"
+    if score == 3:
+        return "A"
+    return "B"
+
+
+def observe_traces(ret, traces):
+    # traces 為含 generation / style_profile / intent 的進化節點；
+    # 每種風格、每種意圖樣板第一次出現的代數列入保護，回傳新保護的代數
+    new_gens = []
+    for trace in traces:
+        style = trace.get("style_profile")
+        intent = trace.get("intent") or []
+        gen = trace.get("generation")
+        first = False
+        if style and style not in ret["seen_styles"]:
+            ret["seen_styles"][style] = gen
+            first = True
+        if intent:
+            key = intent_key(intent)
+            if key not in ret["seen_intents"]:
+                ret["seen_intents"][key] = gen
+                first = True
+        if first and str(gen) not in ret["protected"]:
+            ret["protected"][str(gen)] = 1
+            new_gens.append(gen)
+            _protect(ret, gen)
+    return new_gens
+
+
+def _protect(ret, gen):
+    # 已在堆中的同代紀錄改為受保護：推入新鍵，舊鍵於彈出時視為過期丟棄
+    for rid in ret["by_gen"].get(str(gen), []):
+        entry = ret["live"][str(rid)]
+        if not entry[0]:
+            entry[0] = 1
+            heapq.heappush(ret["heap"], [1, entry[1], -rid, rid])
+
+
+def insert(ret, record, score, capacity):
+    # 插入一筆並回傳被淘汰的 [(rid, score), ...]，每筆 O(log K)
+    rid = record["rid"]
+    gen = record.get("generation", rid)
+    is_protected = int(str(gen) in ret["protected"] or score >= 4)
+    ret["live"][str(rid)] = [is_protected, score, gen]
+    ret["by_gen"].setdefault(str(gen), []).append(rid)
+    ret["tiers"][tier_of(score)] += 1
+    heapq.heappush(ret["heap"], [is_protected, score, -rid, rid])
+    ret["history_cursor"] = max(ret["history_cursor"], rid)
+
+    evicted = []
+    while len(ret["live"]) > capacity:
+        prot, s, _, victim = heapq.heappop(ret["heap"])
+        entry = ret["live"].get(str(victim))
+        if entry is None or entry[0] != prot:
+            continue
+        _drop(ret, victim)
+        evicted.append((victim, s))
+    _compact(ret)
+    return evicted
+
+
+def forget(ret, rids):
+    # 外部（如 memory_recorder 截斷）已移除的紀錄
+    for rid in rids:
+        if str(rid) in ret["live"]:
+            _drop(ret, rid)
+    _compact(ret)
+
+
+def prune_protected(ret):
+    # 保護的代數已沒有任何保留中的紀錄時移除：最後一筆被淘汰的代數，
+    # 以及早於最舊保留代數、之後也不會再有紀錄的代數（代數單調遞增）
+    live_gens = [int(g) for g in ret["by_gen"] if g.lstrip("-").isdigit()]
+    oldest = min(live_gens, default=None)
+    stale = [g for g in ret["protected"]
+             if g not in ret["by_gen"] and (oldest is None or not g.lstrip("-").isdigit() or int(g) < oldest)]
+    for g in stale:
+        del ret["protected"][g]
+    return len(stale)
+
+
+def _drop(ret, rid):
+    prot, score, gen = ret["live"].pop(str(rid))
+    ret["tiers"][tier_of(score)] -= 1
+    same_gen = ret["by_gen"].get(str(gen), [])
+    if rid in same_gen:
+        same_gen.remove(rid)
+    if not same_gen:
+        ret["by_gen"].pop(str(gen), None)
+        ret["protected"].pop(str(gen), None)
+
+
+def _compact(ret):
+    # 過期鍵超過一半時重建堆，讓堆大小維持 O(K)
+    if len(ret["heap"]) > 2 * len(ret["live"]) + 16:
+        ret["heap"] = [[p, s, -int(rid), int(rid)] for rid, (p, s, _) in ret["live"].items()]
+        heapq.heapify(ret["heap"])
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import sys
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+ARCHIVE_PATH = Path("~/Killcore/archives").expanduser()
+COMPRESS_LEVEL = 6
+# 文字檔以內容決定的行邊界切塊（平均約 64 行），前後輪相同的塊只存一次
+LINE_CHUNK_MASK = 0x3F
+MAX_CHUNK_BYTES = 256 * 1024
+# 二進位檔（如 king_memory.db）以固定大小切塊，對齊 SQLite 頁面
+BINARY_CHUNK_BYTES = 64 * 1024
+GC_INTERVAL = 50
+
+
+def _atomic_write(path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def chunk_text(data):
+    chunks, start, pos = [], 0, 0
+    while pos < len(data):
+        end = data.find(b"\n", pos)
+        end = len(data) if end < 0 else end + 1
+        line = data[pos:end]
+        pos = end
+        if (zlib.crc32(line) & LINE_CHUNK_MASK) == 0 or pos - start >= MAX_CHUNK_BYTES:
+            chunks.append(data[start:pos])
+            start = pos
+    if start < len(data):
+        chunks.append(data[start:])
+    return chunks
+
+
+def chunk_binary(data):
+    return [data[i:i + BINARY_CHUNK_BYTES] for i in range(0, len(data), BINARY_CHUNK_BYTES)]
+
+
+class RoundArchive:
+    """以內容雜湊定址的輪次封存：blobs/ 存壓縮後的塊，manifests/ 每輪一份小清單，counter 記錄最新輪次。"""
+
+    def __init__(self, root=ARCHIVE_PATH):
+        self.root = Path(root)
+        self.blobs = self.root / "blobs"
+        self.manifests = self.root / "manifests"
+        self.counter = self.root / "counter"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.manifests.mkdir(parents=True, exist_ok=True)
+
+    def last_round(self):
+        return int(self.counter.read_text()) if self.counter.exists() else 0
+
+    def _blob_path(self, digest):
+        return self.blobs / digest[:2] / digest[2:]
+
+    def put_blob(self, data):
+        # 回傳 (雜湊, 新寫入的壓縮位元組數)；已存在則不重寫
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if path.exists():
+            return digest, 0
+        path.parent.mkdir(exist_ok=True)
+        packed = zlib.compress(data, COMPRESS_LEVEL)
+        _atomic_write(path, packed)
+        return digest, len(packed)
+
+    def get_blob(self, digest):
+        return zlib.decompress(self._blob_path(digest).read_bytes())
+
+    def manifest_path(self, round_num):
+        return self.manifests / f"round_{round_num:06d}.json"
+
+    def archive(self, files):
+        # files：{封存名稱: 來源路徑}，回傳 (輪次, manifest)
+        round_num = self.last_round() + 1
+        manifest = {"round": round_num, "ts": datetime.now().isoformat(), "files": {}, "new_bytes": 0}
+        for name, src in files.items():
+            src = Path(src)
+            if not src.exists():
+                continue
+            data = src.read_bytes()
+            chunks = chunk_text(data) if src.suffix == ".json" else chunk_binary(data)
+            digests = []
+            for c in chunks:
+                digest, written = self.put_blob(c)
+                digests.append(digest)
+                manifest["new_bytes"] += written
+            manifest["files"][name] = {
+                "size": len(data),
+                "sha256": hashlib.sha256(data).hexdigest(),
+                "chunks": digests,
+            }
+        _atomic_write(self.manifest_path(round_num), json.dumps(manifest, ensure_ascii=False).encode())
+        _atomic_write(self.counter, str(round_num).encode())
+        return round_num, manifest
+
+    def load_manifest(self, round_num):
+        return json.loads(self.manifest_path(round_num).read_text())
+
+    def read_file(self, round_num, name):
+        entry = self.load_manifest(round_num)["files"][name]
+        data = b"".join(self.get_blob(d) for d in entry["chunks"])
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise ValueError(f"round {round_num} 的 {name} 校驗失敗")
+        return data
+
+    def restore(self, round_num, dest):
+        dest = Path(dest)
+        dest.mkdir(parents=True, exist_ok=True)
+        restored = []
+        for name in self.load_manifest(round_num)["files"]:
+            out = dest / name
+            out.write_bytes(self.read_file(round_num, name))
+            restored.append(out)
+        return restored
+
+    def prune(self, keep):
+        # 只保留最近 keep 輪的 manifest；每 GC_INTERVAL 輪做一次標記清除回收無人引用的 blob
+        last = self.last_round()
+        for round_num in range(max(last - keep, 0), 0, -1):
+            path = self.manifest_path(round_num)
+            if not path.exists():
+                break
+            path.unlink()
+        if last and last % GC_INTERVAL == 0:
+            return self.gc()
+        return 0
+
+    def gc(self):
+        live = set()
+        for path in self.manifests.glob("round_*.json"):
+            for entry in json.loads(path.read_text())["files"].values():
+                live.update(entry["chunks"])
+        removed = 0
+        for sub in self.blobs.iterdir():
+            for blob in sub.iterdir():
+                if sub.name + blob.name not in live:
+                    blob.unlink()
+                    removed += 1
+        return removed
+
+
+if __name__ == "__main__":
+    # 用法：python3 round_archive.py restore <輪次> [目的資料夾]
+    if len(sys.argv) >= 3 and sys.argv[1] == "restore":
+        round_num = int(sys.argv[2])
+        dest = sys.argv[3] if len(sys.argv) > 3 else f"restored_round_{round_num:06d}"
+        for path in RoundArchive().restore(round_num, dest):
+            print(f"[Archive] 已還原 {path}")
+    else:
+        archive = RoundArchive()
+        print(f"[Archive] 最新輪次：{archive.last_round()}")
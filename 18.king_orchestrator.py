@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+KILLCORE_PATH = Path("~/Killcore").expanduser()
+# kings.json：[{"id": "shib_a", "symbol": "SHIBUSDT"}, {"id": "doge_a", "symbol": "DOGEUSDT"}, ...]
+# symbol 省略時該 king 照舊由 symbol_selector 選幣
+KINGS_FILE = KILLCORE_PATH / "kings.json"
+KINGS_PATH = KILLCORE_PATH / "kings"
+
+# 同時執行的 king 數上限、全體共用的 API 請求速率（次/秒）與連線池大小
+MAX_CONCURRENCY = int(os.environ.get("KILLCORE_MAX_CONCURRENCY", "4"))
+RATE_LIMIT_PER_SEC = float(os.environ.get("KILLCORE_RATE_LIMIT", "10"))
+RATE_BURST = 20
+POOL_SIZE = 32
+ROUND_INTERVAL_SEC = 60
+
+
+class TokenBucket:
+    """執行緒安全的令牌桶；令牌不足時先預約再睡，讓等待者依序放行。"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.granted = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            self.granted += 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class PooledSession(requests.Session):
+    """所有 king 共用的 HTTP session：單一連線池，每個請求先經過令牌桶。"""
+
+    def __init__(self, rate=RATE_LIMIT_PER_SEC, burst=RATE_BURST, pool_size=POOL_SIZE):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.bucket = TokenBucket(rate, burst)
+
+    def request(self, *args, **kwargs):
+        self.bucket.acquire()
+        return super().request(*args, **kwargs)
+
+
+def load_kings():
+    if not KINGS_FILE.exists():
+        return []
+    return [k for k in json.loads(KINGS_FILE.read_text()) if k.get("id")]
+
+
+def run_king_round(king, session=None, output=None):
+    # 在工作執行緒內跑完一個 king 的整輪：各自的 RoundState 命名空間與封存
+    # 共用 session 經 RoundState 傳給各模組；本輪輸出先進 output 的執行緒緩衝，跑完整段印出
+    from analytics_store import export as export_analytics
+    from historical_archiver import ARCHIVE_FILES, modules, run_inprocess
+    from round_archive import RoundArchive
+    from round_state import RoundState
+
+    root = KINGS_PATH / king["id"]
+    root.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    state = RoundState(root, symbol=king.get("symbol"), session=session)
+    if output is not None:
+        output.begin()
+    try:
+        print(f"\n[Orchestrator] ===== {king['id']} =====")
+        for module in modules:
+            module_path = KILLCORE_PATH / module
+            if module_path.exists():
+                run_inprocess(module_path, state)
+        state.flush()
+        round_num, manifest = RoundArchive(root / "archives").archive(
+            {Path(f).name: root / f for f in ARCHIVE_FILES})
+        export_analytics(root, state.memory())
+    finally:
+        if output is not None:
+            output.end()
+    perf = state.performance({})
+    return {
+        "id": king["id"],
+        "symbol": perf.get("symbol", king.get("symbol")),
+        "return_pct": perf.get("return_pct"),
+        "drawdown": perf.get("drawdown"),
+        "round": round_num,
+        "secs": round(time.time() - start, 2),
+    }
+
+
+async def run_all(kings, session=None, output=None, concurrency=MAX_CONCURRENCY):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(king):
+        async with sem:
+            try:
+                return await asyncio.to_thread(run_king_round, king, session, output)
+            except Exception as e:
+                print(f"[Orchestrator] {king['id']} 本輪失敗：{e}")
+                return {"id": king["id"], "error": str(e)}
+
+    return await asyncio.gather(*(bounded(k) for k in kings))
+
+
+def preload_modules():
+    # 先在主執行緒匯入各模組，避免多個執行緒同時第一次 import
+    import importlib
+    from historical_archiver import modules
+    for module in dict.fromkeys(modules):
+        if (KILLCORE_PATH / module).exists():
+            importlib.import_module(Path(module).stem)
+
+
+async def main(loop_forever=False):
+    sys.path.insert(0, str(KILLCORE_PATH))
+    from stage_graph import StageOutput
+    # 各 king 的 HTTP 呼叫走同一個連線池與限速器；輸出依 king 分段，不與其他 king 交錯
+    shared = PooledSession()
+    output = StageOutput(sys.stdout)
+    preload_modules()
+    while True:
+        kings = load_kings()
+        if not kings:
+            print(f"[Orchestrator] 找不到 king 設定：{KINGS_FILE}")
+            return
+        start, requests_before = time.time(), shared.bucket.granted
+        print(f"\n[Orchestrator] 本輪 {len(kings)} 個 king，並行上限 {MAX_CONCURRENCY}")
+        sys.stdout = output
+        try:
+            results = await run_all(kings, shared, output)
+        finally:
+            sys.stdout = output.stream
+        print(f"\n[Orchestrator] 本輪完成，耗時 {round(time.time() - start, 2)} 秒，API 請求 {shared.bucket.granted - requests_before} 次")
+        for r in results:
+            if "error" in r:
+                print(f" - {r['id']:<16} 失敗：{r['error']}")
+            else:
+                print(f" - {r['id']:<16} {str(r['symbol']):<10} 報酬 {r['return_pct']}% ｜ 回撤 {r['drawdown']}% ｜ 第 {r['round']} 輪 ｜ {r['secs']} 秒")
+        if not loop_forever:
+            return
+        await asyncio.sleep(max(ROUND_INTERVAL_SEC - (time.time() - start), 0))
+
+
+if __name__ == "__main__":
+    # 用法：python3 king_orchestrator.py [loop]
+    try:
+        asyncio.run(main(loop_forever="loop" in sys.argv[1:]))
+    except KeyboardInterrupt:
+        print("\n[Orchestrator] 偵測到中斷，結束")
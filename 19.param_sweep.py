@@ -0,0 +1,296 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from backtest_engine import backtest_ma_crossover, fitness
+
+SWEEP_PATH = Path("~/Killcore/sweeps").expanduser()
+SWEEP_DB = "sweep.db"
+KLINE_INTERVAL = "1m"
+# 取最近 WINDOW_BARS × FOLDS 根，切成 FOLDS 段互不重疊的連續視窗（同一序列的巢狀尾段不算多個視窗）
+WINDOW_BARS = 1000
+FOLDS = 3
+SYMBOLS = ["DOGEUSDT", "SHIBUSDT"]
+GRID_STEPS = 5
+SAMPLES = 2000
+FEE_RATE = 0.001
+SLIPPAGE = 0.0015
+COMMIT_EVERY = 200
+# 搜尋範圍：以 core_generator 四種風格預設的最小／最大值再各往外擴一半
+RANGE_STRETCH = 0.5
+RISK_RANGE = (0.05, 0.2)
+PARAMS = ("ma_fast", "ma_slow", "sl_pct", "tp_pct")
+
+_worker_bars = None
+
+
+def search_space():
+    from core_generator import STYLE_PRESETS
+    space = {}
+    for p in PARAMS:
+        values = [preset[p] for preset in STYLE_PRESETS.values()]
+        space[p] = (min(values) * (1 - RANGE_STRETCH), max(values) * (1 + RANGE_STRETCH))
+    space["risk_tolerance"] = RISK_RANGE
+    return space
+
+
+def _normalize(point):
+    # 均線取整數並確保 fast < slow；百分比與風險容忍度取固定小數位，讓同一組參數有唯一鍵
+    ma_slow = max(int(round(point["ma_slow"])), 3)
+    ma_fast = min(max(int(round(point["ma_fast"])), 2), ma_slow - 1)
+    return {
+        "ma_fast": ma_fast,
+        "ma_slow": ma_slow,
+        "sl_pct": round(float(point["sl_pct"]), 2),
+        "tp_pct": round(float(point["tp_pct"]), 2),
+        "risk_tolerance": round(float(point["risk_tolerance"]), 3),
+    }
+
+
+def sample_configs(method, space, samples=SAMPLES, steps=GRID_STEPS, seed=0):
+    # grid：每維 steps 個等距點；random：均勻抽樣；lhs：拉丁超立方（每維各分層抽一次）
+    dims = list(space)
+    lo = np.array([space[d][0] for d in dims])
+    hi = np.array([space[d][1] for d in dims])
+    if method == "grid":
+        axes = [np.linspace(0, 1, steps)] * len(dims)
+        unit = np.array(list(itertools.product(*axes)))
+    else:
+        rng = np.random.default_rng(seed)
+        if method == "random":
+            unit = rng.random((samples, len(dims)))
+        elif method == "lhs":
+            strata = np.stack([rng.permutation(samples) for _ in dims], axis=1)
+            unit = (strata + rng.random((samples, len(dims)))) / samples
+        else:
+            raise ValueError(f"未知的掃描方式：{method}")
+    points = lo + unit * (hi - lo)
+    configs = {}
+    for row in points:
+        c = _normalize(dict(zip(dims, row)))
+        configs[tuple(c.values())] = c
+    return list(configs.values())
+
+
+class SweepResults:
+    """掃描結果表（SQLite）：每組 (symbol, interval, 資料快照, 視窗, 參數, 風險容忍度) 一列，已存在者續跑時略過。
+
+    snapshot 為掃描所用資料最後一根的 open time：K 線更新後是新的快照，舊結果不再被續跑略過，也不混入 best()。
+    """
+
+    def __init__(self, path=SWEEP_PATH / SWEEP_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                symbol TEXT, interval TEXT, snapshot INTEGER, window INTEGER,
+                window_start INTEGER, window_end INTEGER,
+                ma_fast INTEGER, ma_slow INTEGER, sl_pct REAL, tp_pct REAL, risk_tolerance REAL,
+                return_pct REAL, drawdown REAL, sharpe REAL, win_rate REAL, trade_count INTEGER,
+                fitness REAL, feasible INTEGER, ts REAL,
+                PRIMARY KEY (symbol, interval, snapshot, window_start, window_end,
+                             ma_fast, ma_slow, sl_pct, tp_pct, risk_tolerance)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def done_keys(self, symbol, interval, snapshot, window_start, window_end):
+        rows = self.conn.execute(
+            "SELECT ma_fast, ma_slow, sl_pct, tp_pct, risk_tolerance FROM results "
+            "WHERE symbol = ? AND interval = ? AND snapshot = ? AND window_start = ? AND window_end = ?",
+            (symbol, interval, snapshot, window_start, window_end))
+        return set(rows)
+
+    def add(self, rows):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO results VALUES "
+            "(:symbol, :interval, :snapshot, :window, :window_start, :window_end, "
+            ":ma_fast, :ma_slow, :sl_pct, :tp_pct, :risk_tolerance, "
+            ":return_pct, :drawdown, :sharpe, :win_rate, :trade_count, :fitness, :feasible, :ts)",
+            rows)
+
+    def commit(self):
+        self.conn.commit()
+
+    def best(self, symbol, interval=KLINE_INTERVAL, limit=1):
+        # 只看最新的資料快照：跨該快照各視窗平均適應度，取每個視窗都有結果且回撤都在風險容忍度內的參數組
+        snapshot, windows = self.conn.execute(
+            "SELECT snapshot, COUNT(DISTINCT window_start) FROM results WHERE symbol = ? AND interval = ? "
+            "AND snapshot = (SELECT MAX(snapshot) FROM results WHERE symbol = ? AND interval = ?)",
+            (symbol, interval, symbol, interval)).fetchone()
+        if not windows:
+            return []
+        rows = self.conn.execute("""
+            SELECT ma_fast, ma_slow, sl_pct, tp_pct, risk_tolerance,
+                   AVG(fitness), AVG(return_pct), MAX(drawdown), COUNT(*)
+            FROM results WHERE symbol = ? AND interval = ? AND snapshot = ?
+            GROUP BY ma_fast, ma_slow, sl_pct, tp_pct, risk_tolerance
+            HAVING COUNT(*) = ? AND MIN(feasible) = 1
+            ORDER BY AVG(fitness) DESC LIMIT ?
+        """, (symbol, interval, snapshot, windows, limit)).fetchall()
+        return [{
+            "parameters": {"ma_fast": r[0], "ma_slow": r[1], "sl_pct": r[2], "tp_pct": r[3]},
+            "risk_tolerance": r[4],
+            "fitness": round(r[5], 4),
+            "return_pct": round(r[6], 4),
+            "max_drawdown": round(r[7], 4),
+            "windows": r[8],
+            "snapshot": snapshot,
+        } for r in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def best_config(symbol, interval=KLINE_INTERVAL, path=SWEEP_PATH / SWEEP_DB):
+    # 給 core_generator 用：沒有掃描結果時回傳 None
+    if not Path(path).exists():
+        return None
+    results = SweepResults(path)
+    try:
+        top = results.best(symbol, interval)
+    finally:
+        results.close()
+    return top[0] if top else None
+
+
+def _init_worker(spec):
+    global _worker_bars
+    from shared_bars import attach
+    _worker_bars = attach(spec)
+
+
+def evaluate_group(symbol, window, params, risks):
+    # 同一組參數只回測一次；風險容忍度作為回撤上限，逐一判定是否可行。window 為 folds() 的一段
+    bars = _worker_bars[symbol]
+    span = slice(window["lo"], window["hi"])
+    bt = backtest_ma_crossover(
+        bars["open"][span], bars["high"][span], bars["low"][span], bars["close"][span],
+        params["ma_fast"], params["ma_slow"], params["sl_pct"], params["tp_pct"],
+        fee_rate=FEE_RATE, slippage=SLIPPAGE,
+    )
+    metrics = {k: round(float(bt[k]), 4) for k in ("return_pct", "drawdown", "sharpe", "win_rate")}
+    score = fitness(bt)
+    return [dict(params, **metrics, risk_tolerance=r, trade_count=bt["trade_count"], fitness=score,
+                 feasible=int(bt["drawdown"] <= r * 100), snapshot=window["snapshot"], window=window["index"],
+                 window_start=window["start"], window_end=window["end"])
+            for r in risks]
+
+
+def folds(open_time, window_bars=WINDOW_BARS, count=FOLDS):
+    # 由新到舊切出至多 count 段互不重疊的 window_bars 根視窗；index 0 為最近一段
+    n = len(open_time)
+    snapshot = int(open_time[-1])
+    out = []
+    for i in range(min(count, n // window_bars)):
+        hi = n - i * window_bars
+        lo = hi - window_bars
+        out.append({"index": i, "lo": lo, "hi": hi, "snapshot": snapshot,
+                    "start": int(open_time[lo]), "end": int(open_time[hi - 1])})
+    return out
+
+
+def load_bars(symbols, interval, size):
+    from kline_store import load_window
+    bars = {}
+    for symbol in symbols:
+        window = load_window(symbol, interval, size, advance=False)
+        if window is None or len(window["close"]) < 5:
+            print(f"[Sweep] {symbol} 無足夠 K 線，略過")
+            continue
+        bars[symbol] = {k: np.ascontiguousarray(window[k]) for k in ("open_time", "open", "high", "low", "close")}
+    return bars
+
+
+def run_sweep(method, symbols=SYMBOLS, window_bars=WINDOW_BARS, fold_count=FOLDS, interval=KLINE_INTERVAL,
+              samples=SAMPLES, steps=GRID_STEPS, seed=0, workers=None, path=SWEEP_PATH / SWEEP_DB):
+    configs = sample_configs(method, search_space(), samples, steps, seed)
+    bars = load_bars(symbols, interval, window_bars * fold_count)
+    results = SweepResults(path)
+
+    # 依 (symbol, 視窗, 參數) 分組成任務；同一資料快照中已完成的 (參數, 風險) 組合續跑時略過
+    tasks = []
+    windows = []
+    for symbol, b in bars.items():
+        symbol_folds = folds(b["open_time"], window_bars, fold_count)
+        if len(symbol_folds) < fold_count:
+            print(f"[Sweep] {symbol} 只有 {len(b['close'])} 根 K 線，只切出 {len(symbol_folds)} 段 {window_bars} 根視窗")
+        windows.extend(symbol_folds)
+        for window in symbol_folds:
+            done = results.done_keys(symbol, interval, window["snapshot"], window["start"], window["end"])
+            groups = {}
+            for c in configs:
+                if tuple(c.values()) in done:
+                    continue
+                params = {k: c[k] for k in PARAMS}
+                groups.setdefault(tuple(params.values()), (params, []))[1].append(c["risk_tolerance"])
+            tasks += [(symbol, window, params, risks) for params, risks in groups.values()]
+
+    total = sum(len(t[3]) for t in tasks)
+    print(f"[Sweep] {method}：{len(configs)} 組參數 × {len(bars)} 幣種，共 {len(windows)} 段視窗，待跑 {total} 列")
+    if not tasks:
+        results.close()
+        return 0
+
+    start, written, pending = time.time(), 0, []
+    workers = workers or os.cpu_count() or 1
+    # 各幣種 K 線一次放進共享記憶體，worker 以名稱掛上視圖，不再各自收一份副本
+    # forkserver：core_generator 在編排器的執行緒中呼叫時，不 fork 多執行緒的主行程
+    from shared_bars import SharedBars
+    with SharedBars(bars) as shared, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"),
+                                initializer=_init_worker, initargs=(shared.spec,)) as pool:
+        futures = {pool.submit(evaluate_group, *t): t for t in tasks}
+        for future in as_completed(futures):
+            symbol = futures[future][0]
+            now = time.time()
+            for row in future.result():
+                row.update(symbol=symbol, interval=interval, ts=now)
+                pending.append(row)
+            if len(pending) >= COMMIT_EVERY:
+                results.add(pending)
+                results.commit()
+                written += len(pending)
+                pending = []
+                print(f"[Sweep] 進度 {written}/{total}（{round(written / (now - start), 1)} 列/秒）")
+    results.add(pending)
+    results.commit()
+    written += len(pending)
+    results.close()
+    print(f"[Sweep] 完成 {written} 列，耗時 {round(time.time() - start, 2)} 秒 → {path}")
+    return written
+
+
+if __name__ == "__main__":
+    # 用法：python3 param_sweep.py grid|random|lhs [--symbols A,B] [--window-bars 1000] [--folds 3] [--samples N]
+    #      python3 param_sweep.py best [--symbols A,B]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("method", choices=["grid", "random", "lhs", "best"])
+    parser.add_argument("--symbols", default=",".join(SYMBOLS))
+    parser.add_argument("--window-bars", type=int, default=WINDOW_BARS)
+    parser.add_argument("--folds", type=int, default=FOLDS)
+    parser.add_argument("--interval", default=KLINE_INTERVAL)
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--steps", type=int, default=GRID_STEPS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    symbols = args.symbols.split(",")
+
+    if args.method == "best":
+        results = SweepResults()
+        for symbol in symbols:
+            for r in results.best(symbol, args.interval, limit=5):
+                print(f"{symbol:<10}｜ {r['parameters']} ｜ 風險 {r['risk_tolerance']} ｜ 適應度 {r['fitness']} ｜ 最大回撤 {r['max_drawdown']}")
+        results.close()
+    else:
+        run_sweep(args.method, symbols, args.window_bars, args.folds, args.interval,
+                  args.samples, args.steps, args.seed, args.workers)
@@ -1,86 +1,111 @@
 import json
+import os
 import random
 import hashlib
-import time
-from pathlib import Path
 from datetime import datetime
 
-# 目錄與檔案路徑
-module_dir = Path("~/Killcore/modules").expanduser()
-module_dir.mkdir(parents=True, exist_ok=True)
-memory_file = Path("~/Killcore/symbol_memory.json").expanduser()
-
-# 檢查幣種來源
-if not memory_file.exists():
-    raise FileNotFoundError("請先執行 symbol_selector.py")
-memory = json.loads(memory_file.read_text())
-selected_symbol = max(memory.items(), key=lambda x: x[1]["uses"])[0]
-
-# 預設池
-strategy_type = "MA_Crossover"
-style_pool = ["defensive", "explosive", "balanced", "scalper"]
-theme_pool = ["trend_following", "breakout", "mean_revert"]
-emotions = ["greedy", "fearful", "hesitant", "balanced", "aggressive"]
-indicators = ["MA", "RSI", "Volume", "MACD", "PriceAction"]
-
-# 隨機風格參數
-style = random.choice(style_pool)
-if style == "defensive":
-    ma_fast, ma_slow, sl, tp = 20, 60, 2, 4
-elif style == "explosive":
-    ma_fast, ma_slow, sl, tp = 8, 21, 4, 10
-elif style == "scalper":
-    ma_fast, ma_slow, sl, tp = 5, 13, 1.5, 2.5
-else:
-    ma_fast, ma_slow, sl, tp = 15, 45, 3, 6
-
-parameters = {
-    "ma_fast": ma_fast,
-    "ma_slow": ma_slow,
-    "sl_pct": sl,
-    "tp_pct": tp
-}
+from genome_cache import genome_hash, genome_of
+from round_state import RoundState
 
-# 決策權重地圖
-selected_indicators = random.sample(indicators, 3)
-weights = [random.uniform(0.2, 0.5) for _ in range(3)]
-s = sum(weights)
-decision_map = {k: round(w / s, 2) for k, w in zip(selected_indicators, weights)}
-
-# 核心辨識碼
-now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-genetic_id = hashlib.md5((selected_symbol + now).encode()).hexdigest()[:12]
-creation_id = f"{selected_symbol}_{now}"
-training_trace_id = f"trace_{random.randint(100000,999999)}"
-
-# 模組主體
-module = {
-    "id": "king",
-    "symbol": selected_symbol,
-    "strategy_type": strategy_type,
-    "parameters": parameters,
-    "capital": 70.51,
-    "generation": 0,
-    "style_profile": style,
-    "strategy_theme": random.choice(theme_pool),
-    "risk_tolerance": round(random.uniform(0.05, 0.2), 2),
-    "max_live_rounds": 10,
-    "init_bias_score": round(random.uniform(-1.0, 1.0), 2),
-    "temperature_level": round(random.uniform(0.3, 0.9), 2),
-    "genetic_id": genetic_id,
-    "creation_id": creation_id,
-    "created_by": "core_generator_v1",
-    "human_note": "初代 king 模組。具備人格、風格、決策邏輯與風險偏好。",
-    "decision_weighting_map": decision_map,
-    "emotional_tendency": random.choice(emotions),
-    "training_trace_id": training_trace_id,
-    "version_stamp": "v1_full_final",
-    "is_divine": False
+# 風格預設參數（param_sweep 也以此決定搜尋範圍）
+STYLE_PRESETS = {
+    "defensive": {"ma_fast": 20, "ma_slow": 60, "sl_pct": 2, "tp_pct": 4},
+    "explosive": {"ma_fast": 8, "ma_slow": 21, "sl_pct": 4, "tp_pct": 10},
+    "scalper": {"ma_fast": 5, "ma_slow": 13, "sl_pct": 1.5, "tp_pct": 2.5},
+    "balanced": {"ma_fast": 15, "ma_slow": 45, "sl_pct": 3, "tp_pct": 6},
 }
+# 有掃描結果時，以該幣種實測最佳參數作為初代 king 的起點
+USE_SWEEP = os.environ.get("KILLCORE_USE_SWEEP", "1") == "1"
+STATE_READS = ("symbol_memory", "sweeps")
+STATE_WRITES = ("king",)
+
+
+def nearest_style(parameters):
+    # 以相對距離找最接近的風格標籤
+    def dist(preset):
+        return sum(abs(parameters[k] - v) / v for k, v in preset.items())
+    return min(STYLE_PRESETS, key=lambda s: dist(STYLE_PRESETS[s]))
+
+
+def run(state):
+    # 檢查幣種來源（固定幣種的 king 直接使用該幣種）
+    if state.symbol:
+        selected_symbol = state.symbol
+    else:
+        if not state.exists("symbol_memory"):
+            raise FileNotFoundError("請先執行 symbol_selector.py")
+        memory = state.load("symbol_memory")
+        selected_symbol = max(memory.items(), key=lambda x: x[1]["uses"])[0]
+
+    # 預設池
+    strategy_type = "MA_Crossover"
+    style_pool = ["defensive", "explosive", "balanced", "scalper"]
+    theme_pool = ["trend_following", "breakout", "mean_revert"]
+    emotions = ["greedy", "fearful", "hesitant", "balanced", "aggressive"]
+    indicators = ["MA", "RSI", "Volume", "MACD", "PriceAction"]
+
+    # 風格參數：優先採用參數掃描的實測最佳值，否則隨機抽一個預設風格
+    best = None
+    if USE_SWEEP:
+        from param_sweep import best_config
+        best = best_config(selected_symbol)
+    if best:
+        parameters = best["parameters"]
+        style = nearest_style(parameters)
+        risk_tolerance = best["risk_tolerance"]
+        print(f"[Core Generator] 採用掃描最佳參數（適應度 {best['fitness']}，{best['windows']} 個視窗）")
+    else:
+        style = random.choice(style_pool)
+        parameters = dict(STYLE_PRESETS[style])
+        risk_tolerance = round(random.uniform(0.05, 0.2), 2)
+
+    # 決策權重地圖
+    selected_indicators = random.sample(indicators, 3)
+    weights = [random.uniform(0.2, 0.5) for _ in range(3)]
+    s = sum(weights)
+    decision_map = {k: round(w / s, 2) for k, w in zip(selected_indicators, weights)}
+
+    # 核心辨識碼
+    now = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    genetic_id = hashlib.md5((selected_symbol + now).encode()).hexdigest()[:12]
+    creation_id = f"{selected_symbol}_{now}"
+    training_trace_id = f"trace_{random.randint(100000,999999)}"
+
+    # 模組主體
+    module = {
+        "id": "king",
+        "symbol": selected_symbol,
+        "strategy_type": strategy_type,
+        "parameters": parameters,
+        "capital": 70.51,
+        "generation": 0,
+        "style_profile": style,
+        "strategy_theme": random.choice(theme_pool),
+        "risk_tolerance": risk_tolerance,
+        "max_live_rounds": 10,
+        "init_bias_score": round(random.uniform(-1.0, 1.0), 2),
+        "temperature_level": round(random.uniform(0.3, 0.9), 2),
+        "genetic_id": genetic_id,
+        "creation_id": creation_id,
+        "created_by": "core_generator_v1",
+        "human_note": "初代 king 模組。具備人格、風格、決策邏輯與風險偏好。",
+        "decision_weighting_map": decision_map,
+        "emotional_tendency": random.choice(emotions),
+        "training_trace_id": training_trace_id,
+        "version_stamp": "v1_full_final",
+        "is_divine": False
+    }
+
+    # 內容雜湊：同一組基因（參數、風險、風格、權重）永遠得到相同雜湊，供適應度快取與血統索引使用
+    module["genome_hash"] = genome_hash(genome_of(module))
+
+    # 儲存模組
+    state.save("king", module)
+
+    print(f"[已產生模組] → {state.path('king')}")
+    print(json.dumps(module, indent=2))
 
-# 儲存模組
-with open(module_dir / "king.json", "w") as f:
-    json.dump(module, f, indent=2)
 
-print(f"[已產生模組] → {module_dir}/king.json")
-print(json.dumps(module, indent=2))
+if __name__ == "__main__":
+    with RoundState() as state:
+        run(state)
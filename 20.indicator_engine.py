@@ -0,0 +1,226 @@
+import math
+
+import numpy as np
+
+# decision_weighting_map 使用的指標：批次模式對整段 K 線向量化計算，
+# 串流模式每根新 K 線 O(1) 更新（滾動和與 EMA 遞迴），狀態為純 dict 可存入 JSON。
+INDICATORS = ("MA", "RSI", "Volume", "MACD", "PriceAction")
+DEFAULT_CONFIG = {
+    "ma_fast": 15,
+    "ma_slow": 45,
+    "rsi_period": 14,
+    "macd_fast": 12,
+    "macd_slow": 26,
+    "macd_signal": 9,
+    "volume_window": 20,
+}
+# 串流狀態保留的最近收盤／成交量根數；需涵蓋 ma_slow 上限（evolution_engine 限制為 240）
+RING_SIZE = 240
+EMA_BLOCK = 256
+
+
+def make_config(parameters=None):
+    cfg = dict(DEFAULT_CONFIG)
+    for k in ("ma_fast", "ma_slow"):
+        if parameters and k in parameters:
+            cfg[k] = int(parameters[k])
+    return cfg
+
+
+# === 批次模式 ===
+
+def sma(x, n):
+    out = np.full(len(x), np.nan)
+    if n <= len(x):
+        cs = np.concatenate(([0.0], np.cumsum(x)))
+        out[n - 1:] = (cs[n:] - cs[:-n]) / n
+    return out
+
+
+def ema(x, alpha):
+    # y[t] = y[t-1] + alpha·(x[t] - y[t-1])，y[0] = x[0]；分塊以封閉式向量化，塊間只傳遞上一塊的末值
+    x = np.asarray(x, dtype=np.float64)
+    out = np.empty(len(x))
+    if not len(x):
+        return out
+    d = 1 - alpha
+    k = np.arange(1, EMA_BLOCK + 1)
+    decay = d ** k
+    carry = x[0]
+    for start in range(0, len(x), EMA_BLOCK):
+        block = x[start:start + EMA_BLOCK]
+        m = len(block)
+        # y[j] = d^(j+1)·carry + alpha·Σ_{i<=j} d^(j-i)·x[i]
+        acc = np.cumsum(block / decay[:m])
+        out[start:start + m] = decay[:m] * (carry + alpha * acc)
+        carry = out[start + m - 1]
+    return out
+
+
+def compute_batch(bars, config=None):
+    cfg = config or DEFAULT_CONFIG
+    o, h, l, c, v = (np.asarray(bars[k], dtype=np.float64) for k in ("open", "high", "low", "close", "volume"))
+    n = len(c)
+
+    macd = ema(c, 2 / (cfg["macd_fast"] + 1)) - ema(c, 2 / (cfg["macd_slow"] + 1))
+    macd_signal = ema(macd, 2 / (cfg["macd_signal"] + 1))
+
+    rsi = np.full(n, np.nan)
+    if n > 1:
+        change = np.diff(c)
+        avg_gain = ema(np.maximum(change, 0), 1 / cfg["rsi_period"])
+        avg_loss = ema(np.maximum(-change, 0), 1 / cfg["rsi_period"])
+        rsi[1:] = _rsi(avg_gain, avg_loss)
+
+    vol_avg = sma(v, cfg["volume_window"])
+    rng = h - l
+    return {
+        "ma_fast": sma(c, cfg["ma_fast"]),
+        "ma_slow": sma(c, cfg["ma_slow"]),
+        "rsi": rsi,
+        "macd": macd,
+        "macd_signal": macd_signal,
+        "volume_ratio": np.divide(v, vol_avg, out=np.full(n, np.nan), where=vol_avg > 0),
+        "body": np.divide(c - o, rng, out=np.zeros(n), where=rng > 0),
+        "close": c,
+    }
+
+
+def _rsi(avg_gain, avg_loss):
+    avg_gain, avg_loss = np.asarray(avg_gain, dtype=np.float64), np.asarray(avg_loss, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    return np.where(avg_loss > 0, rsi, np.where(avg_gain > 0, 100.0, 50.0))
+
+
+# === 訊號與決策分數（批次陣列與串流單值共用）===
+
+def signals(values):
+    # 每個指標轉成 [-1, 1] 的多空訊號；暖機期（NaN）視為 0
+    ma = np.tanh((np.asarray(values["ma_fast"]) / np.asarray(values["ma_slow"]) - 1) * 100)
+    rsi = (50 - np.asarray(values["rsi"])) / 50
+    volume = np.tanh(np.asarray(values["volume_ratio"]) - 1) * np.sign(values["body"])
+    macd = np.tanh((np.asarray(values["macd"]) - np.asarray(values["macd_signal"])) / np.asarray(values["close"]) * 1000)
+    out = {"MA": ma, "RSI": rsi, "Volume": volume, "MACD": macd, "PriceAction": np.asarray(values["body"])}
+    return {k: np.nan_to_num(s) for k, s in out.items()}
+
+
+def decision_score(sig, weighting_map):
+    # decision_weighting_map 加權總分，範圍 [-1, 1]
+    total = sum(weighting_map.get(k, 0) for k in INDICATORS) or 1
+    return sum(sig[k] * weighting_map[k] for k in INDICATORS if k in weighting_map) / total
+
+
+# === 串流模式 ===
+
+def empty_state(config=None):
+    cfg = dict(config or DEFAULT_CONFIG)
+    return {
+        "config": cfg,
+        "t": 0,
+        "last_open_time": None,
+        "closes": [],
+        "volumes": [],
+        "sum_fast": 0.0,
+        "sum_slow": 0.0,
+        "sum_vol": 0.0,
+        "ema_fast": None,
+        "ema_slow": None,
+        "macd_signal": None,
+        "avg_gain": None,
+        "avg_loss": None,
+        "prev_close": None,
+        "values": None,
+    }
+
+
+def _window_sum(ring, t, n):
+    # 環狀緩衝中最近 n 根（含第 t-1 根）的和
+    n = min(n, t)
+    return float(sum(ring[(t - 1 - i) % RING_SIZE] for i in range(n)))
+
+
+def configure(state, parameters):
+    # king 的均線週期變動時只從環狀緩衝重算兩個滾動和（O(RING_SIZE)），EMA 類指標不受影響
+    cfg = state["config"]
+    new = make_config(parameters)
+    if (new["ma_fast"], new["ma_slow"]) == (cfg["ma_fast"], cfg["ma_slow"]):
+        return state
+    cfg["ma_fast"], cfg["ma_slow"] = new["ma_fast"], new["ma_slow"]
+    state["sum_fast"] = _window_sum(state["closes"], state["t"], cfg["ma_fast"])
+    state["sum_slow"] = _window_sum(state["closes"], state["t"], cfg["ma_slow"])
+    return state
+
+
+def update(state, candle):
+    # candle：{"open_time", "open", "high", "low", "close", "volume"}，回傳本根的指標值
+    cfg = state["config"]
+    t = state["t"]
+    o, h, l, c, v = (float(candle[k]) for k in ("open", "high", "low", "close", "volume"))
+    closes, volumes = state["closes"], state["volumes"]
+
+    for key, n, ring, x in (("sum_fast", cfg["ma_fast"], closes, c),
+                            ("sum_slow", cfg["ma_slow"], closes, c),
+                            ("sum_vol", cfg["volume_window"], volumes, v)):
+        state[key] += x - (ring[(t - n) % RING_SIZE] if t >= n else 0.0)
+    for ring, x in ((closes, c), (volumes, v)):
+        if len(ring) < RING_SIZE:
+            ring.append(x)
+        else:
+            ring[t % RING_SIZE] = x
+
+    a_fast, a_slow, a_sig = (2 / (cfg[k] + 1) for k in ("macd_fast", "macd_slow", "macd_signal"))
+    if t == 0:
+        state["ema_fast"] = state["ema_slow"] = c
+        state["macd_signal"] = 0.0
+    else:
+        state["ema_fast"] += a_fast * (c - state["ema_fast"])
+        state["ema_slow"] += a_slow * (c - state["ema_slow"])
+        macd = state["ema_fast"] - state["ema_slow"]
+        state["macd_signal"] += a_sig * (macd - state["macd_signal"])
+        change = c - state["prev_close"]
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        if t == 1:
+            state["avg_gain"], state["avg_loss"] = gain, loss
+        else:
+            state["avg_gain"] += (gain - state["avg_gain"]) / cfg["rsi_period"]
+            state["avg_loss"] += (loss - state["avg_loss"]) / cfg["rsi_period"]
+
+    n = t + 1
+    nan = math.nan
+    vol_avg = state["sum_vol"] / cfg["volume_window"] if n >= cfg["volume_window"] else nan
+    values = {
+        "ma_fast": state["sum_fast"] / cfg["ma_fast"] if n >= cfg["ma_fast"] else nan,
+        "ma_slow": state["sum_slow"] / cfg["ma_slow"] if n >= cfg["ma_slow"] else nan,
+        "rsi": float(_rsi(state["avg_gain"], state["avg_loss"])) if t >= 1 else nan,
+        "macd": state["ema_fast"] - state["ema_slow"],
+        "macd_signal": state["macd_signal"],
+        "volume_ratio": v / vol_avg if vol_avg and vol_avg > 0 else nan,
+        "body": (c - o) / (h - l) if h > l else 0.0,
+        "close": c,
+    }
+    state["t"] = n
+    state["prev_close"] = c
+    state["last_open_time"] = int(candle["open_time"])
+    state["values"] = {k: None if isinstance(x, float) and math.isnan(x) else x for k, x in values.items()}
+    return values
+
+
+def stream_window(state, bars, parameters=None):
+    # 只餵入狀態最後一根之後的 K 線；狀態過期（缺口、時間倒退）時以此視窗重新暖機
+    open_time = bars["open_time"]
+    last = state["last_open_time"] if state else None
+    if not len(open_time):
+        return state, 0
+    start = int(np.searchsorted(open_time, last, side="right")) if last is not None else 0
+    if last is None or start == 0 or open_time[start - 1] != last:
+        state, start = empty_state(make_config(parameters)), 0
+    configure(state, parameters)
+    for i in range(start, len(open_time)):
+        update(state, {k: bars[k][i] for k in ("open_time", "open", "high", "low", "close", "volume")})
+    return state, len(open_time) - start
+
+
+def current_values(state):
+    # 由存檔狀態取回最後一根的指標值（None 還原為 NaN）
+    return {k: math.nan if x is None else x for k, x in (state.get("values") or {}).items()}
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+# 以合成資料量測各模組隨資料量的耗時與峰值記憶體，並與基準比較
+SCRIPT_DIR = Path(__file__).resolve().parent
+BASELINE_FILE = SCRIPT_DIR / "benchmark_baseline.json"
+# 每次量測結果寫到 metrics/（與 round_metrics 同處），不混進部署的腳本與狀態檔；可用 --out 指定
+RESULTS_FILE = Path("~/Killcore/metrics/benchmark_results.json").expanduser()
+SIZES = (1_000, 100_000, 1_000_000)
+STAGES = [
+    "live_simulator",
+    "memory_recorder",
+    "memory_regulator",
+    "auto_grader",
+    "insight_reporter",
+    "backtest_kernel",
+    "indicator_kernel",
+]
+SYMBOL = "SHIBUSDT"
+INTERVAL = "1m"
+# 退步門檻：超過基準的比例，且絕對差距超過雜訊底線才算
+WALL_THRESHOLD = 0.25
+WALL_NOISE_SEC = 0.05
+PEAK_THRESHOLD = 0.20
+PEAK_NOISE_MB = 5
+STYLES = ["defensive", "explosive", "balanced", "scalper"]
+INTENTS = [["降低 SL%"], ["提高 TP%"], ["縮短均線"], ["風格轉換"]]
+
+
+# === 合成資料 ===
+
+def synthetic_klines(n, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 1e-5 * np.cumprod(1 + rng.normal(0, 0.002, n))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.001, n))
+    start = int(datetime(2024, 1, 1).timestamp() * 1000)
+    return {
+        "open_time": start + np.arange(n, dtype=np.int64) * 60_000,
+        "open": open_,
+        "high": np.maximum(open_, close) * (1 + spread),
+        "low": np.minimum(open_, close) * (1 - spread),
+        "close": close,
+        "volume": rng.uniform(1e3, 1e6, n),
+    }
+
+
+def write_kline_store(root, bars):
+    from kline_store import COLUMNS, KlineStore
+    store = KlineStore(SYMBOL, INTERVAL, root)
+    for col, dtype in COLUMNS.items():
+        np.asarray(bars[col], dtype=dtype).tofile(store._file(col))
+
+
+def synthetic_memory(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ret = np.round(rng.normal(0, 5, n), 2)
+    dd = np.round(np.abs(rng.normal(5, 3, n)), 2)
+    win = np.round(rng.uniform(20, 80, n), 1)
+    sharpe = np.round(rng.normal(0.5, 1, n), 2)
+    start = datetime(2024, 1, 1)
+    history = [{
+        "rid": i,
+        "generation": i,
+        "ts": (start + timedelta(minutes=i)).isoformat(),
+        "return_pct": float(ret[i]),
+        "net_profit": round(float(ret[i]) * 0.7051, 2),
+        "drawdown": float(dd[i]),
+        "win_rate": float(win[i]),
+        "sharpe": float(sharpe[i]),
+        "trade_count": int(i % 17),
+        "fail_reason": "none" if ret[i] > 0 else "loss",
+        "fail_indicators": ["dd_high"] if dd[i] > 5 else [],
+        "symbol": SYMBOL,
+        "params": {"ma_fast": 15, "ma_slow": 45, "sl_pct": 3, "tp_pct": 6},
+        "style": STYLES[i % 4],
+        "intent": INTENTS[i % 4],
+    } for i in range(n)]
+    traces = [{
+        "generation": i,
+        "timestamp": (start + timedelta(minutes=i)).isoformat(),
+        "style_profile": STYLES[(i // 7) % 4],
+        "intent": INTENTS[(i // 5) % 4],
+        "return_pct": float(ret[i]),
+    } for i in range(n)]
+    return {
+        "live_rounds": n,
+        "learning_score": 2,
+        "history": history,
+        "history_seq": n,
+        "evolution_trace": traces,
+        "drift_history": [{"generation": i, "style": STYLES[i % 4]} for i in range(0, n, 10)],
+        "intent_summary": [{"generation": i, "intent": INTENTS[i % 4]} for i in range(0, n, 10)],
+        "style_history": [STYLES[i % 4] for i in range(0, n, 10)],
+        "fail_indicators_count": {"dd_high": n // 2},
+        "memory_flags": {},
+        "aging_map": {},
+        "bad_behavior_tag": [],
+    }
+
+
+def seed_root(root, n):
+    # 在 root（即子行程的 ~/Killcore）產生一份完整狀態
+    from round_state import RoundState
+    root.mkdir(parents=True, exist_ok=True)
+    write_kline_store(root / "klines", synthetic_klines(n))
+    state = RoundState(root)
+    state.save("king", {
+        "id": "king", "symbol": SYMBOL, "strategy_type": "MA_Crossover",
+        "parameters": {"ma_fast": 15, "ma_slow": 45, "sl_pct": 3, "tp_pct": 6},
+        "capital": 70.51, "generation": n, "style_profile": "balanced", "risk_tolerance": 0.1,
+        "init_bias_score": 0.1, "temperature_level": 0.5, "emotional_tendency": "balanced",
+        "decision_weighting_map": {"MA": 0.4, "RSI": 0.3, "MACD": 0.3},
+    })
+    state.save("performance", {
+        "return_pct": 1.2, "net_profit": 0.85, "drawdown": 3.1, "sharpe": 0.8, "win_rate": 55.0,
+        "trade_count": 4, "fail_reason": "none", "fail_indicators": [], "symbol": SYMBOL,
+        "ts": datetime.now().isoformat(),
+    })
+    state.save("market", {"btc_volatility": 3, "trend_score": 0.4})
+    state.save("evaluation", {"next_focus": "", "strategy_shift": "", "risk_response": ""})
+    state.save("memory", synthetic_memory(n))
+    state.flush()
+    # SQLite 後端：先完成一次性的 JSON 匯入，避免算進第一個模組
+    state.memory()
+    state.flush()
+
+
+# === 子行程：單一模組計時 ===
+
+def run_stage(stage, root, n):
+    if stage == "backtest_kernel":
+        from backtest_engine import backtest_ma_crossover
+        from kline_store import KlineStore
+        bars = {k: np.ascontiguousarray(v) for k, v in KlineStore(SYMBOL, INTERVAL, root / "klines").window(n).items()}
+        t0, c0 = time.perf_counter(), time.process_time()
+        backtest_ma_crossover(bars["open"], bars["high"], bars["low"], bars["close"], 15, 45, 3, 6,
+                              entry_slices=(0.25, 0.25, 0.5), slippage=0.0015)
+        return time.perf_counter() - t0, time.process_time() - c0
+    if stage == "indicator_kernel":
+        from indicator_engine import compute_batch
+        from kline_store import KlineStore
+        bars = {k: np.ascontiguousarray(v) for k, v in KlineStore(SYMBOL, INTERVAL, root / "klines").window(n).items()}
+        t0, c0 = time.perf_counter(), time.process_time()
+        compute_batch(bars)
+        return time.perf_counter() - t0, time.process_time() - c0
+
+    import contextlib
+    import importlib
+    import io
+    from round_state import RoundState
+    module = importlib.import_module(stage)
+    t0, c0 = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = RoundState(root)
+        module.run(state)
+        state.end_stage()
+        state.flush()
+    return time.perf_counter() - t0, time.process_time() - c0
+
+
+def child_main(args):
+    sys.path.insert(0, str(SCRIPT_DIR))
+    root = Path("~/Killcore").expanduser()
+    if args.child == "seed":
+        seed_root(root, args.size)
+        return
+    wall, cpu = run_stage(args.child, root, args.size)
+    print(json.dumps({"wall": wall, "cpu": cpu}))
+
+
+# === 主行程 ===
+
+def measure(stage, seed_home, work_home, n):
+    if work_home.exists():
+        shutil.rmtree(work_home)
+    shutil.copytree(seed_home, work_home)
+    # 每個模組一個子行程：HOME 指向複製出的工作目錄；自行 wait4 取得該子行程的 ru_maxrss（KB）
+    env = dict(os.environ, HOME=str(work_home), KILLCORE_KLINE_MODE="replay")
+    err_file = work_home / "stderr.txt"
+    with open(err_file, "w") as err:
+        proc = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "--child", stage, "--size", str(n)],
+                                env=env, stdout=subprocess.PIPE, stderr=err, text=True)
+        out = proc.stdout.read()
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f"{stage} @ {n} 失敗：\n{err_file.read_text()}")
+    result = json.loads(out.strip().splitlines()[-1])
+    result["peak_mb"] = usage.ru_maxrss / 1024
+    return {k: round(v, 4) for k, v in result.items()}
+
+
+def compare(results, baseline):
+    regressions = []
+    for size, stages in results.items():
+        for stage, r in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if not base:
+                continue
+            if r["wall"] > base["wall"] * (1 + WALL_THRESHOLD) and r["wall"] - base["wall"] > WALL_NOISE_SEC:
+                regressions.append(f"{stage} @ {size}：耗時 {base['wall']} → {r['wall']} 秒")
+            if r["peak_mb"] > base["peak_mb"] * (1 + PEAK_THRESHOLD) and r["peak_mb"] - base["peak_mb"] > PEAK_NOISE_MB:
+                regressions.append(f"{stage} @ {size}：峰值記憶體 {base['peak_mb']} → {r['peak_mb']} MB")
+    return regressions
+
+
+def main(args):
+    sizes = [int(float(s)) for s in args.sizes.split(",")]
+    stages = args.stages.split(",") if args.stages else STAGES
+    baseline = json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+    results = {}
+    tmp = Path(tempfile.mkdtemp(prefix="killcore_bench_"))
+    try:
+        for n in sizes:
+            seed_home = tmp / f"seed_{n}"
+            t0 = time.time()
+            env = dict(os.environ, HOME=str(seed_home), KILLCORE_KLINE_MODE="replay")
+            subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", "seed", "--size", str(n)],
+                           env=env, check=True)
+            print(f"\n[Benchmark] {n:,} 筆合成資料產生完成（{round(time.time() - t0, 1)} 秒）")
+            results[str(n)] = {}
+            for stage in stages:
+                r = measure(stage, seed_home, tmp / "work", n)
+                results[str(n)][stage] = r
+                base = baseline.get(str(n), {}).get(stage)
+                ref = f"（基準 {base['wall']} 秒 / {base['peak_mb']} MB）" if base else ""
+                print(f" - {stage:<18} 耗時 {r['wall']:>9.4f} 秒 ｜ CPU {r['cpu']:>9.4f} 秒 ｜ 峰值 {r['peak_mb']:>8.1f} MB {ref}")
+            shutil.rmtree(seed_home)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps({"ts": datetime.now().isoformat(), "results": results}, indent=2))
+    print(f"\n[Benchmark] 量測結果 → {out}")
+    if args.update_baseline:
+        for size, stages_result in results.items():
+            baseline.setdefault(size, {}).update(stages_result)
+        BASELINE_FILE.write_text(json.dumps(baseline, indent=2))
+        print(f"\n[Benchmark] 已更新基準 → {BASELINE_FILE}")
+        return 0
+    regressions = compare(results, baseline)
+    if regressions:
+        print("\n[Benchmark] 效能退步：")
+        for r in regressions:
+            print(f" - {r}")
+        return 1
+    print("\n[Benchmark] 無效能退步" if baseline else "\n[Benchmark] 尚無基準，可加 --update-baseline 建立")
+    return 0
+
+
+if __name__ == "__main__":
+    # 用法：python3 benchmark.py [--sizes 1e3,1e5,1e6] [--stages a,b] [--out 路徑] [--update-baseline]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES))
+    parser.add_argument("--stages", default=None)
+    parser.add_argument("--out", default=str(RESULTS_FILE))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child_main(args)
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,232 @@
+import cProfile
+import json
+import os
+import resource
+import signal
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+METRICS_PATH = Path("~/Killcore/metrics").expanduser()
+JSONL_FILE = "rounds.jsonl"
+PROM_FILE = "killcore.prom"
+JSONL_MAX_BYTES = 5 * 1024 * 1024
+JSONL_BACKUPS = 5
+# tracemalloc 會拖慢配置密集的模組，可用 KILLCORE_TRACE_MEMORY=0 關閉
+TRACE_MEMORY = os.environ.get("KILLCORE_TRACE_MEMORY", "1") == "1"
+# 空字串：不剖析；cprofile：每模組輸出 .prof；sample：SIGPROF 取樣輸出 folded stacks（可直接畫火焰圖）
+PROFILE_MODE = os.environ.get("KILLCORE_PROFILE", "")
+SAMPLE_INTERVAL_SEC = 0.005
+PROFILE_KEEP = 50
+
+# Prometheus 指標名稱 → (單模組紀錄欄位, 說明)
+PROM_METRICS = {
+    "killcore_stage_wall_seconds": ("wall", "Wall time of the stage in the last round"),
+    "killcore_stage_cpu_seconds": ("cpu", "CPU time of the stage in the last round, including child processes"),
+    "killcore_stage_tracemalloc_peak_bytes": ("tracemalloc_peak", "Peak traced Python allocation during the stage"),
+    "killcore_stage_json_read_bytes": ("json_read_bytes", "JSON state bytes read by the stage"),
+    "killcore_stage_json_written_bytes": ("json_written_bytes", "JSON state bytes written by the stage"),
+    "killcore_stage_http_requests": ("http_requests", "HTTP requests made by the stage"),
+    "killcore_stage_http_seconds": ("http_seconds", "Total HTTP latency of the stage"),
+    "killcore_stage_failed": ("failed", "1 if the stage raised in the last round"),
+}
+
+_local = threading.local()
+
+
+def _on_response(response, *args, **kwargs):
+    rec = getattr(_local, "stage", None)
+    if rec is not None:
+        rec["http_requests"] += 1
+        rec["http_seconds"] += response.elapsed.total_seconds()
+
+
+def instrument_session(session):
+    # 在 requests.Session 掛上回應 hook，把請求數與延遲記到目前執行中的模組
+    hooks = session.hooks.setdefault("response", [])
+    if _on_response not in hooks:
+        hooks.append(_on_response)
+    return session
+
+
+class _Sampler:
+    """以 SIGPROF 定時取樣呼叫堆疊，累計成 folded stacks。只能在主執行緒使用。"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SEC):
+        self.interval = interval
+        self.counts = Counter()
+        self._previous = None
+
+    def _handler(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{Path(frame.f_code.co_filename).stem}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        self.counts[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._previous = signal.signal(signal.SIGPROF, self._handler)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+
+    def dump(self, path):
+        path.write_text("".join(f"{stack} {n}\n" for stack, n in self.counts.most_common()))
+
+
+class RoundTracer:
+    """單輪逐模組量測：wall / CPU 時間、tracemalloc 峰值、JSON 讀寫量、HTTP 次數與延遲。
+
+    finish() 把整輪紀錄附加到輪替的 JSONL，並覆寫 Prometheus textfile。
+    """
+
+    def __init__(self, root=METRICS_PATH, trace_memory=TRACE_MEMORY, profile=PROFILE_MODE, concurrent=False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.trace_memory = trace_memory
+        self.profile = profile
+        # concurrent：各模組可能同時在不同執行緒執行（stage_graph 排程）。CPU 改計執行緒時間，
+        # tracemalloc 在第一個模組開始時啟動、最後一個結束時停止，重疊期間的峰值為行程整體值
+        self.concurrent = concurrent
+        self.stages = []
+        self.start = time.perf_counter()
+        self.started_at = datetime.now().isoformat()
+        self._active = 0
+        self._guard = threading.Lock()
+
+    def _name(self, name):
+        # 同一模組一輪執行兩次（如 memory_recorder）時加上序號，讓指標標籤唯一
+        seen = sum(1 for s in self.stages if s["stage"].split("#")[0] == name)
+        return f"{name}#{seen + 1}" if seen else name
+
+    def _start_profile(self):
+        if self.profile == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        if self.profile == "sample" and threading.current_thread() is threading.main_thread():
+            sampler = _Sampler()
+            sampler.start()
+            return sampler
+        return None
+
+    def _stop_profile(self, profiler, name):
+        if profiler is None:
+            return
+        folder = self.root / "profiles"
+        folder.mkdir(exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(str(folder / f"{stamp}_{name}.prof"))
+        else:
+            profiler.stop()
+            profiler.dump(folder / f"{stamp}_{name}.folded")
+        for old in sorted(folder.iterdir(), key=lambda f: f.stat().st_mtime, reverse=True)[PROFILE_KEEP:]:
+            old.unlink()
+
+    @contextmanager
+    def stage(self, name, state=None):
+        rec = {
+            "stage": self._name(name),
+            "wall": 0.0,
+            "cpu": 0.0,
+            "tracemalloc_peak": None,
+            "json_read_bytes": None,
+            "json_written_bytes": None,
+            "http_requests": 0,
+            "http_seconds": 0.0,
+            "failed": 0,
+        }
+        io_before = dict(state.io) if state is not None else None
+        # 只在模組執行期間追蹤配置（模組匯入等不計入，也避免全程追蹤的額外負擔）
+        if self.trace_memory:
+            with self._guard:
+                if not self._active:
+                    tracemalloc.start()
+                self._active += 1
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        profiler = self._start_profile()
+        _local.stage = rec
+        clock = time.thread_time if self.concurrent else time.process_time
+        t0, c0 = time.perf_counter(), clock()
+        rec["start"] = round(t0 - self.start, 6)
+        try:
+            yield rec
+        except BaseException:
+            rec["failed"] = 1
+            raise
+        finally:
+            rec["wall"] = time.perf_counter() - t0
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            rec["cpu"] = (clock() - c0 + after.ru_utime - children.ru_utime
+                          + after.ru_stime - children.ru_stime)
+            _local.stage = None
+            self._stop_profile(profiler, rec["stage"].replace("#", "_"))
+            if self.trace_memory:
+                with self._guard:
+                    rec["tracemalloc_peak"] = tracemalloc.get_traced_memory()[1]
+                    self._active -= 1
+                    if not self._active:
+                        tracemalloc.stop()
+            if io_before is not None:
+                rec["json_read_bytes"] = state.io["json_read_bytes"] - io_before["json_read_bytes"]
+                rec["json_written_bytes"] = state.io["json_written_bytes"] - io_before["json_written_bytes"]
+            rec["wall"], rec["cpu"], rec["http_seconds"] = (round(rec[k], 6) for k in ("wall", "cpu", "http_seconds"))
+            self.stages.append(rec)
+
+    def finish(self, **extra):
+        record = {
+            "ts": self.started_at,
+            "wall": round(time.perf_counter() - self.start, 6),
+            **extra,
+            "stages": self.stages,
+        }
+        self._append_jsonl(record)
+        self._write_prom(record)
+        return record
+
+    def _append_jsonl(self, record):
+        path = self.root / JSONL_FILE
+        if path.exists() and path.stat().st_size >= JSONL_MAX_BYTES:
+            for i in range(JSONL_BACKUPS - 1, 0, -1):
+                older = path.with_name(f"{JSONL_FILE}.{i}")
+                if older.exists():
+                    os.replace(older, path.with_name(f"{JSONL_FILE}.{i + 1}"))
+            os.replace(path, path.with_name(f"{JSONL_FILE}.1"))
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _write_prom(self, record):
+        # node_exporter textfile collector 格式；先寫暫存檔再 rename，避免被讀到半份
+        lines = []
+        for metric, (field, help_text) in PROM_METRICS.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for s in record["stages"]:
+                if s[field] is not None:
+                    lines.append(f'{metric}{{stage="{s["stage"]}"}} {s[field]}')
+        lines += [
+            "# HELP killcore_round_wall_seconds Wall time of the last round",
+            "# TYPE killcore_round_wall_seconds gauge",
+            f"killcore_round_wall_seconds {record['wall']}",
+            "# HELP killcore_round_timestamp_seconds Unix time the last round finished",
+            "# TYPE killcore_round_timestamp_seconds gauge",
+            f"killcore_round_timestamp_seconds {round(time.time(), 3)}",
+        ]
+        if "round" in record:
+            lines += [
+                "# HELP killcore_round_number Archive round number of the last round",
+                "# TYPE killcore_round_number gauge",
+                f"killcore_round_number {record['round']}",
+            ]
+        path = self.root / PROM_FILE
+        tmp = path.with_name(PROM_FILE + ".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        os.replace(tmp, path)
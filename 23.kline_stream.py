@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import random
+import time
+from pathlib import Path
+
+import requests
+
+import kline_store
+from kline_store import INTERVAL_MS, STREAM_PATH, STREAM_STALE_SEC, KlineRing, KlineStore
+
+# 常駐的 K 線／行情串流接收器：訂閱交易所 WebSocket，把 K 線寫進 kline_store.KlineRing，
+# 最新行情寫進 tickers.json。KILLCORE_KLINE_MODE=stream 時模擬器與選幣器改讀這裡，不再每輪打 REST。
+# 可用 KILLCORE_WS_URL 指向本機的替身伺服器測試。
+# 需另外安裝 websockets 套件（pip install "websockets>=12"）；只有本接收器用到，其他模組不依賴它。
+WS_URL = os.environ.get("KILLCORE_WS_URL", "wss://wbs.mexc.com/ws")
+LOCK_FILE = Path("/tmp/killcore_stream.lock")
+KILLCORE_PATH = Path("~/Killcore").expanduser()
+TICKER_FILE = "tickers.json"
+KLINE_CHANNEL = "spot@public.kline.v3.api@{symbol}@{interval}"
+TICKER_CHANNEL = "spot@public.miniTicker.v3.api@{symbol}@UTC+8"
+WS_INTERVALS = {
+    "1m": "Min1",
+    "5m": "Min5",
+    "15m": "Min15",
+    "30m": "Min30",
+    "60m": "Min60",
+    "4h": "Hour4",
+    "1d": "Day1",
+}
+PING_SEC = 20
+RECONNECT_MIN_SEC = 1
+RECONNECT_MAX_SEC = 60
+RESYNC_MIN_SEC = 5       # 同一 symbol 缺口補抓的最短間隔
+TICKER_FLUSH_SEC = 1
+
+
+def read_tickers(root=STREAM_PATH, max_age=STREAM_STALE_SEC):
+    # 給選幣器用：回傳 max_age 秒內更新過的行情（欄位與 REST /ticker/24hr 同名）
+    path = Path(root) / TICKER_FILE
+    try:
+        tickers = json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    now = time.time()
+    return {s: t for s, t in tickers.items() if now - t.get("ts", 0) <= max_age}
+
+
+def active_symbols():
+    # 預設訂閱：選幣器候選清單 + kings.json 中固定的幣種
+    from symbol_selector import SYMBOLS
+    symbols = list(SYMBOLS)
+    kings_file = KILLCORE_PATH / "kings.json"
+    if kings_file.exists():
+        for king in json.loads(kings_file.read_text()):
+            if king.get("symbol") and king["symbol"] not in symbols:
+                symbols.append(king["symbol"])
+    return symbols
+
+
+class StreamIngestor:
+    """單一 WebSocket 連線訂閱多個 symbol 的 K 線與行情。
+
+    連線（含重連）時先以 REST 補齊本地 K 線庫並重填環狀緩衝；收到下一根 K 線時，
+    上一根視為收盤並寫入 K 線庫。推播出現缺口時在背景執行緒以 REST 重新補齊，
+    補齊期間該 symbol 的推播先暫存，完成後重填緩衝再依序套用，不阻塞接收迴圈與心跳。
+    """
+
+    def __init__(self, symbols, interval="1m", url=WS_URL, root=STREAM_PATH):
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.step = INTERVAL_MS[interval]
+        self.url = url
+        self.root = Path(root)
+        self.rings = {s: KlineRing(s, interval, root) for s in self.symbols}
+        self.stores = {s: KlineStore(s, interval) for s in self.symbols}
+        self.tickers = read_tickers(root, max_age=float("inf"))
+        self._ticker_dirty = False
+        self._resynced_at = {}
+        self._resyncing = {}
+        self._resync_tasks = set()
+        self.stats = {"messages": 0, "klines": 0, "tickers": 0, "closed": 0, "resyncs": 0, "reconnects": 0}
+
+    def _fetch(self, symbol):
+        # REST 補抓（阻塞，可在執行緒中執行）
+        try:
+            return self.stores[symbol].sync(session=kline_store.session)
+        except requests.RequestException as e:
+            print(f"[Stream] {symbol} REST 補抓失敗，沿用本地資料：{e}")
+            return 0
+
+    def _refill(self, symbol, added):
+        store = self.stores[symbol]
+        self.rings[symbol].reset(store.window(self.rings[symbol].capacity))
+        self._resynced_at[symbol] = time.monotonic()
+        self.stats["resyncs"] += 1
+        print(f"[Stream] {symbol} {self.interval} 補抓 {added} 根，緩衝 {min(len(store), self.rings[symbol].capacity)} 根")
+
+    def resync(self, symbol):
+        self._refill(symbol, self._fetch(symbol))
+
+    async def _resync_later(self, symbol):
+        # 推播缺口：REST 在執行緒中跑，緩衝只在事件迴圈內重填，不與 on_kline 同時修改
+        added = 0
+        try:
+            added = await asyncio.to_thread(self._fetch, symbol)
+        finally:
+            pending = self._resyncing.pop(symbol, [])
+        self._refill(symbol, added)
+        for k in pending:
+            self.on_kline(symbol, k)
+
+    def on_kline(self, symbol, k):
+        # MEXC kline 推播：t 為開盤秒數，o/h/l/c 價格，v 成交量（與 REST 第 6 欄相同）
+        if symbol in self._resyncing:
+            self._resyncing[symbol].append(k)
+            return
+        row = (int(k["t"]) * 1000, float(k["o"]), float(k["h"]), float(k["l"]), float(k["c"]), float(k["v"]))
+        ring = self.rings[symbol]
+        last = ring.last()
+        if last is not None and row[0] < last[0]:
+            return
+        if last is not None and row[0] > last[0]:
+            if row[0] - last[0] > self.step:
+                if time.monotonic() - self._resynced_at.get(symbol, float("-inf")) >= RESYNC_MIN_SEC:
+                    print(f"[Stream] {symbol} 推播缺口 {int((row[0] - last[0]) / self.step) - 1} 根，以 REST 補齊")
+                    self._resynced_at[symbol] = time.monotonic()
+                    self._resyncing[symbol] = [k]
+                    task = asyncio.get_running_loop().create_task(self._resync_later(symbol))
+                    self._resync_tasks.add(task)
+                    task.add_done_callback(self._resync_tasks.discard)
+                    return
+            else:
+                # 上一根已收盤：以 REST 原始格式（含收盤時間）寫進 K 線庫
+                self.stats["closed"] += self.stores[symbol].append([[*last, last[0] + self.step - 1]])
+        ring.upsert(row)
+        self.stats["klines"] += 1
+
+    def on_ticker(self, symbol, d):
+        # miniTicker：p 最新價、r 漲跌幅（小數）、v 成交額；轉成 REST /ticker/24hr 的欄位名
+        self.tickers[symbol] = {
+            "symbol": symbol,
+            "lastPrice": d.get("p"),
+            "priceChangePercent": str(round(float(d.get("r") or 0) * 100, 4)),
+            "quoteVolume": d.get("v"),
+            "ts": time.time(),
+        }
+        self._ticker_dirty = True
+        self.stats["tickers"] += 1
+
+    def handle(self, raw):
+        msg = json.loads(raw)
+        channel = msg.get("c", "")
+        self.stats["messages"] += 1
+        if ".kline." in channel:
+            self.on_kline(msg["s"], msg["d"]["k"])
+        elif ".miniTicker." in channel:
+            self.on_ticker(msg["s"], msg["d"])
+        elif msg.get("code"):
+            print(f"[Stream] 伺服器回應錯誤：{msg}")
+
+    def flush_tickers(self):
+        if not self._ticker_dirty:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / TICKER_FILE
+        tmp = path.with_name(TICKER_FILE + ".tmp")
+        tmp.write_text(json.dumps(self.tickers))
+        os.replace(tmp, path)
+        self._ticker_dirty = False
+
+    def subscriptions(self):
+        params = []
+        for s in self.symbols:
+            params.append(KLINE_CHANNEL.format(symbol=s, interval=WS_INTERVALS[self.interval]))
+            params.append(TICKER_CHANNEL.format(symbol=s))
+        return {"method": "SUBSCRIPTION", "params": params}
+
+    async def _keepalive(self, ws):
+        while True:
+            await asyncio.sleep(PING_SEC)
+            await ws.send(json.dumps({"method": "PING"}))
+
+    async def _ticker_writer(self):
+        while True:
+            await asyncio.sleep(TICKER_FLUSH_SEC)
+            self.flush_tickers()
+
+    async def _session(self, websockets):
+        for symbol in self.symbols:
+            await asyncio.to_thread(self.resync, symbol)
+        async with websockets.connect(self.url, ping_interval=None, max_queue=None) as ws:
+            await ws.send(json.dumps(self.subscriptions()))
+            print(f"[Stream] 已連線 {self.url}，訂閱 {len(self.symbols)} 個幣種")
+            tasks = [asyncio.create_task(self._keepalive(ws)), asyncio.create_task(self._ticker_writer())]
+            try:
+                async for raw in ws:
+                    self.handle(raw)
+            finally:
+                # 重連時會整批重新補抓，進行中的缺口補抓與暫存的推播直接放棄
+                for task in tasks + list(self._resync_tasks):
+                    task.cancel()
+                self.flush_tickers()
+
+    async def run(self):
+        # 斷線後指數退避（加隨機抖動）重連；連線維持超過 RECONNECT_MAX_SEC 才把退避歸零
+        import websockets
+        backoff = RECONNECT_MIN_SEC
+        while True:
+            started = time.monotonic()
+            try:
+                await self._session(websockets)
+                print("[Stream] 伺服器關閉連線")
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                print(f"[Stream] 連線中斷：{e}")
+            if time.monotonic() - started > RECONNECT_MAX_SEC:
+                backoff = RECONNECT_MIN_SEC
+            delay = backoff * (1 + random.random() * 0.5)
+            print(f"[Stream] {round(delay, 1)} 秒後重連")
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, RECONNECT_MAX_SEC)
+
+
+async def run_for(ingestor, duration=None):
+    if duration is None:
+        await ingestor.run()
+        return
+    try:
+        await asyncio.wait_for(ingestor.run(), duration)
+    except asyncio.TimeoutError:
+        pass
+    ingestor.flush_tickers()
+
+
+if __name__ == "__main__":
+    # 用法：python3 kline_stream.py [--symbols A,B] [--interval 1m] [--url ws://127.0.0.1:8765] [--duration 秒]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", default=None)
+    parser.add_argument("--interval", default="1m", choices=list(WS_INTERVALS))
+    parser.add_argument("--url", default=WS_URL)
+    parser.add_argument("--duration", type=float, default=None)
+    args = parser.parse_args()
+
+    lock = open(LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("[Stream] 已有接收器在運行中，略過啟動")
+        exit(0)
+
+    symbols = args.symbols.split(",") if args.symbols else active_symbols()
+    ingestor = StreamIngestor(symbols, args.interval, args.url)
+    try:
+        asyncio.run(run_for(ingestor, args.duration))
+    except KeyboardInterrupt:
+        print("\n[Stream] 偵測到中斷，準備離開...")
+    finally:
+        print(f"[Stream] 結束：{ingestor.stats}")
@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from column_store import ColumnStore
+
+# 長期分析用的欄式表：每欄一個 append-only 的原始二進位檔（與 kline_store 共用 column_store），
+# 字串欄以字典編碼存成 int32 代碼。history 來自記憶中的逐輪紀錄（記憶只保留最近 30 輪），
+# rounds 來自每輪封存的 king.json / king_performance.json。兩者都以遞增主鍵做增量匯出。
+ANALYTICS_PATH = Path("~/Killcore/analytics").expanduser()
+CATEGORY = "category"
+MISSING_INT = -1
+METRIC_COLUMNS = {
+    "return_pct": np.float64,
+    "net_profit": np.float64,
+    "drawdown": np.float64,
+    "sharpe": np.float64,
+    "win_rate": np.float64,
+    "trade_count": np.int64,
+}
+TABLES = {
+    "history": {
+        "rid": np.int64,
+        "generation": np.int64,
+        "ts": np.int64,
+        "symbol": CATEGORY,
+        "style": CATEGORY,
+        "fail_reason": CATEGORY,
+        **METRIC_COLUMNS,
+    },
+    "rounds": {
+        "round": np.int64,
+        "ts": np.int64,
+        "generation": np.int64,
+        "symbol": CATEGORY,
+        "style": CATEGORY,
+        **METRIC_COLUMNS,
+        "new_bytes": np.int64,
+    },
+}
+# 主鍵：單調遞增，最後一列即增量匯出的水位
+KEYS = {"history": "rid", "rounds": "round"}
+# by 可用的時間分桶（毫秒）；依本地時區的整點／午夜切分
+TIME_BUCKETS = {"hour": 3_600_000, "day": 86_400_000}
+HISTORY_SCAN = 64
+
+
+def to_ms(value):
+    # ISO 字串、datetime 或毫秒整數 → 毫秒
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp() * 1000)
+
+
+def _dtype(kind):
+    return np.dtype(np.int32 if kind == CATEGORY else kind)
+
+
+class AnalyticsTable(ColumnStore):
+    """單一分析表：欄式 append-only 檔案（column_store）、字典編碼的字串欄，以及篩選與分組彙總。"""
+
+    def __init__(self, name, root=ANALYTICS_PATH):
+        self.name = name
+        self.schema = TABLES[name]
+        self.key = KEYS[name]
+        self._dicts = {}
+        super().__init__(Path(root) / name, {col: _dtype(kind) for col, kind in self.schema.items()})
+
+    def dictionary(self, col):
+        if col not in self._dicts:
+            f = self.path / f"{col}.dict.json"
+            self._dicts[col] = json.loads(f.read_text()) if f.exists() else []
+        return self._dicts[col]
+
+    def last_key(self):
+        return self._last(self.key)
+
+    def _encode(self, records):
+        out = {}
+        for col, kind in self.schema.items():
+            values = [r.get(col) for r in records]
+            if kind == CATEGORY:
+                words = self.dictionary(col)
+                index = {w: i for i, w in enumerate(words)}
+                codes = []
+                for v in values:
+                    if v is None:
+                        codes.append(MISSING_INT)
+                        continue
+                    v = str(v)
+                    if v not in index:
+                        index[v] = len(words)
+                        words.append(v)
+                    codes.append(index[v])
+                out[col] = np.asarray(codes, dtype=np.int32)
+            elif np.dtype(kind).kind == "f":
+                out[col] = np.asarray([np.nan if v is None else v for v in values], dtype=kind)
+            else:
+                out[col] = np.asarray([MISSING_INT if v is None else v for v in values], dtype=kind)
+        return out
+
+    def _save_dictionaries(self):
+        for col, kind in self.schema.items():
+            if kind == CATEGORY:
+                f = self.path / f"{col}.dict.json"
+                tmp = f.with_name(f.name + ".tmp")
+                tmp.write_text(json.dumps(self.dictionary(col), ensure_ascii=False))
+                os.replace(tmp, f)
+
+    def append(self, records):
+        # 只附加主鍵大於目前水位的紀錄；字典先落地再寫欄位，代碼永遠可解
+        with self.locked():
+            last = self.last_key()
+            rows = sorted((r for r in records if r.get(self.key) is not None and (last is None or r[self.key] > last)),
+                          key=lambda r: r[self.key])
+            if not rows:
+                return 0
+            self._dicts = {}
+            encoded = self._encode(rows)
+            self._save_dictionaries()
+            self._append(encoded)
+        return len(rows)
+
+    def merge(self, records):
+        # 依主鍵聯集（已有的列保留不動），整表依主鍵重排後以新世代整批換入；供回補水位以下的舊紀錄，
+        # append 只收水位以上的主鍵，對非空表回補會全部略過
+        with self.locked():
+            self._dicts = {}
+            self._maps = None
+            cols = self.columns()
+            have = set(np.asarray(cols[self.key]).tolist())
+            rows = list({r[self.key]: r for r in records
+                         if r.get(self.key) is not None and r[self.key] not in have}.values())
+            if not rows:
+                self._maps = None
+                return 0
+            encoded = self._encode(rows)
+            self._save_dictionaries()
+            order = np.argsort(np.concatenate([cols[self.key], encoded[self.key]]), kind="stable")
+            self._swap({col: np.concatenate([cols[col], encoded[col]])[order] for col in self.schema})
+        return len(rows)
+
+    # === 查詢 ===
+
+    def _codes_of(self, col, values):
+        index = {w: i for i, w in enumerate(self.dictionary(col))}
+        return [index[str(v)] for v in values if str(v) in index]
+
+    def mask(self, where=None):
+        # where：{欄位: 值 | [值...] | (下限, 上限)}；範圍含兩端、None 表示不設限，ts 可用 ISO 字串或 datetime
+        cols = self.columns()
+        mask = np.ones(len(cols[self.key]), dtype=bool)
+        for col, cond in (where or {}).items():
+            x = cols[col]
+            if isinstance(cond, tuple):
+                lo, hi = (to_ms(c) if col == "ts" else c for c in cond)
+                if lo is not None:
+                    mask &= x >= lo
+                if hi is not None:
+                    mask &= x <= hi
+                continue
+            values = cond if isinstance(cond, list) else [cond]
+            if self.schema[col] == CATEGORY:
+                values = self._codes_of(col, values)
+            mask &= np.isin(x, values)
+        return mask
+
+    def _group_column(self, name, idx):
+        if name in TIME_BUCKETS:
+            # 先換成本地時間再切桶，"day" 才會從本地午夜開始；時區偏移依各列所在的小時查一次（含夏令時間）
+            ts = np.asarray(self.columns()["ts"][idx])
+            hours, inverse = np.unique(ts // 3_600_000, return_inverse=True)
+            offset = np.array([time.localtime(int(h) * 3600).tm_gmtoff * 1000 for h in hours], dtype=np.int64)
+            offset = offset[inverse.reshape(-1)] if len(ts) else np.zeros(0, dtype=np.int64)
+            size = TIME_BUCKETS[name]
+            return (ts + offset) // size * size - offset
+        return self.columns()[name][idx]
+
+    def _decode(self, name, value):
+        if name in TIME_BUCKETS:
+            return datetime.fromtimestamp(value / 1000).isoformat()
+        if self.schema[name] == CATEGORY:
+            return self.dictionary(name)[value] if value >= 0 else None
+        return int(value)
+
+    def aggregate(self, metrics, by=(), where=None):
+        """分組彙總。metrics 如 ["count", "return_pct:mean", "drawdown:max"]，
+        彙總方式有 sum / mean / min / max / std；by 為欄位名稱或 "hour" / "day" 時間分桶。"""
+        by = (by,) if isinstance(by, str) else tuple(by)
+        idx = np.flatnonzero(self.mask(where))
+        if by:
+            # 每個分組欄各自因子化後合成單一整數鍵，避免 np.unique(axis=0) 的逐列比較
+            levels, combined = [], np.zeros(len(idx), dtype=np.int64)
+            for b in by:
+                values, codes = np.unique(self._group_column(b, idx).astype(np.int64), return_inverse=True)
+                levels.append(values)
+                combined = combined * len(values) + codes.reshape(-1)
+            flat, inverse = np.unique(combined, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            groups = np.empty((len(flat), len(by)), dtype=np.int64)
+            for j in range(len(by) - 1, -1, -1):
+                groups[:, j] = levels[j][flat % len(levels[j])]
+                flat = flat // len(levels[j])
+        else:
+            groups, inverse = np.zeros((1, 0), dtype=np.int64), np.zeros(len(idx), dtype=np.intp)
+        n = len(groups)
+        out = [{b: self._decode(b, g[j]) for j, b in enumerate(by)} for g in groups]
+        cols = self.columns()
+        for spec in metrics:
+            if spec == "count":
+                for row, v in zip(out, np.bincount(inverse, minlength=n)):
+                    row["count"] = int(v)
+                continue
+            col, how = spec.split(":")
+            x = cols[col][idx].astype(np.float64)
+            if self.schema[col] != CATEGORY and np.dtype(self.schema[col]).kind == "i":
+                x[x == MISSING_INT] = np.nan
+            ok = ~np.isnan(x)
+            g, x = inverse[ok], x[ok]
+            count = np.bincount(g, minlength=n)
+            total = np.bincount(g, weights=x, minlength=n)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = total / count
+                if how == "sum":
+                    values = total
+                elif how == "mean":
+                    values = mean
+                elif how == "std":
+                    values = np.sqrt(np.bincount(g, weights=(x - mean[g]) ** 2, minlength=n) / count)
+                elif how in ("min", "max"):
+                    values = np.full(n, np.inf if how == "min" else -np.inf)
+                    (np.minimum if how == "min" else np.maximum).at(values, g, x)
+                    values[count == 0] = np.nan
+                else:
+                    raise ValueError(f"未知的彙總方式：{how}")
+            name = f"{col}_{how}"
+            for row, v in zip(out, values):
+                row[name] = None if np.isnan(v) else round(float(v), 6)
+        return out
+
+
+# === 匯出 ===
+
+def history_record(r):
+    return {col: to_ms(r.get(col)) if col == "ts" else r.get(col) for col in TABLES["history"]}
+
+
+def round_record(round_num, manifest, king, perf):
+    return {
+        "round": round_num,
+        "ts": to_ms(manifest.get("ts")),
+        "generation": king.get("generation"),
+        "symbol": perf.get("symbol") or king.get("symbol"),
+        "style": king.get("style_profile"),
+        **{k: perf.get(k) for k in METRIC_COLUMNS},
+        "new_bytes": manifest.get("new_bytes"),
+    }
+
+
+def export_history(memory, table):
+    # 記憶中的 history 依 rid 遞增；從尾端往前取到水位為止
+    last = table.last_key()
+    if last is None:
+        rows = memory.all("history")
+    else:
+        n = HISTORY_SCAN
+        rows = memory.tail("history", n)
+        while len(rows) == n and (rows[0].get("rid") or 0) > last:
+            n *= 2
+            rows = memory.tail("history", n)
+    return table.append([history_record(r) for r in rows])
+
+
+def _read_json(archive, round_num, name, default=None):
+    try:
+        return json.loads(archive.read_file(round_num, name))
+    except KeyError:
+        return default
+
+
+def export_rounds(archive, table, with_history=None):
+    # 已被 prune 的 manifest 直接略過；with_history 為 history 表時一併從封存的 king_memory.json 回補
+    start = (table.last_key() or 0) + 1
+    records, history = [], {}
+    for round_num in range(start, archive.last_round() + 1):
+        if not archive.manifest_path(round_num).exists():
+            continue
+        manifest = archive.load_manifest(round_num)
+        king = _read_json(archive, round_num, "king.json", {})
+        perf = _read_json(archive, round_num, "king_performance.json", {})
+        records.append(round_record(round_num, manifest, king, perf))
+        if with_history is not None:
+            memory = _read_json(archive, round_num, "king_memory.json", {})
+            # 相鄰輪次的記憶大多重疊，以 rid 去重
+            history.update((r.get("rid"), history_record(r)) for r in memory.get("history", []))
+    added = table.append(records)
+    if with_history is not None:
+        # 封存中的 history 多半早於現有水位，以主鍵合併而非 append
+        with_history.merge(list(history.values()))
+    return added
+
+
+def export(root, memory=None):
+    # 每輪封存後呼叫：匯出新封存的輪次與記憶中新增的 history，回傳 {表名: 新增列數}
+    from round_archive import RoundArchive
+    root = Path(root)
+    analytics = root / "analytics"
+    rounds = export_rounds(RoundArchive(root / "archives"), AnalyticsTable("rounds", analytics))
+    history = export_history(memory, AnalyticsTable("history", analytics)) if memory is not None else 0
+    return {"rounds": rounds, "history": history}
+
+
+if __name__ == "__main__":
+    # 用法：python3 analytics_store.py backfill                 從所有封存回補 rounds 與 history
+    #      python3 analytics_store.py query history --by style --metrics count,return_pct:mean
+    #             [--where '{"symbol": "SHIBUSDT", "ts": ["2024-01-01", null]}']
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["backfill", "query"])
+    parser.add_argument("table", nargs="?", default="history", choices=list(TABLES))
+    parser.add_argument("--by", default="")
+    parser.add_argument("--metrics", default="count,return_pct:mean,drawdown:mean,win_rate:mean")
+    parser.add_argument("--where", default="{}")
+    parser.add_argument("--root", default=str(ANALYTICS_PATH.parent))
+    args = parser.parse_args()
+
+    root = Path(args.root)
+    if args.command == "backfill":
+        from round_archive import RoundArchive
+        history = AnalyticsTable("history", root / "analytics")
+        added = export_rounds(RoundArchive(root / "archives"), AnalyticsTable("rounds", root / "analytics"), history)
+        print(f"[Analytics] 回補 {added} 輪，history 共 {len(history)} 列")
+    else:
+        where = {k: tuple(v) if isinstance(v, list) and len(v) == 2 and k in ("ts", "generation", "rid", "round") else v
+                 for k, v in json.loads(args.where).items()}
+        table = AnalyticsTable(args.table, root / "analytics")
+        for row in table.aggregate(args.metrics.split(","), [b for b in args.by.split(",") if b], where):
+            print(json.dumps(row, ensure_ascii=False))
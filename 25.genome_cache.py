@@ -0,0 +1,171 @@
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+# 基因內容雜湊、適應度快取與血統索引（同一個 SQLite 檔，放在狀態根目錄）。
+# 適應度以 (評估用雜湊, symbol, K 線視窗指紋) 為鍵，超過 MAX_ENTRIES 時淘汰最久未用者；
+# 血統索引記錄每次進化的 親代 → 子代，祖先查詢每代一次索引查找，不必掃描 evolution_trace。
+CACHE_DB = "genome_cache.db"
+GENOME_FIELDS = ("parameters", "risk_tolerance", "style_profile", "decision_weighting_map")
+# 回測只看參數，風險容忍度／風格／權重不影響結果；適應度快取只以參數計算雜湊，權重突變後仍可命中
+EVAL_FIELDS = ("parameters",)
+FLOAT_DIGITS = 6
+MAX_ENTRIES = 200_000
+EVICT_TO = 0.9
+
+
+def genome_of(king):
+    return {
+        "parameters": dict(king.get("parameters", {})),
+        "risk_tolerance": king.get("risk_tolerance", 0.5),
+        "style_profile": king.get("style_profile", "balanced"),
+        "decision_weighting_map": dict(king.get("decision_weighting_map", {})),
+    }
+
+
+def _canonical(value):
+    # 數值一律轉 float 並取固定位數，15 與 15.0、浮點誤差不同的同一組參數得到相同雜湊
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), FLOAT_DIGITS)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return round(float(value), FLOAT_DIGITS)
+
+
+def genome_hash(genome, fields=GENOME_FIELDS):
+    payload = json.dumps({f: _canonical(genome.get(f)) for f in fields}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def window_fingerprint(bars, interval, fee_rate, slippage):
+    # 已收盤 K 線不會變動：根數與頭尾 open time 即可識別視窗，成本模型也併入
+    open_time = bars["open_time"]
+    if not len(open_time):
+        return f"{interval}:0"
+    return f"{interval}:{len(open_time)}:{int(open_time[0])}:{int(open_time[-1])}:{fee_rate}:{slippage}"
+
+
+class GenomeCache:
+    """適應度快取（LRU 上限 MAX_ENTRIES 筆）與血統索引。"""
+
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(str(self.path), timeout=30)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fitness (
+                genome_hash TEXT, symbol TEXT, window TEXT,
+                fitness REAL, metrics TEXT, created REAL, last_used REAL, hits INTEGER DEFAULT 0,
+                UNIQUE (genome_hash, symbol, window)
+            );
+            CREATE INDEX IF NOT EXISTS fitness_lru ON fitness (last_used);
+            CREATE TABLE IF NOT EXISTS lineage (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                genome_hash TEXT, parent_hash TEXT, symbol TEXT, generation INTEGER,
+                style_profile TEXT, intent TEXT, ts TEXT
+            );
+            CREATE INDEX IF NOT EXISTS lineage_child ON lineage (genome_hash, seq);
+            CREATE INDEX IF NOT EXISTS lineage_parent ON lineage (parent_hash);
+        """)
+        self.conn.commit()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    # === 適應度快取 ===
+
+    def get_many(self, symbol, window, hashes):
+        # 回傳 {雜湊: (fitness, metrics)}；命中者更新最近使用時間
+        hashes = list(set(hashes))
+        found = {}
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT genome_hash, fitness, metrics FROM fitness WHERE symbol = ? AND window = ? "
+                f"AND genome_hash IN ({','.join('?' * len(batch))})", (symbol, window, *batch))
+            found.update((h, (f, json.loads(m))) for h, f, m in rows)
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE fitness SET last_used = ?, hits = hits + 1 WHERE genome_hash = ? AND symbol = ? AND window = ?",
+                [(now, h, symbol, window) for h in found])
+            self.conn.commit()
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(hashes) - len(found)
+        return found
+
+    def put_many(self, symbol, window, results):
+        # results：{雜湊: (fitness, metrics)}
+        if not results:
+            return
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO fitness (genome_hash, symbol, window, fitness, metrics, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(h, symbol, window, f, json.dumps(m), now, now) for h, (f, m) in results.items()])
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        # 超過上限時一次淘汰到 EVICT_TO，避免每次寫入都觸發
+        count = self.conn.execute("SELECT COUNT(*) FROM fitness").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        n = count - int(self.max_entries * EVICT_TO)
+        self.conn.execute(
+            "DELETE FROM fitness WHERE rowid IN (SELECT rowid FROM fitness ORDER BY last_used LIMIT ?)", (n,))
+        self.stats["evicted"] += n
+
+    # === 血統索引 ===
+
+    def add_lineage(self, genome_hash, parent_hash, symbol, generation, style_profile, intent, ts):
+        cur = self.conn.execute(
+            "INSERT INTO lineage (genome_hash, parent_hash, symbol, generation, style_profile, intent, ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (genome_hash, parent_hash, symbol, generation, style_profile, json.dumps(intent, ensure_ascii=False), ts))
+        self.conn.commit()
+        return cur.lastrowid
+
+    def _node(self, row):
+        seq, child, parent, symbol, generation, style, intent, ts = row
+        return {"seq": seq, "genome_hash": child, "parent_hash": parent, "symbol": symbol, "generation": generation,
+                "style_profile": style, "intent": json.loads(intent), "ts": ts}
+
+    def last_seq(self):
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM lineage").fetchone()[0]
+
+    def lineage_since(self, seq):
+        # 序號大於 seq 的進化節點（依序），給 memory_regulator 增量更新血統保護
+        rows = self.conn.execute("SELECT * FROM lineage WHERE seq > ? ORDER BY seq", (seq,))
+        return [self._node(r) for r in rows]
+
+    def latest(self, genome_hash):
+        row = self.conn.execute(
+            "SELECT * FROM lineage WHERE genome_hash = ? ORDER BY seq DESC LIMIT 1", (genome_hash,)).fetchone()
+        return self._node(row) if row else None
+
+    def ancestors(self, genome_hash, limit=None):
+        # 由子代往上追溯：每一步找序號更早、雜湊為親代的最新節點
+        node = self.latest(genome_hash)
+        chain = []
+        while node is not None and node["parent_hash"] and (limit is None or len(chain) < limit):
+            row = self.conn.execute(
+                "SELECT * FROM lineage WHERE genome_hash = ? AND seq < ? ORDER BY seq DESC LIMIT 1",
+                (node["parent_hash"], node["seq"])).fetchone()
+            if row is None:
+                break
+            node = self._node(row)
+            chain.append(node)
+        return chain
+
+    def children(self, genome_hash):
+        rows = self.conn.execute("SELECT * FROM lineage WHERE parent_hash = ? ORDER BY seq", (genome_hash,))
+        return [self._node(r) for r in rows if r[1] != genome_hash]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,303 @@
+import argparse
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import requests
+
+from kline_store import API_URL, COLUMNS, FETCH_LIMIT, INTERVAL_MS, STORE_PATH, KlineStore
+
+# 歷史 K 線回補工具：把 [now - days, now) 切成每頁 FETCH_LIMIT 根的固定區段，由新到舊、多個 symbol / interval
+# 交錯並行抓取。全體共用一個連線池與令牌桶，429 / 5xx / 連線錯誤以指數退避重試。
+# 每頁結果先寫進該 K 線庫目錄下的暫存檔（n × 6 float64）並更新檢查點，中斷後重跑只補未完成的頁；
+# 全部頁完成後才一次併入欄式 K 線庫（kline_store.KlineStore.merge）。
+# 可用 --url 指向本機的替身 HTTP 伺服器測試。
+BACKFILL_DAYS = 30
+MAX_WORKERS = 8
+RATE_LIMIT_PER_SEC = float(os.environ.get("KILLCORE_BACKFILL_RATE", "10"))
+RATE_BURST = 20
+MAX_RETRIES = 6
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+CHECKPOINT_FILE = "backfill.json"
+STAGING_FILE = "backfill.bin"
+LOCK_FILE = "backfill.lock"
+PROGRESS_EVERY = 50
+
+_stats_lock = threading.Lock()
+
+
+def _count(stats, key, n=1):
+    with _stats_lock:
+        stats[key] += n
+
+
+class BackfillJob:
+    """單一 symbol / interval 的回補：頁面清單、暫存檔與檢查點。
+
+    檢查點記錄時間範圍、已完成的頁（以頁起點毫秒表示）與暫存檔筆數；
+    重跑時暫存檔截到檢查點筆數（寫入後、存檢查點前當機的那頁會重抓）。
+    """
+
+    def __init__(self, symbol, interval, start_ms, end_ms, root=STORE_PATH, fresh=False):
+        self.symbol = symbol
+        self.interval = interval
+        self.step = INTERVAL_MS[interval]
+        self.store = KlineStore(symbol, interval, root)
+        self.checkpoint = self.store.path / CHECKPOINT_FILE
+        self.staging = self.store.path / STAGING_FILE
+        self.lock = threading.Lock()
+        self.failed = 0
+        self.error = None
+
+        saved = None if fresh else self._load()
+        if saved and not saved.get("merged"):
+            # 未完成的回補沿用原本的時間範圍，否則「現在」一變所有頁界都會錯開
+            start_ms, end_ms = saved["start"], saved["end"]
+            print(f"[Backfill] {symbol} {interval} 由檢查點續跑（已完成 {len(saved['done'])} 頁）")
+        else:
+            saved = None
+        self.start = int(start_ms) // self.step * self.step
+        self.end = int(end_ms) // self.step * self.step
+        self.done = set(saved["done"]) if saved else set()
+        self.rows = saved["rows"] if saved else 0
+        self.floor = saved.get("floor") if saved else None
+
+        expected = self.rows * len(COLUMNS) * 8
+        size = self.staging.stat().st_size if self.staging.exists() else 0
+        if size > expected:
+            os.truncate(self.staging, expected)
+        elif size < expected:
+            # 暫存檔遺失或被截短：已完成頁不可信，整段重抓
+            self.done, self.rows, self.floor = set(), 0, None
+            self.staging.unlink(missing_ok=True)
+        self.pages = [p for p in self._page_starts() if p not in self.done and not self._covered(p)]
+        self.pending = len(self.pages)
+
+    def _load(self):
+        try:
+            return json.loads(self.checkpoint.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, merged=False):
+        tmp = self.checkpoint.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "symbol": self.symbol,
+            "interval": self.interval,
+            "start": self.start,
+            "end": self.end,
+            "done": sorted(self.done),
+            "rows": self.rows,
+            "floor": self.floor,
+            "merged": merged,
+            "ts": datetime.now().isoformat(),
+        }))
+        os.replace(tmp, self.checkpoint)
+
+    def _page_starts(self):
+        # 由新到舊；最舊一頁可能不滿 FETCH_LIMIT 根
+        span = FETCH_LIMIT * self.step
+        page_end = self.end
+        while page_end > self.start:
+            yield max(page_end - span, self.start)
+            page_end -= span
+
+    def page_end(self, page_start):
+        return min(page_start + FETCH_LIMIT * self.step, self.end)
+
+    def _covered(self, page_start):
+        # 本地 K 線庫已有整頁連續資料時不必再抓
+        open_time = self.store.columns()["open_time"]
+        lo = np.searchsorted(open_time, page_start, side="left")
+        hi = np.searchsorted(open_time, self.page_end(page_start), side="left")
+        return hi - lo == (self.page_end(page_start) - page_start) // self.step
+
+    def skip(self, page_start):
+        # 比「上市前」空頁更早的頁、或已遇到不可重試錯誤（如無效 symbol）的 job 不必再打 API
+        return self.error is not None or (self.floor is not None and self.page_end(page_start) <= self.floor)
+
+    def record(self, page_start, klines):
+        # 只留頁範圍內的 K 線；空頁代表此前尚未上市，記為下限
+        rows = [k[:6] for k in klines if page_start <= int(k[0]) < self.page_end(page_start)]
+        with self.lock:
+            if rows:
+                raw = np.asarray(rows, dtype=np.float64)
+                with open(self.staging, "ab") as f:
+                    f.write(raw.tobytes())
+                self.rows += len(raw)
+            elif self.floor is None or self.page_end(page_start) > self.floor:
+                self.floor = self.page_end(page_start)
+            self.done.add(page_start)
+            self._save()
+        return len(rows)
+
+    def finish(self):
+        # 所有頁完成後一次併入 K 線庫；有失敗頁時保留暫存與檢查點等下次續跑
+        if self.failed or self.error:
+            print(f"[Backfill] {self.symbol} {self.interval} 有 {self.failed} 頁失敗，保留檢查點待重跑")
+            return 0
+        added = 0
+        if self.staging.exists():
+            raw = np.fromfile(self.staging, dtype=np.float64).reshape(-1, len(COLUMNS))
+            added = self.store.merge(raw)
+            self.staging.unlink()
+        self.rows = 0
+        self._save(merged=True)
+        print(f"[Backfill] {self.symbol} {self.interval} 併入 {added} 根，共 {len(self.store)} 根")
+        return added
+
+
+def fetch_page(session, api_url, job, page_start, stats):
+    # 429 / 5xx / 連線錯誤以指數退避（加隨機抖動）重試，有 Retry-After 時照其秒數；其餘 4xx 直接失敗
+    url = (f"{api_url}/api/v3/klines?symbol={job.symbol}&interval={job.interval}&limit={FETCH_LIMIT}"
+           f"&startTime={page_start}&endTime={job.page_end(page_start) - 1}")
+    for attempt in range(MAX_RETRIES + 1):
+        wait = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * 2 ** attempt) * random.uniform(0.5, 1)
+        try:
+            _count(stats, "requests")
+            res = session.get(url, timeout=10)
+            if res.status_code not in RETRY_STATUS:
+                res.raise_for_status()
+                return res.json()
+            error = requests.HTTPError(f"HTTP {res.status_code}", response=res)
+            try:
+                wait = max(wait, float(res.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        if attempt < MAX_RETRIES:
+            _count(stats, "retries")
+            time.sleep(wait)
+    raise error
+
+
+def _interleave(jobs):
+    # 各 job 的頁輪流排入，所有 symbol 同時往回推進
+    queues = [[(job, p) for p in job.pages] for job in jobs]
+    for i in range(max((len(q) for q in queues), default=0)):
+        for q in queues:
+            if i < len(q):
+                yield q[i]
+
+
+def backfill(jobs, session, api_url=API_URL, workers=MAX_WORKERS):
+    stats = {"requests": 0, "retries": 0, "pages": 0, "skipped": 0, "failed": 0, "rows": 0, "merged": 0}
+    start = time.time()
+
+    def run_page(job, page_start):
+        if job.skip(page_start):
+            return None
+        return job.record(page_start, fetch_page(session, api_url, job, page_start, stats))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_page, job, p): job for job, p in _interleave(jobs)}
+        for job in jobs:
+            if not job.pending:
+                stats["merged"] += job.finish()
+        try:
+            for job in _drain(futures, stats, start):
+                stats["merged"] += job.finish()
+        except KeyboardInterrupt:
+            # 已排隊的頁直接取消，只等執行中的頁寫完檢查點
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    stats["secs"] = round(time.time() - start, 2)
+    return stats
+
+
+def _drain(futures, stats, start):
+    # 依完成順序統計各頁結果，某個 job 的頁全部結束時交出該 job 讓呼叫端併入 K 線庫
+    for future in as_completed(futures):
+        job = futures[future]
+        try:
+            n = future.result()
+            if n is None:
+                stats["skipped"] += 1
+            else:
+                stats["pages"] += 1
+                stats["rows"] += n
+        except requests.RequestException as e:
+            job.failed += 1
+            stats["failed"] += 1
+            response = getattr(e, "response", None)
+            if response is not None and response.status_code not in RETRY_STATUS:
+                if job.error is None:
+                    print(f"[Backfill] {job.symbol} {job.interval} 無法回補，略過其餘頁：{e}")
+                job.error = str(e)
+            else:
+                print(f"[Backfill] {job.symbol} {job.interval} 抓取失敗：{e}")
+        job.pending -= 1
+        if not job.pending:
+            yield job
+        done = stats["pages"] + stats["skipped"] + stats["failed"]
+        if done % PROGRESS_EVERY == 0:
+            elapsed = time.time() - start
+            print(f"[Backfill] {done}/{len(futures)} 頁｜{stats['rows']} 根｜{stats['rows'] / elapsed:.0f} 根/秒")
+
+
+def acquire(symbol, interval, root=STORE_PATH):
+    # 同一 K 線庫同時只允許一個回補行程；須在建立 BackfillJob（會截斷暫存檔）之前取得
+    path = Path(root) / f"{symbol}_{interval}"
+    path.mkdir(parents=True, exist_ok=True)
+    lock = open(path / LOCK_FILE, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+if __name__ == "__main__":
+    # 用法：python3 kline_backfill.py [--symbols A,B] [--intervals 1m,5m] [--days 90] [--url http://127.0.0.1:8000]
+    #                                 [--workers 8] [--rate 10] [--fresh]
+    from king_orchestrator import PooledSession
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", default=None)
+    parser.add_argument("--intervals", default="1m")
+    parser.add_argument("--days", type=float, default=BACKFILL_DAYS)
+    parser.add_argument("--url", default=API_URL)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT_PER_SEC)
+    parser.add_argument("--root", default=str(STORE_PATH))
+    parser.add_argument("--fresh", action="store_true", help="忽略檢查點重新回補")
+    args = parser.parse_args()
+
+    if args.symbols:
+        symbols = args.symbols.split(",")
+    else:
+        from kline_stream import active_symbols
+        symbols = active_symbols()
+    intervals = [i for i in args.intervals.split(",") if i in INTERVAL_MS]
+
+    end_ms = int(time.time() * 1000)
+    start_ms = end_ms - int(args.days * 86_400_000)
+    jobs, locks = [], []
+    for symbol in symbols:
+        for interval in intervals:
+            lock = acquire(symbol, interval, args.root)
+            if lock is None:
+                print(f"[Backfill] {symbol} {interval} 已有回補行程在運行中，略過")
+                continue
+            jobs.append(BackfillJob(symbol, interval, start_ms, end_ms, Path(args.root), args.fresh))
+            locks.append(lock)
+
+    session = PooledSession(rate=args.rate, pool_size=max(args.workers, 1))
+    print(f"[Backfill] {len(jobs)} 組 symbol/interval，{sum(j.pending for j in jobs)} 頁待抓")
+    try:
+        stats = backfill(jobs, session, args.url, args.workers)
+        print(f"[Backfill] 完成：{stats}")
+    except KeyboardInterrupt:
+        print("\n[Backfill] 偵測到中斷，檢查點已保存，重跑即可續傳")
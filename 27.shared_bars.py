@@ -0,0 +1,116 @@
+import itertools
+import os
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+# 多行程回測共用的 K 線：主行程把各組欄位陣列一次複製進同一塊 multiprocessing.shared_memory，
+# worker 初始化時依名稱掛上並取唯讀的 numpy 視圖，不再每個 worker 各收一份 pickle 副本。
+# 區塊名稱帶建立者 pid，主行程當機遺留的區塊在下次建立時清掉。
+BLOCK_PREFIX = "killcore_bars"
+ALIGN = 64
+SHM_DIR = Path("/dev/shm")
+
+# worker 端掛上的區塊；視圖引用其緩衝區，須與行程同壽
+_attached = []
+_serial = itertools.count()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def cleanup_stale():
+    # 清除建立者已不在的遺留區塊
+    if not SHM_DIR.exists():
+        return 0
+    removed = 0
+    for f in SHM_DIR.glob(f"{BLOCK_PREFIX}_*"):
+        try:
+            pid = int(f.name.split("_")[2])
+        except (IndexError, ValueError):
+            continue
+        if not _alive(pid):
+            f.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+class SharedBars:
+    """主行程端：{key: {欄位: 陣列}} 複製進單一共享記憶體區塊。
+
+    spec 是可 pickle 的小字典（區塊名稱與各欄位置），交給 worker 的 initializer 後以 attach() 取回視圖；
+    離開 with 區塊時關閉並刪除區塊，應包在行程池外層，讓 worker 先結束。
+    共享記憶體不可用時 spec 直接攜帶陣列，行為同原本的 initargs。
+    """
+
+    def __init__(self, bars):
+        self.shm = None
+        layout, offset = {}, 0
+        for key, cols in bars.items():
+            layout[key] = {}
+            for col, arr in cols.items():
+                arr = np.asarray(arr)
+                layout[key][col] = (offset, len(arr), arr.dtype.str)
+                offset += -(-arr.nbytes // ALIGN) * ALIGN
+        try:
+            cleanup_stale()
+            self.shm = shared_memory.SharedMemory(
+                name=f"{BLOCK_PREFIX}_{os.getpid()}_{next(_serial)}", create=True, size=max(offset, 1))
+        except OSError as e:
+            print(f"[Shared Bars] 無法建立共享記憶體，改為逐 worker 複製：{e}")
+            self.spec = {"inline": {k: {c: np.ascontiguousarray(a) for c, a in cols.items()} for k, cols in bars.items()}}
+            return
+        for key, cols in bars.items():
+            for col, arr in cols.items():
+                start, n, dtype = layout[key][col]
+                np.ndarray(n, dtype=dtype, buffer=self.shm.buf, offset=start)[:] = arr
+        self.spec = {"name": self.shm.name, "layout": layout}
+
+    @property
+    def nbytes(self):
+        return self.shm.size if self.shm else 0
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _open_block(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前沒有 track 參數；行程池的 worker 與主行程共用同一個 resource tracker，
+        # 重複登記不影響，區塊仍由主行程 unlink 時一併取消登記
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach(spec):
+    # worker 端：回傳 {key: {欄位: 唯讀視圖}}
+    if "inline" in spec:
+        return spec["inline"]
+    shm = _open_block(spec["name"])
+    _attached.append(shm)
+    bars = {}
+    for key, cols in spec["layout"].items():
+        bars[key] = {}
+        for col, (start, n, dtype) in cols.items():
+            view = np.ndarray(n, dtype=dtype, buffer=shm.buf, offset=start)
+            view.flags.writeable = False
+            bars[key][col] = view
+    return bars
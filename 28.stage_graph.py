@@ -0,0 +1,121 @@
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# 依讀寫宣告排程的單輪階段圖。每個階段為 dict：name、run（無參數的可呼叫物件）、reads、writes；
+# reads / writes 是 round_state 的狀態邏輯名稱，或 klines、genome_cache、archives 等共用資源名稱。
+# 階段 j 在清單中排在 i 之前，且兩者有讀後寫、寫後讀或寫後寫衝突時，i 必須等 j 完成；其餘可同時執行。
+# 沒有宣告的模組視為讀寫全部（ANY），與前後所有階段串行，等同原本的依序執行。
+ANY = "*"
+MAX_WORKERS = 4
+
+
+def declared(module):
+    # 模組以 STATE_READS / STATE_WRITES 宣告讀寫的狀態
+    reads = getattr(module, "STATE_READS", None)
+    writes = getattr(module, "STATE_WRITES", None)
+    if reads is None or writes is None:
+        return {ANY}, {ANY}
+    return set(reads), set(writes)
+
+
+def _overlap(a, b):
+    return bool(a & b) or (ANY in a and b) or (ANY in b and a)
+
+
+def conflicts(earlier, later):
+    return (_overlap(earlier["writes"], later["reads"] | later["writes"])
+            or _overlap(earlier["reads"], later["writes"]))
+
+
+def dependencies(stages):
+    # 每個階段 → 必須先完成的階段索引
+    return {i: {j for j in range(i) if conflicts(stages[j], stages[i])} for i in range(len(stages))}
+
+
+def critical_path(stages, timings):
+    # 依實際耗時找出最長的相依鏈：回傳 (秒數, [階段名稱])
+    deps = dependencies(stages)
+    best = {}
+    for i in range(len(stages)):
+        prev = max(deps[i], key=lambda j: best[j][0], default=None)
+        base, chain = best[prev] if prev is not None else (0.0, [])
+        best[i] = (base + timings.get(stages[i]["name"], 0.0), chain + [stages[i]["name"]])
+    return max(best.values(), default=(0.0, []))
+
+
+class StageOutput:
+    """並行執行時各階段的 print 先寫進自己執行緒的緩衝，階段結束後整段輸出，避免交錯。"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buf = getattr(self.local, "buf", None)
+        if buf is None:
+            return self.stream.write(text)
+        buf.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def begin(self):
+        self.local.buf = []
+
+    def end(self):
+        buf, self.local.buf = self.local.buf, None
+        with self.lock:
+            self.stream.write("".join(buf))
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def run_graph(stages, workers=MAX_WORKERS):
+    """執行階段圖，回傳各階段 wall 秒數；任一階段拋出例外時不再啟動新階段，等執行中的結束後拋出。
+
+    模組階段經 run_inprocess 執行，失敗時已撤回並印出、不會拋出，後續階段照常進行；
+    會走到這條錯誤路徑的只有不經 run_inprocess 的階段（archiver 的 flush / archive / analytics / prefetch）。
+    """
+    deps = dependencies(stages)
+    timings = {}
+    output = StageOutput(sys.stdout)
+
+    def call(stage):
+        output.begin()
+        t0 = time.perf_counter()
+        try:
+            stage["run"]()
+        finally:
+            timings[stage["name"]] = time.perf_counter() - t0
+            output.end()
+
+    started, done, error = set(), set(), None
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            while True:
+                if error is None:
+                    for i, stage in enumerate(stages):
+                        if i not in started and deps[i] <= done:
+                            started.add(i)
+                            running[pool.submit(call, stage)] = i
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    done.add(i)
+                    if future.exception() is not None and error is None:
+                        error = future.exception()
+    finally:
+        sys.stdout = output.stream
+    if error is not None:
+        raise error
+    return timings
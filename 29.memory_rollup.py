@@ -0,0 +1,252 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+from retention_engine import intent_key
+
+# 記憶分層彙總：evolution_trace / drift_history / intent_summary 近期保留原始紀錄，
+# 超過 raw_hours 的依時間併入每小時桶，超過 hourly_days 的每小時桶再併成每日桶，
+# 每日桶超過 max_daily 個時併入 total（全期彙總）。彙總存放於 king_memory 的 "rollups" 欄位：
+#   {kind: {"hourly": [桶], "daily": [桶], "total": 桶或 None, "first": 最早的原始紀錄}}
+# 桶內只放可相加的統計（次數表、n/sum/min/max），每小時併每日、每日併全期都是同一個 merge。
+# 意圖以 retention_engine.intent_key（每筆紀錄的整組意圖去掉數字後的雜湊）計數，intent_text 保留各鍵的一筆原文；
+# 每個次數表至多 TABLE_CAP 個鍵（其餘併入 other）。
+# min_raw：無論時間，最新幾筆一律保留原始紀錄（auto_grader / memory_recorder 只讀 tail）。
+ROLLUP_RULES = {
+    "evolution_trace": {"raw_hours": 24, "hourly_days": 7, "max_daily": 365, "min_raw": 50},
+    "drift_history": {"raw_hours": 24, "hourly_days": 7, "max_daily": 365, "min_raw": 20},
+    "intent_summary": {"raw_hours": 24, "hourly_days": 7, "max_daily": 365, "min_raw": 20},
+}
+# 例：KILLCORE_ROLLUP_RULES='{"evolution_trace": {"raw_hours": 6}}' 只覆寫指定的欄位
+RULES_OVERRIDE = os.environ.get("KILLCORE_ROLLUP_RULES", "")
+
+HOUR_FMT = "%Y-%m-%dT%H"
+DAY_FMT = "%Y-%m-%d"
+RESULT_PATTERN = re.compile(r"(-?[\d.]+)% / DD (-?[\d.]+)%")
+# 每個次數表最多保留的鍵數（含 other）；其餘併入 other，彙總大小不隨新鍵無限成長
+TABLE_CAP = 50
+OTHER = "other"
+
+
+def rollup_rules():
+    rules = {kind: dict(rule) for kind, rule in ROLLUP_RULES.items()}
+    if RULES_OVERRIDE:
+        for kind, rule in json.loads(RULES_OVERRIDE).items():
+            rules.setdefault(kind, {}).update(rule)
+    return rules
+
+
+def empty_bucket(key=None):
+    return {"bucket": key, "n": 0, "first_ts": None, "last_ts": None, "generations": None,
+            "styles": {}, "grades": {}, "intents": {}, "intent_text": {}, "drift": 0, "return_pct": None, "drawdown": None}
+
+
+def _count(table, key, k=1):
+    if key is not None:
+        table[str(key)] = table.get(str(key), 0) + k
+
+
+def _cap(table, cap=TABLE_CAP):
+    # 超過上限時保留次數最多的 cap - 1 個鍵，其餘併入 other
+    if len(table) <= cap:
+        return table
+    ranked = sorted((k for k in table if k != OTHER), key=lambda k: (-table[k], k))
+    rest = table.get(OTHER, 0) + sum(table.pop(k) for k in ranked[cap - 1:])
+    table[OTHER] = rest
+    return table
+
+
+def _count_intent(bucket, intent):
+    # intent 為一筆紀錄的意圖（字串或清單）；空意圖不計
+    if not intent:
+        return
+    key = intent_key(intent)
+    _count(bucket["intents"], key)
+    bucket["intent_text"].setdefault(key, " / ".join([intent] if isinstance(intent, str) else map(str, intent)))
+
+
+def _cap_intents(bucket):
+    _cap(bucket["intents"])
+    bucket["intent_text"] = {key: text for key, text in bucket["intent_text"].items() if key in bucket["intents"]}
+
+
+def _summary(acc, value):
+    if value is None:
+        return acc
+    value = float(value)
+    if acc is None:
+        return {"n": 1, "sum": value, "min": value, "max": value}
+    acc["n"] += 1
+    acc["sum"] += value
+    acc["min"] = min(acc["min"], value)
+    acc["max"] = max(acc["max"], value)
+    return acc
+
+
+def _entry_ts(entry):
+    # 舊紀錄沒有時間（drift_history 原本是風格清單、intent_summary 是字串）
+    if not isinstance(entry, dict):
+        return None
+    ts = entry.get("ts") or entry.get("timestamp")
+    try:
+        return datetime.fromisoformat(ts) if ts else None
+    except (TypeError, ValueError):
+        return None
+
+
+def add_entry(bucket, entry):
+    """把一筆原始紀錄計入桶。"""
+    bucket["n"] += 1
+    ts = _entry_ts(entry)
+    if ts is not None:
+        iso = ts.isoformat()
+        bucket["first_ts"] = min(bucket["first_ts"] or iso, iso)
+        bucket["last_ts"] = max(bucket["last_ts"] or iso, iso)
+    if isinstance(entry, str):
+        _count_intent(bucket, entry)
+        _cap_intents(bucket)
+        return bucket
+    if isinstance(entry, list):
+        for style in entry:
+            _count(bucket["styles"], style)
+        _cap(bucket["styles"])
+        bucket["drift"] += len(entry) > 1
+        return bucket
+
+    gen = entry.get("generation")
+    if isinstance(gen, int):
+        lo, hi = bucket["generations"] or (gen, gen)
+        bucket["generations"] = [min(lo, gen), max(hi, gen)]
+    styles = entry.get("styles")
+    if styles is not None:
+        for style in styles:
+            _count(bucket["styles"], style)
+        bucket["drift"] += len(styles) > 1
+    else:
+        _count(bucket["styles"], entry.get("style_profile") or entry.get("style"))
+    if entry.get("grade"):
+        # 評級字串如「A（穩定成長）」，只計等級本身
+        _count(bucket["grades"], entry["grade"].split("（")[0])
+    _count_intent(bucket, entry.get("intent"))
+    for table in ("styles", "grades"):
+        _cap(bucket[table])
+    _cap_intents(bucket)
+
+    ret, dd = entry.get("return_pct"), entry.get("drawdown")
+    if ret is None and isinstance(entry.get("result"), str):
+        # 舊的 memory_recorder 紀錄只有「x% / DD y%」字串
+        m = RESULT_PATTERN.match(entry["result"])
+        if m:
+            ret, dd = m.groups()
+    bucket["return_pct"] = _summary(bucket["return_pct"], ret)
+    bucket["drawdown"] = _summary(bucket["drawdown"], dd)
+    return bucket
+
+
+def merge(into, other):
+    """把 other 併入 into（每小時 → 每日 → 全期）。"""
+    into["n"] += other["n"]
+    for edge, pick in (("first_ts", min), ("last_ts", max)):
+        values = [v for v in (into[edge], other[edge]) if v]
+        into[edge] = pick(values) if values else None
+    if other["generations"]:
+        lo, hi = into["generations"] or other["generations"]
+        into["generations"] = [min(lo, other["generations"][0]), max(hi, other["generations"][1])]
+    for table in ("styles", "grades", "intents"):
+        for key, k in other[table].items():
+            _count(into[table], key, k)
+    for key, text in other["intent_text"].items():
+        into["intent_text"].setdefault(key, text)
+    for table in ("styles", "grades"):
+        _cap(into[table])
+    _cap_intents(into)
+    into["drift"] += other["drift"]
+    for metric in ("return_pct", "drawdown"):
+        a, b = into[metric], other[metric]
+        if b is None:
+            continue
+        if a is None:
+            into[metric] = dict(b)
+        else:
+            into[metric] = {"n": a["n"] + b["n"], "sum": a["sum"] + b["sum"],
+                            "min": min(a["min"], b["min"]), "max": max(a["max"], b["max"])}
+    return into
+
+
+def _fold(buckets, key, entry=None, bucket=None):
+    # buckets 依 key 排序；同 key 的桶併在一起
+    if buckets and buckets[-1]["bucket"] == key:
+        target = buckets[-1]
+    else:
+        target = next((b for b in buckets if b["bucket"] == key), None)
+        if target is None:
+            target = empty_bucket(key)
+            buckets.append(target)
+            buckets.sort(key=lambda b: b["bucket"])
+    if entry is not None:
+        add_entry(target, entry)
+    if bucket is not None:
+        merge(target, bucket)
+
+
+def compact(memory, kind, rule, now=None):
+    """依規則把 memory 中 kind 清單較舊的紀錄併入彙總，回傳 (併入筆數, 彙總)。"""
+    now = now or datetime.now()
+    rollups = memory.get("rollups") or {}
+    roll = rollups.get(kind) or {"hourly": [], "daily": [], "total": None, "first": None}
+
+    # 原始紀錄依時間附加，待彙總的是開頭一段：時間早於 raw_hours 或沒有時間的舊紀錄
+    raw_cutoff = now - timedelta(hours=rule["raw_hours"])
+    candidates = memory.head(kind, max(memory.count(kind) - rule["min_raw"], 0))
+    rolled = 0
+    for entry in candidates:
+        ts = _entry_ts(entry)
+        if ts is not None and ts >= raw_cutoff:
+            break
+        if roll["first"] is None:
+            roll["first"] = entry
+        if ts is None:
+            roll["total"] = add_entry(roll["total"] or empty_bucket("total"), entry)
+        else:
+            _fold(roll["hourly"], ts.strftime(HOUR_FMT), entry=entry)
+        rolled += 1
+
+    # 每小時桶 → 每日桶
+    hour_cutoff = (now - timedelta(days=rule["hourly_days"])).strftime(HOUR_FMT)
+    while roll["hourly"] and roll["hourly"][0]["bucket"] < hour_cutoff:
+        bucket = roll["hourly"].pop(0)
+        _fold(roll["daily"], bucket["bucket"][:len("YYYY-MM-DD")], bucket=bucket)
+
+    # 每日桶 → 全期
+    while len(roll["daily"]) > rule["max_daily"]:
+        roll["total"] = merge(roll["total"] or empty_bucket("total"), roll["daily"].pop(0))
+
+    if rolled:
+        memory.trim(kind, memory.count(kind) - rolled)
+    rollups[kind] = roll
+    memory.set("rollups", rollups)
+    return rolled, roll
+
+
+def compact_all(memory, rules=None, now=None):
+    rules = rules or rollup_rules()
+    return {kind: compact(memory, kind, rule, now)[0] for kind, rule in rules.items()}
+
+
+def overall(memory, kind):
+    """全期 + 每日 + 每小時彙總併成一個桶（不含仍在原始紀錄中的部分）。"""
+    roll = (memory.get("rollups") or {}).get(kind)
+    bucket = empty_bucket("overall")
+    if roll:
+        for b in ([roll["total"]] if roll["total"] else []) + roll["daily"] + roll["hourly"]:
+            merge(bucket, b)
+    return bucket
+
+
+def first_entry(memory, kind):
+    # 最早一筆：已被彙總時取彙總保留的原始紀錄
+    roll = (memory.get("rollups") or {}).get(kind)
+    if roll and roll["first"] is not None:
+        return roll["first"]
+    return (memory.head(kind, 1) or [None])[0]
@@ -1,109 +1,260 @@
-import json
+import os
+import copy
+import multiprocessing
 import random
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from pathlib import Path
-
-# 路徑設定
-king_path = Path("~/Killcore/modules/king.json").expanduser()
-perf_path = Path("~/Killcore/king_performance.json").expanduser()
-mem_path = Path("~/Killcore/king_memory.json").expanduser()
-market_path = Path("~/Killcore/market_status.json").expanduser()
-eval_path = Path("~/Killcore/king_self_evaluation.json").expanduser()
-
-# 載入資料
-king = json.loads(king_path.read_text())
-perf = json.loads(perf_path.read_text())
-memory = json.loads(mem_path.read_text()) if mem_path.exists() else {}
-market = json.loads(market_path.read_text()) if market_path.exists() else {}
-evaluation = json.loads(eval_path.read_text()) if eval_path.exists() else {}
-
-# 預設值補全
-memory.setdefault("evolution_trace", [])
-memory.setdefault("live_rounds", 0)
-memory.setdefault("learning_score", 0)
-memory.setdefault("style_history", [])
-memory.setdefault("drift_history", [])
-
-# 提升進化代數
-king["generation"] += 1
-intent_summary = []
-style_change = None
-
-# 市況判斷（trend + volatility）
-vol = market.get("btc_volatility", 0)
-trend = market.get("trend_score", 0)
-if trend > 0.6 and vol > 5:
-    market_type = "trend"
-elif vol > 6:
-    market_type = "volatile"
-elif trend < 0.4:
-    market_type = "sideway"
-else:
-    market_type = "stable"
-
-# 根據市況改變風格
-style = king.get("style_profile", "balanced")
-if market_type == "trend":
-    king["parameters"]["tp_pct"] *= 1.1
-    style = "explosive"
-    intent_summary.append("趨勢市 → 提升 TP% 並採爆發風格")
-elif market_type == "sideway":
-    king["parameters"]["sl_pct"] *= 0.9
-    style = "defensive"
-    intent_summary.append("震盪市 → 降低 SL% 並採防守風格")
-elif market_type == "volatile":
-    king["risk_tolerance"] = min(king.get("risk_tolerance", 0.5) + 0.05, 1.0)
-    intent_summary.append("高波動市 → 提高風險容忍")
-else:
-    intent_summary.append("穩定市 → 保持風格")
-
-# 自評進化策略：從模組 10 讀入 JSON 結果
-grade = evaluation.get("evolution_grade", "")
-trend_score = evaluation.get("trend_score", 0)
-
-if grade.startswith("S+"):
-    intent_summary.append("自評結果：實戰等級，凍結參數")
+
+from backtest_engine import backtest_ma_crossover, fitness
+from genome_cache import CACHE_DB, EVAL_FIELDS, GenomeCache, genome_hash, genome_of, window_fingerprint
+from kline_store import load_window
+from round_state import RoundState
+from shared_bars import SharedBars, attach
+
+# single：每輪依評級突變 king 一次
+# population：維持 N 個候選基因，多行程平行回測後做選擇／交配／突變，最佳者晉升為 king。
+# 適應度只由回測決定，而回測只用到 parameters，故族群只進化 parameters；
+# risk_tolerance、style_profile、decision_weighting_map 沿用 king 本身（沒有選擇壓力的欄位不算進化）
+EVOLUTION_MODE = os.environ.get("KILLCORE_EVOLUTION_MODE", "single")
+POPULATION_SIZE = 32
+GENERATIONS_PER_ROUND = 5
+ELITE_COUNT = 2
+TOURNAMENT_SIZE = 3
+KLINE_INTERVAL = "1m"
+KLINE_LIMIT = 1000
+# 評級 → 突變強度
+GRADE_SIGMA = {"A": 0.05, "B": 0.15, "C": 0.4}
+FEE_RATE = 0.001
+SLIPPAGE = 0.0015
+# 族群模式取窗時會同步 K 線庫，故 klines 也列為寫入
+STATE_READS = ("king", "performance", "memory", "market", "evaluation", "population", "klines", "genome_cache")
+STATE_WRITES = ("king", "population", "memory", "klines", "genome_cache")
+
+_worker_bars = None
+
+
+def mutate(genome, sigma):
+    g = copy.deepcopy(genome)
+    p = g["parameters"]
+    p["ma_slow"] = int(min(max(round(p.get("ma_slow", 45) * random.gauss(1, sigma)), 5), 240))
+    p["ma_fast"] = int(min(max(round(p.get("ma_fast", 15) * random.gauss(1, sigma)), 2), p["ma_slow"] - 1))
+    p["sl_pct"] = round(min(max(p.get("sl_pct", 3) * random.gauss(1, sigma), 0.3), 15), 3)
+    p["tp_pct"] = round(min(max(p.get("tp_pct", 6) * random.gauss(1, sigma), 0.5), 30), 3)
+    return g
+
+
+def crossover(a, b):
+    # 參數逐項均勻交配，ma_fast < ma_slow 由後續突變修正
+    child = copy.deepcopy(a)
+    for k in child["parameters"]:
+        if k in b["parameters"] and random.random() < 0.5:
+            child["parameters"][k] = b["parameters"][k]
+    return child
+
+
+def tournament(population, fitness):
+    picks = random.sample(range(len(population)), min(TOURNAMENT_SIZE, len(population)))
+    return population[max(picks, key=lambda i: fitness[i])]
+
+
+def _init_worker(spec, fee_rate, slippage):
+    global _worker_bars
+    _worker_bars = (attach(spec)["window"], fee_rate, slippage)
+
+
+def evaluate_genome(genome):
+    # 適應度：報酬扣除一半回撤，K 線在 worker 初始化時只傳一次
+    bars, fee_rate, slippage = _worker_bars
+    p = genome["parameters"]
+    bt = backtest_ma_crossover(
+        bars["open"], bars["high"], bars["low"], bars["close"],
+        p.get("ma_fast", 15), p.get("ma_slow", 45), p.get("sl_pct", 3), p.get("tp_pct", 6),
+        fee_rate=fee_rate, slippage=slippage,
+    )
+    metrics = {k: round(float(bt[k]), 4) for k in ("return_pct", "drawdown", "sharpe", "win_rate", "trade_count")}
+    return fitness(bt), metrics
+
+
+def evolve_population(state, king, grade):
+    window = load_window(king.get("symbol"), KLINE_INTERVAL, KLINE_LIMIT, advance=False, http=state.session)
+    if window is None or len(window["close"]) < 5:
+        print("[Evolution Engine] 無法取得 K 線，略過族群進化")
+        return None
+    bars = {k: np.ascontiguousarray(v) for k, v in window.items()}
+    sigma = GRADE_SIGMA.get(grade[:1], GRADE_SIGMA["B"])
+
+    saved = state.load("population", {})
+    population = [g for g in saved.get("genomes", []) if "parameters" in g]
+    seed = genome_of(king)
+    population = [seed] + [dict(seed, parameters=g["parameters"]) for g in population[1:POPULATION_SIZE]]
+    while len(population) < POPULATION_SIZE:
+        population.append(mutate(seed, max(sigma, GRADE_SIGMA["B"])))
+
+    # 同一參數組在同一視窗只回測一次：先查適應度快取，只把未命中的不重複基因送進行程池；
+    # K 線放進共享記憶體，各 worker 掛上同一份，池結束後才釋放；
+    # worker 以 forkserver 啟動：父行程若有其他執行緒持有鎖，直接 fork 可能繼承該鎖而死結
+    cache = GenomeCache(state.root / CACHE_DB)
+    symbol = king.get("symbol")
+    fingerprint = window_fingerprint(bars, KLINE_INTERVAL, FEE_RATE, SLIPPAGE)
+    workers = min(os.cpu_count() or 1, POPULATION_SIZE)
+    chunk = max(1, POPULATION_SIZE // (workers * 4))
+    with SharedBars({"window": bars}) as shared, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"),
+                                initializer=_init_worker, initargs=(shared.spec, FEE_RATE, SLIPPAGE)) as pool:
+        for gen in range(GENERATIONS_PER_ROUND + 1):
+            keys = [genome_hash(g, EVAL_FIELDS) for g in population]
+            known = cache.get_many(symbol, fingerprint, keys)
+            todo = {}
+            for k, g in zip(keys, population):
+                if k not in known:
+                    todo.setdefault(k, g)
+            fresh = dict(zip(todo, pool.map(evaluate_genome, todo.values(), chunksize=chunk)))
+            cache.put_many(symbol, fingerprint, fresh)
+            known.update(fresh)
+            results = [known[k] for k in keys]
+            fitness = [f for f, _ in results]
+            if gen == GENERATIONS_PER_ROUND:
+                break
+            ranked = sorted(range(len(population)), key=lambda i: fitness[i], reverse=True)
+            next_pop = [population[i] for i in ranked[:ELITE_COUNT]]
+            while len(next_pop) < POPULATION_SIZE:
+                child = crossover(tournament(population, fitness), tournament(population, fitness))
+                next_pop.append(mutate(child, sigma))
+            population = next_pop
+
+    print(f"[Evolution Engine] 適應度快取命中 {cache.stats['hits']} ／ 回測 {cache.stats['misses']}")
+    cache.close()
+    ranked = sorted(range(len(population)), key=lambda i: fitness[i], reverse=True)
+    genomes = []
+    for i in ranked:
+        g = dict(population[i])
+        g["fitness"], g["metrics"] = results[i]
+        genomes.append(g)
+    state.save("population", {
+        "symbol": king.get("symbol"),
+        "generation": saved.get("generation", 0) + GENERATIONS_PER_ROUND,
+        "candles": len(bars["close"]),
+        "ts": datetime.now().isoformat(),
+        "genomes": genomes,
+    })
+    return genomes[0]
+
+
+def run(state):
+    # 載入資料
+    king = state.king()
+    perf = state.performance()
+    memory = state.memory()
+    market = state.load("market", {})
+    evaluation = state.evaluation({})
+
+    # 預設值補全
+    memory.setdefault("evolution_trace", [])
+    memory.setdefault("live_rounds", 0)
+    memory.setdefault("learning_score", 0)
+    memory.setdefault("style_history", [])
+    memory.setdefault("drift_history", [])
+
+    # 進化前的基因雜湊即本代的親代
+    parent_hash = king.get("genome_hash") or genome_hash(genome_of(king))
+
+    # 提升進化代數
+    king["generation"] += 1
+    intent_summary = []
+    style_change = None
+
+    # 市況判斷（trend + volatility）
+    vol = market.get("btc_volatility", 0)
+    trend = market.get("trend_score", 0)
+    if trend > 0.6 and vol > 5:
+        market_type = "trend"
+    elif vol > 6:
+        market_type = "volatile"
+    elif trend < 0.4:
+        market_type = "sideway"
+    else:
+        market_type = "stable"
+
+    # 根據市況改變風格
+    style = king.get("style_profile", "balanced")
+    if market_type == "trend":
+        king["parameters"]["tp_pct"] *= 1.1
+        style = "explosive"
+        intent_summary.append("趨勢市 → 提升 TP% 並採爆發風格")
+    elif market_type == "sideway":
+        king["parameters"]["sl_pct"] *= 0.9
+        style = "defensive"
+        intent_summary.append("震盪市 → 降低 SL% 並採防守風格")
+    elif market_type == "volatile":
+        king["risk_tolerance"] = min(king.get("risk_tolerance", 0.5) + 0.05, 1.0)
+        intent_summary.append("高波動市 → 提高風險容忍")
+    else:
+        intent_summary.append("穩定市 → 保持風格")
+
+    # 自評進化策略：從模組 10 讀入 JSON 結果
+    grade = evaluation.get("evolution_grade", "")
+    trend_score = evaluation.get("trend_score", 0)
+
+    if grade.startswith("S+"):
+        intent_summary.append("自評結果：實戰等級，凍結參數")
+        king["evolution_intent"] = intent_summary
+        state.save("king", king)
+        print("[Evolution Engine] S+ 評級 → 凍結參數不進化")
+        return
+
+    elif EVOLUTION_MODE == "population" and (best := evolve_population(state, king, grade)):
+        king["parameters"] = best["parameters"]
+        intent_summary.append(f"族群進化 → 最佳基因晉升（fitness={best['fitness']}）")
+
+    elif grade.startswith("A"):
+        king["parameters"]["tp_pct"] *= 1.05
+        king["parameters"]["sl_pct"] *= 0.97
+        intent_summary.append("自評 A 級 → 微幅強化 TP，縮小 SL")
+
+    elif grade.startswith("B"):
+        king["parameters"]["tp_pct"] *= random.uniform(0.9, 1.1)
+        king["parameters"]["sl_pct"] *= random.uniform(0.9, 1.1)
+        king["risk_tolerance"] = min(max(king.get("risk_tolerance", 0.5) + random.uniform(-0.1, 0.1), 0.1), 1.0)
+        intent_summary.append("自評 B 級 → 中度突變進化")
+
+    elif grade.startswith("C"):
+        king["parameters"]["tp_pct"] = random.uniform(3, 8)
+        king["parameters"]["sl_pct"] = random.uniform(1, 4)
+        king["risk_tolerance"] = random.uniform(0.3, 0.7)
+        style = random.choice(["balanced", "defensive", "explosive"])
+        intent_summary.append("自評 C 級 → 重設策略與風格")
+
+    # 偵測風格變化
+    if king.get("style_profile") != style:
+        style_change = f"{king['style_profile']} → {style}"
+    king["style_profile"] = style
+
+    # 記錄意圖與進化摘要
     king["evolution_intent"] = intent_summary
-    king_path.write_text(json.dumps(king, indent=2, ensure_ascii=False))
-    print("[Evolution Engine] S+ 評級 → 凍結參數不進化")
-    exit(0)
-
-elif grade.startswith("A"):
-    king["parameters"]["tp_pct"] *= 1.05
-    king["parameters"]["sl_pct"] *= 0.97
-    intent_summary.append("自評 A 級 → 微幅強化 TP，縮小 SL")
-
-elif grade.startswith("B"):
-    king["parameters"]["tp_pct"] *= random.uniform(0.9, 1.1)
-    king["parameters"]["sl_pct"] *= random.uniform(0.9, 1.1)
-    king["risk_tolerance"] = min(max(king.get("risk_tolerance", 0.5) + random.uniform(-0.1, 0.1), 0.1), 1.0)
-    intent_summary.append("自評 B 級 → 中度突變進化")
-
-elif grade.startswith("C"):
-    king["parameters"]["tp_pct"] = random.uniform(3, 8)
-    king["parameters"]["sl_pct"] = random.uniform(1, 4)
-    king["risk_tolerance"] = random.uniform(0.3, 0.7)
-    style = random.choice(["balanced", "defensive", "explosive"])
-    intent_summary.append("自評 C 級 → 重設策略與風格")
-
-# 偵測風格變化
-if king.get("style_profile") != style:
-    style_change = f"{king['style_profile']} → {style}"
-king["style_profile"] = style
-
-# 記錄意圖與進化摘要
-king["evolution_intent"] = intent_summary
-evo_trace = {
-    "generation": king["generation"],
-    "ts": datetime.now().isoformat(),
-    "intent": intent_summary,
-    "style_profile": style,
-    "grade": grade,
-    "score": trend_score
-}
-memory["evolution_trace"].append(evo_trace)
-
-# 寫入結果
-king_path.write_text(json.dumps(king, indent=2, ensure_ascii=False))
-mem_path.write_text(json.dumps(memory, indent=2, ensure_ascii=False))
-print(f"[Evolution Engine] 第 {king['generation']} 代進化完成｜評級={grade}｜風格={style}")
+    evo_trace = {
+        "generation": king["generation"],
+        "ts": datetime.now().isoformat(),
+        "intent": intent_summary,
+        "style_profile": style,
+        "grade": grade,
+        "score": trend_score
+    }
+    memory.append("evolution_trace", evo_trace)
+
+    # 血統索引：親代 → 子代
+    king["genome_hash"] = genome_hash(genome_of(king))
+    king["parent_genome"] = parent_hash
+    cache = GenomeCache(state.root / CACHE_DB)
+    cache.add_lineage(king["genome_hash"], parent_hash, king.get("symbol"), king["generation"],
+                      style, intent_summary, evo_trace["ts"])
+    cache.close()
+
+    # 寫入結果
+    state.save("king", king)
+    print(f"[Evolution Engine] 第 {king['generation']} 代進化完成｜評級={grade}｜風格={style}")
+
+
+if __name__ == "__main__":
+    with RoundState() as state:
+        run(state)
@@ -0,0 +1,131 @@
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+
+class ColumnStore:
+    """kline_store 與 analytics_store 共用的欄式檔案底層：每欄一個 append-only 的原始二進位檔。
+
+    欄檔放在 current 連結指向的世代目錄（沒有 current 的舊佈局直接放在 path 底下）；
+    append 在 .lock 下逐欄附加，_swap 把整份欄位寫進新世代後原子切換，讀取端不會看到新舊混雜的欄。
+    """
+
+    def __init__(self, path, dtypes):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtypes = {col: np.dtype(dtype) for col, dtype in dtypes.items()}
+        self._maps = None
+        self._repair()
+
+    @contextmanager
+    def locked(self):
+        # 跨行程的寫入鎖；寫入者之間以此串行
+        with open(self.path / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _dir(self):
+        try:
+            return self.path / os.readlink(self.path / "current")
+        except FileNotFoundError:
+            return self.path
+
+    def _file(self, col, d=None):
+        return (d or self._dir()) / f"{col}.bin"
+
+    def _rows(self, col, d=None):
+        try:
+            return self._file(col, d).stat().st_size // self.dtypes[col].itemsize
+        except FileNotFoundError:
+            return 0
+
+    def _repair(self):
+        # 中途當機可能讓各欄長度不一，截到最短欄。append 逐欄寫入期間長度本來就不一，
+        # 故只在取得 .lock 時修復；鎖被占用表示寫入者還活著（當機的行程鎖會由核心釋放），交給它寫完
+        with open(self.path / ".lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            d = self._dir()
+            n = min(self._rows(col, d) for col in self.dtypes)
+            for col, dtype in self.dtypes.items():
+                f = self._file(col, d)
+                size = n * dtype.itemsize
+                if not f.exists():
+                    f.touch()
+                elif f.stat().st_size != size:
+                    os.truncate(f, size)
+
+    def _current(self):
+        # (世代目錄, 所有欄都已寫入的列數)；其他行程可能正逐欄 append。
+        # 期間 _swap 切換了世代（舊檔可能已刪、量到 0 列）就重新解析
+        while True:
+            d = self._dir()
+            n = min(self._rows(col, d) for col in self.dtypes)
+            if self._dir() == d:
+                return d, n
+
+    def __len__(self):
+        return self._current()[1]
+
+    def columns(self):
+        # 每次映射只解析一次世代目錄，各欄必定來自同一世代；
+        # 解析後舊世代剛好被 _swap 刪除時重新解析（已映射的檔案內容不受刪除影響）
+        while self._maps is None:
+            d, n = self._current()
+            try:
+                self._maps = {
+                    col: np.memmap(self._file(col, d), dtype=dtype, mode="r", shape=(n,)) if n else np.zeros(0, dtype=dtype)
+                    for col, dtype in self.dtypes.items()
+                }
+            except FileNotFoundError:
+                continue
+        return self._maps
+
+    def _last(self, col):
+        # 某欄最後一列的值；空表回傳 None
+        size = self.dtypes[col].itemsize
+        while True:
+            d, n = self._current()
+            if not n:
+                return None
+            try:
+                with open(self._file(col, d), "rb") as f:
+                    f.seek((n - 1) * size)
+                    return np.frombuffer(f.read(size), dtype=self.dtypes[col])[0].item()
+            except FileNotFoundError:
+                continue
+
+    def _append(self, arrays):
+        # 呼叫端須持有 locked()；arrays 為 {欄: 陣列}，各欄等長
+        d = self._dir()
+        for col, dtype in self.dtypes.items():
+            with open(self._file(col, d), "ab") as f:
+                f.write(np.asarray(arrays[col], dtype=dtype).tobytes())
+        self._maps = None
+
+    def _swap(self, arrays):
+        # 呼叫端須持有 locked()；整份欄位寫進新的世代目錄，以 current 連結原子切換後刪除舊世代
+        old = self._dir()
+        gen = int(old.name[len("gen_"):]) + 1 if old != self.path else 1
+        new = self.path / f"gen_{gen:06d}"
+        shutil.rmtree(new, ignore_errors=True)
+        new.mkdir()
+        for col, dtype in self.dtypes.items():
+            np.asarray(arrays[col], dtype=dtype).tofile(self._file(col, new))
+        link = self.path / "current.tmp"
+        link.unlink(missing_ok=True)
+        link.symlink_to(new.name)
+        os.replace(link, self.path / "current")
+        self._maps = None
+        # 舊世代已無人會新解析到；已映射的讀取端仍持有原檔內容
+        if old == self.path:
+            for col in self.dtypes:
+                self._file(col, old).unlink(missing_ok=True)
+        else:
+            shutil.rmtree(old, ignore_errors=True)
@@ -1,114 +1,176 @@
-import json
+import os
 import random
-import time
-from pathlib import Path
-import requests
 from datetime import datetime
 
-# === CONFIG ===
-symbol = "SHIBUSDT"
-interval = "1m"
-limit = 60
-api_url = f"https://api.mexc.com/api/v3/klines?symbol={symbol}&interval={interval}&limit={limit}"
-
-# === PATH ===
-king_path = Path("~/Killcore/modules/king.json").expanduser()
-perf_path = Path("~/Killcore/king_performance.json").expanduser()
-eval_path = Path("~/Killcore/king_self_evaluation.json").expanduser()
-
-# === AI 自評讀取 ===
-evaluation = {}
-if eval_path.exists():
-    evaluation = json.loads(eval_path.read_text())
-    print("[Simulator] 讀取自評建議：", evaluation.get("next_focus", "無"))
-
-# === 依照進化建議調整模擬條件 ===
-next_focus = evaluation.get("next_focus", "").lower()
-strategy_shift = evaluation.get("strategy_shift", "").lower()
-risk_response = evaluation.get("risk_response", "").lower()
-
-slippage_factor = 0.0015
-fee_rate = 0.001
-execution_delay_sec = random.uniform(0.3, 2.5)
-entry_slices = [0.25, 0.25, 0.5]
-
-if "drawdown" in next_focus or "sl" in next_focus:
-    slippage_factor *= 3
-    execution_delay_sec *= 1.5
-    print("[模擬] 啟動高壓滑價模式（測試防守力）")
-
-if "tp" in next_focus:
-    limit = 100  # 提高波動樣本
-    print("[模擬] 啟動波段延伸模式（測試獲利力）")
-
-if "defensive" in strategy_shift:
-    symbol = "DOGEUSDT"  # 測試較平緩品種
-    print("[模擬] 切換震盪測試幣種")
-
-if "風險" in risk_response:
-    fee_rate *= 2
-    print("[模擬] 模擬高手續費高摩擦環境")
-
-# === K 線抓取 ===
-api_url = f"https://api.mexc.com/api/v3/klines?symbol={symbol}&interval={interval}&limit={limit}"
-res = requests.get(api_url)
-klines = res.json() if res.status_code == 200 else []
-if not klines or len(klines) < 5:
-    print("[Error] 無法取得足夠的 K 線資料")
-    exit()
-
-# === 模擬資本 ===
-capital = 70.51
-avg_entry_price, qty_total, slippage_total, cost_total = 0, 0, 0, 0
-entry_log = []
-
-for ratio in entry_slices:
-    base_price = float(random.choice(klines)[1])
-    slip = base_price * random.uniform(-slippage_factor, slippage_factor)
-    exec_price = base_price + slip
-    time.sleep(execution_delay_sec / len(entry_slices))
-    usdt_amount = capital * ratio
-    qty = usdt_amount / exec_price
-    entry_log.append({
-        "ratio": ratio,
-        "exec_price": round(exec_price, 8),
-        "slippage": round(slip, 8),
-        "qty": round(qty, 6)
-    })
-    avg_entry_price += exec_price * ratio
-    qty_total += qty
-    slippage_total += abs(slip)
-    cost_total += usdt_amount
-
-avg_entry_price = avg_entry_price
-real_cost_basis = cost_total / qty_total
-fee_entry = real_cost_basis * qty_total * fee_rate
-
-# === 模擬出場 ===
-last_close = float(klines[-1][4])
-fee_exit = last_close * qty_total * fee_rate
-gross = last_close * qty_total
-net = gross - cost_total - fee_entry - fee_exit
-return_pct = round((net / cost_total) * 100, 2)
-drawdown = round(random.uniform(1.0, 7.0), 2)
-sharpe = round(random.uniform(0.8, 2.5), 2)
-win_rate = round(random.uniform(50, 80), 1)
-trade_count = random.randint(5, 20)
-
-# === 寫入績效結果 ===
-result = {
-    "return_pct": return_pct,
-    "net_profit": round(net, 2),
-    "drawdown": drawdown,
-    "sharpe": sharpe,
-    "win_rate": win_rate,
-    "trade_count": trade_count,
-    "fail_reason": "none" if return_pct > 0 else "loss",
-    "fail_indicators": ["dd_high"] if drawdown > 5 else [],
-    "entry_log": entry_log,
-    "symbol": symbol,
-    "ts": datetime.now().isoformat()
-}
-
-perf_path.write_text(json.dumps(result, indent=2, ensure_ascii=False))
-print("[Simulator] 模擬完成 ｜ 報酬：", return_pct, "%，回撤：", drawdown)
+import numpy as np
+
+from backtest_engine import backtest_ma_crossover, monte_carlo_returns, return_distribution, trades_to_records
+from genome_cache import genome_hash, genome_of
+from indicator_engine import current_values, decision_score, signals, stream_window
+from kline_store import INTERVAL_MS, load_window
+from round_state import RoundState
+
+# single：單一路徑的滑價與延遲；montecarlo：同一批交易以 MC_PATHS 條成交路徑重新定價，
+# return_pct 改用路徑平均，分佈摘要寫入 execution_summary
+SIM_MODE = os.environ.get("KILLCORE_SIM_MODE", "single")
+MC_PATHS = int(os.environ.get("KILLCORE_MC_PATHS", "2000"))
+MC_SLIPPAGE_SIGMA = 0.5       # 每批滑價 = slippage_factor × 對數常態（平均 1）
+MC_FEE_JITTER = 0.2           # 手續費 ±20% 均勻擾動
+MC_SLICE_CONCENTRATION = 50   # 分批比例以 Dirichlet 擾動，數值越大越接近原比例
+# live 模式取窗會補抓並寫入 K 線庫，replay 模式會推進游標
+STATE_READS = ("king", "evaluation", "indicators", "klines")
+STATE_WRITES = ("performance", "indicators", "klines")
+
+
+def run(state):
+    # === CONFIG ===
+    symbol = state.symbol or "SHIBUSDT"
+    interval = "1m"
+    limit = 500
+
+    # === AI 自評讀取 ===
+    evaluation = {}
+    if state.exists("evaluation"):
+        evaluation = state.evaluation()
+        print("[Simulator] 讀取自評建議：", evaluation.get("next_focus", "無"))
+
+    # === 依照進化建議調整模擬條件 ===
+    next_focus = evaluation.get("next_focus", "").lower()
+    strategy_shift = evaluation.get("strategy_shift", "").lower()
+    risk_response = evaluation.get("risk_response", "").lower()
+
+    slippage_factor = 0.0015
+    fee_rate = 0.001
+    delay_range = (0.3, 2.5)
+    delay_scale = 1.0
+    execution_delay_sec = random.uniform(*delay_range)
+    entry_slices = [0.25, 0.25, 0.5]
+
+    if "drawdown" in next_focus or "sl" in next_focus:
+        slippage_factor *= 3
+        delay_scale *= 1.5
+        execution_delay_sec *= 1.5
+        print("[模擬] 啟動高壓滑價模式（測試防守力）")
+
+    if "tp" in next_focus:
+        limit = 1000  # 提高波動樣本
+        print("[模擬] 啟動波段延伸模式（測試獲利力）")
+
+    if "defensive" in strategy_shift and not state.symbol:
+        symbol = "DOGEUSDT"  # 測試較平緩品種
+        print("[模擬] 切換震盪測試幣種")
+
+    if "風險" in risk_response:
+        fee_rate *= 2
+        print("[模擬] 模擬高手續費高摩擦環境")
+
+    # === K 線讀取（本地 K 線庫，live 模式只補抓新 K 線）===
+    bars = load_window(symbol, interval, limit, http=state.session)
+    if bars is None or len(bars["close"]) < 5:
+        print("[Error] 無法取得足夠的 K 線資料")
+        return
+    candles = len(bars["close"])
+
+    # === 模擬資本 ===
+    capital = 70.51
+    king = state.king()
+    params = king.get("parameters", {})
+
+    # === 回測：以 king 的 MA_Crossover 參數跑完整段 K 線 ===
+    bt = backtest_ma_crossover(
+        bars["open"], bars["high"], bars["low"], bars["close"],
+        ma_fast=params.get("ma_fast", 15),
+        ma_slow=params.get("ma_slow", 45),
+        sl_pct=params.get("sl_pct", 3),
+        tp_pct=params.get("tp_pct", 6),
+        fee_rate=fee_rate,
+        slippage=slippage_factor,
+        entry_slices=entry_slices,
+        capital=capital,
+        execution_delay_ms=execution_delay_sec * 1000,
+        bar_ms=INTERVAL_MS.get(interval, INTERVAL_MS["1m"]),
+    )
+    trades = trades_to_records(bt["trades"], bars["open_time"])
+
+    # === 決策權重地圖：指標狀態跨輪保存，每輪只餵入新收盤的 K 線 ===
+    saved = state.load("indicators", {})
+    stream = saved.get("stream") if saved.get("symbol") == symbol and saved.get("interval") == interval else None
+    stream, fed = stream_window(stream, bars, params)
+    state.save("indicators", {"symbol": symbol, "interval": interval, "stream": stream})
+    indicator_signals = {k: round(float(v), 4) for k, v in signals(current_values(stream)).items()}
+    score = round(float(decision_score(indicator_signals, king.get("decision_weighting_map", {}))), 4)
+    print(f"[Simulator] 指標更新 {fed} 根 ｜ 決策分數：{score}")
+
+    # === 最近一筆進場的分批成交紀錄（虛擬時鐘：延遲已反映在成交根與成交價，不實際等待）===
+    entry_log = []
+    if trades:
+        fills = bt["trades"]
+        for k, ratio in enumerate(entry_slices):
+            bar = int(fills["slice_bar"][-1, k])
+            base_price = float(fills["slice_price"][-1, k])
+            exec_price = base_price * (1 + slippage_factor)
+            entry_log.append({
+                "ratio": ratio,
+                "exec_price": round(exec_price, 8),
+                "slippage": round(exec_price - base_price, 8),
+                "qty": round(capital * ratio / exec_price, 6),
+                "fill_time": int(bars["open_time"][bar] + fills["slice_offset_ms"][-1, k]),
+            })
+
+    return_pct = round(bt["return_pct"], 2)
+    net = bt["net_profit"]
+
+    # === Monte Carlo 成交路徑：分批比例、滑價、手續費與延遲一次批次抽樣 ===
+    execution_summary = {}
+    if SIM_MODE == "montecarlo" and MC_PATHS > 0:
+        rng = np.random.default_rng()
+        n_slices = len(entry_slices)
+        path_returns = monte_carlo_returns(
+            bars["open"], bars["close"], bt["trades"],
+            slice_weights=rng.dirichlet(np.asarray(entry_slices) * MC_SLICE_CONCENTRATION, MC_PATHS),
+            slippage=slippage_factor * rng.lognormal(-MC_SLIPPAGE_SIGMA ** 2 / 2, MC_SLIPPAGE_SIGMA, (MC_PATHS, n_slices)),
+            fee_rate=fee_rate * rng.uniform(1 - MC_FEE_JITTER, 1 + MC_FEE_JITTER, MC_PATHS),
+            delay_ms=rng.uniform(*delay_range, MC_PATHS) * delay_scale * 1000,
+            base_slippage=slippage_factor,
+            bar_ms=INTERVAL_MS.get(interval, INTERVAL_MS["1m"]),
+        )
+        execution_summary = return_distribution(path_returns)
+        execution_summary["path_return_pct"] = return_pct
+        return_pct = round(execution_summary["mean"], 2)
+        net = capital * return_pct / 100
+        print(f"[Simulator] Monte Carlo {MC_PATHS} 路徑 ｜ 平均 {execution_summary['mean']}% ｜ "
+              f"p5 {execution_summary['p5']}% ｜ p95 {execution_summary['p95']}% ｜ 虧損機率 {execution_summary['prob_loss']}")
+    drawdown = round(bt["drawdown"], 2)
+    sharpe = round(bt["sharpe"], 2)
+    win_rate = round(bt["win_rate"], 1)
+    trade_count = bt["trade_count"]
+
+    # === 寫入績效結果 ===
+    result = {
+        "return_pct": return_pct,
+        "net_profit": round(net, 2),
+        "drawdown": drawdown,
+        "sharpe": sharpe,
+        "win_rate": win_rate,
+        "trade_count": trade_count,
+        "fail_reason": "none" if return_pct > 0 else "loss",
+        "fail_indicators": ["dd_high"] if drawdown > 5 else [],
+        "entry_log": entry_log,
+        "genome_hash": king.get("genome_hash") or genome_hash(genome_of(king)),
+        "decision_score": score,
+        "indicator_signals": indicator_signals,
+        "execution_delay_ms": round(execution_delay_sec * 1000),
+        "execution_summary": execution_summary,
+        "trades": trades,
+        "candles": candles,
+        "symbol": symbol,
+        "ts": datetime.now().isoformat()
+    }
+
+    state.save("performance", result)
+    print("[Simulator] 模擬完成 ｜ 報酬：", return_pct, "%，回撤：", drawdown)
+
+
+if __name__ == "__main__":
+    with RoundState() as state:
+        run(state)
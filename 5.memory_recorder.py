@@ -1,125 +1,154 @@
 import json
-from pathlib import Path
 from datetime import datetime
 
-# 路徑
-king_path = Path("~/Killcore/modules/king.json").expanduser()
-perf_path = Path("~/Killcore/king_performance.json").expanduser()
-mem_path = Path("~/Killcore/king_memory.json").expanduser()
+from rolling_stats import RING_SIZE, build_stats, update_stats
+from round_state import RoundState
 
-# 載入模組、績效、記憶體
-king = json.loads(king_path.read_text())
-perf = json.loads(perf_path.read_text())
-memory = {}
-if mem_path.exists():
+STATE_READS = ("king", "performance", "memory")
+STATE_WRITES = ("memory",)
+
+
+def run(state):
+    # 載入模組、績效、記憶體
+    king = state.king()
+    perf = state.performance()
     try:
-        memory = json.loads(mem_path.read_text())
+        memory = state.memory()
     except json.JSONDecodeError:
         print("[警告] king_memory.json 解析失敗，重新初始化")
-        memory = {}
-
-# 初始化記憶體欄位
-memory.setdefault("live_rounds", 0)
-memory.setdefault("fail_indicators_count", {})
-memory.setdefault("history", [])
-memory.setdefault("style_profile", None)
-memory.setdefault("learning_score", 0)
-memory.setdefault("memory_flags", {})
-memory.setdefault("aging_map", {})
-memory.setdefault("fail_pattern_stats", {})
-memory.setdefault("evolution_trace", [])
-memory.setdefault("bad_behavior_tag", [])
-memory.setdefault("drift_history", [])
-memory.setdefault("intent_summary", [])
-
-# 第幾輪模擬
-memory["live_rounds"] += 1
-
-# 累計失敗因子
-for f in perf.get("fail_indicators", []):
-    memory["fail_indicators_count"][f] = memory["fail_indicators_count"].get(f, 0) + 1
-    if memory["fail_indicators_count"][f] >= 10:
-        memory["memory_flags"][f] = "封印候選"
-
-# 建立單輪記錄
-round_record = {
-    "ts": datetime.now().isoformat(),
-    "return_pct": perf.get("return_pct"),
-    "net_profit": perf.get("net_profit"),
-    "drawdown": perf.get("drawdown"),
-    "win_rate": perf.get("win_rate"),
-    "sharpe": perf.get("sharpe"),
-    "trade_count": perf.get("trade_count"),
-    "fail_reason": perf.get("fail_reason"),
-    "fail_indicators": perf.get("fail_indicators"),
-    "symbol": king.get("symbol"),
-    "params": king.get("parameters"),
-    "style": king.get("style_profile"),
-    "intent": king.get("evolution_intent", []),
-    "capital_used": perf.get("capital_used", 70.51),
-    "entry_behavior": perf.get("entry_behavior", []),
-    "risk_profile": perf.get("risk_profile", {}),
-    "execution_summary": perf.get("execution_summary", {}),
-    "simulation_stamp": perf.get("simulation_stamp", datetime.now().isoformat()),
-    "score_snapshot": {
-        "bias": king.get("init_bias_score"),
-        "temp": king.get("temperature_level"),
-        "risk_tol": king.get("risk_tolerance"),
-        "emotion": king.get("emotional_tendency")
+        memory = state.memory(reset=True)
+
+    # 初始化記憶體欄位
+    memory.setdefault("live_rounds", 0)
+    memory.setdefault("fail_indicators_count", {})
+    memory.setdefault("history", [])
+    memory.setdefault("style_profile", None)
+    memory.setdefault("learning_score", 0)
+    memory.setdefault("memory_flags", {})
+    memory.setdefault("aging_map", {})
+    memory.setdefault("fail_pattern_stats", {})
+    memory.setdefault("evolution_trace", [])
+    memory.setdefault("bad_behavior_tag", [])
+    memory.setdefault("drift_history", [])
+    memory.setdefault("intent_summary", [])
+
+    # 第幾輪模擬
+    memory.set("live_rounds", memory.get("live_rounds") + 1)
+
+    # 累計失敗因子
+    fail_count = memory.get("fail_indicators_count")
+    flags = memory.get("memory_flags")
+    for f in perf.get("fail_indicators", []):
+        fail_count[f] = fail_count.get(f, 0) + 1
+        if fail_count[f] >= 10:
+            flags[f] = "封印候選"
+    memory.set("fail_indicators_count", fail_count)
+    memory.set("memory_flags", flags)
+
+    # 建立單輪記錄（rid 為穩定編號，供 memory_regulator 保留引擎使用）
+    rid = memory.get("history_seq")
+    if rid is None:
+        rid = memory.count("history")
+    memory.set("history_seq", rid + 1)
+    round_record = {
+        "rid": rid,
+        "generation": king.get("generation"),
+        "genome_hash": perf.get("genome_hash"),
+        "ts": datetime.now().isoformat(),
+        "return_pct": perf.get("return_pct"),
+        "net_profit": perf.get("net_profit"),
+        "drawdown": perf.get("drawdown"),
+        "win_rate": perf.get("win_rate"),
+        "sharpe": perf.get("sharpe"),
+        "trade_count": perf.get("trade_count"),
+        "fail_reason": perf.get("fail_reason"),
+        "fail_indicators": perf.get("fail_indicators"),
+        "symbol": king.get("symbol"),
+        "params": king.get("parameters"),
+        "style": king.get("style_profile"),
+        "intent": king.get("evolution_intent", []),
+        "capital_used": perf.get("capital_used", 70.51),
+        "entry_behavior": perf.get("entry_behavior", []),
+        "risk_profile": perf.get("risk_profile", {}),
+        "execution_summary": perf.get("execution_summary", {}),
+        "simulation_stamp": perf.get("simulation_stamp", datetime.now().isoformat()),
+        "score_snapshot": {
+            "bias": king.get("init_bias_score"),
+            "temp": king.get("temperature_level"),
+            "risk_tol": king.get("risk_tolerance"),
+            "emotion": king.get("emotional_tendency")
+        }
     }
-}
-memory["history"].append(round_record)
-
-# aging_map 處理
-if len(memory["history"]) > 30:
-    for i in range(len(memory["history"]) - 30):
-        memory["aging_map"][i] = "過期"
-    memory["history"] = memory["history"][-30:]
-
-# 最近 5 輪學習力
-recent = memory["history"][-5:]
-memory["learning_score"] = sum(1 for r in recent if r.get("return_pct", 0) > 0)
-
-# 風格推估
-tp = king.get("parameters", {}).get("tp_pct", 5)
-sl = king.get("parameters", {}).get("sl_pct", 2)
-if tp > 8:
-    memory["style_profile"] = "explosive"
-elif sl < 2:
-    memory["style_profile"] = "defensive"
-else:
-    memory["style_profile"] = "balanced"
-
-# 壞習慣偵測
-tags = set(memory.get("bad_behavior_tag", []))
-if perf.get("drawdown", 0) > 6:
-    tags.add("高回撤")
-if perf.get("trade_count", 0) > 20:
-    tags.add("過度交易")
-if perf.get("win_rate", 100) < 35:
-    tags.add("勝率崩盤")
-if perf.get("fail_reason"):
-    tags.add("重大失誤")
-memory["bad_behavior_tag"] = list(tags)
-
-# 進化摘要記錄
-evo = {
-    "generation": king.get("generation"),
-    "ts": datetime.now().isoformat(),
-    "intent": king.get("evolution_intent", []),
-    "result": f'{perf.get("return_pct", 0)}% / DD {perf.get("drawdown", 0)}%',
-    "style": king.get("style_profile"),
-    "emotion": king.get("emotional_tendency"),
-    "bias": king.get("init_bias_score")
-}
-memory["evolution_trace"].append(evo)
-memory["intent_summary"].extend(king.get("evolution_intent", []))
-
-# 漂移標記
-style_set = set(e["style"] for e in memory["evolution_trace"][-3:] if "style" in e)
-memory["style_drift_flag"] = len(style_set) > 1
-memory["drift_history"].append(list(style_set))
-
-# 寫入記憶
-mem_path.write_text(json.dumps(memory, indent=2, ensure_ascii=False))
-print(f"[Memory Recorder] 第 {memory['live_rounds']} 輪完成 | 學習力={memory['learning_score']} | 標記：{', '.join(memory['bad_behavior_tag'])}")
+    memory.append("history", round_record)
+
+    # 滾動統計（供 auto_grader 以 O(1) 查詢多個視窗）
+    stats = memory.get("rolling_stats")
+    if stats is None:
+        stats = build_stats(memory.tail("history", RING_SIZE))
+    else:
+        update_stats(stats, round_record)
+    memory.set("rolling_stats", stats)
+
+    # aging_map 處理
+    expired = memory.trim("history", 30)
+    if expired:
+        aging_map = memory.get("aging_map")
+        for i in range(expired):
+            aging_map[str(i)] = "過期"
+        memory.set("aging_map", aging_map)
+
+    # 最近 5 輪學習力
+    recent = memory.tail("history", 5)
+    memory.set("learning_score", sum(1 for r in recent if r.get("return_pct", 0) > 0))
+
+    # 風格推估
+    tp = king.get("parameters", {}).get("tp_pct", 5)
+    sl = king.get("parameters", {}).get("sl_pct", 2)
+    if tp > 8:
+        memory.set("style_profile", "explosive")
+    elif sl < 2:
+        memory.set("style_profile", "defensive")
+    else:
+        memory.set("style_profile", "balanced")
+
+    # 壞習慣偵測
+    tags = set(memory.get("bad_behavior_tag", []))
+    if perf.get("drawdown", 0) > 6:
+        tags.add("高回撤")
+    if perf.get("trade_count", 0) > 20:
+        tags.add("過度交易")
+    if perf.get("win_rate", 100) < 35:
+        tags.add("勝率崩盤")
+    if perf.get("fail_reason"):
+        tags.add("重大失誤")
+    memory.set("bad_behavior_tag", list(tags))
+
+    # 進化摘要記錄
+    now = datetime.now().isoformat()
+    evo = {
+        "generation": king.get("generation"),
+        "ts": now,
+        "intent": king.get("evolution_intent", []),
+        "result": f'{perf.get("return_pct", 0)}% / DD {perf.get("drawdown", 0)}%',
+        "return_pct": perf.get("return_pct"),
+        "drawdown": perf.get("drawdown"),
+        "style": king.get("style_profile"),
+        "emotion": king.get("emotional_tendency"),
+        "bias": king.get("init_bias_score")
+    }
+    memory.append("evolution_trace", evo)
+    # 每輪一筆並帶時間，供 memory_rollup 依時間彙總
+    memory.append("intent_summary", {"generation": king.get("generation"), "ts": now,
+                                     "intent": king.get("evolution_intent", [])})
+
+    # 漂移標記
+    style_set = set(e["style"] for e in memory.tail("evolution_trace", 3) if "style" in e)
+    memory.set("style_drift_flag", len(style_set) > 1)
+    memory.append("drift_history", {"generation": king.get("generation"), "ts": now, "styles": list(style_set)})
+
+    print(f"[Memory Recorder] 第 {memory.get('live_rounds')} 輪完成 | 學習力={memory.get('learning_score')} | 標記：{', '.join(memory.get('bad_behavior_tag'))}")
+
+
+if __name__ == "__main__":
+    with RoundState() as state:
+        run(state)
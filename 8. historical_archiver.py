@@ -1,7 +1,10 @@
+import contextlib
+import importlib
 import subprocess
+import sys
 import time
-import shutil
 import os
+import traceback
 from pathlib import Path
 from datetime import datetime
 
@@ -17,47 +20,169 @@ modules = [
     "memory_regulator.py"
 ]
 
-start = time.time()
-print("\n[Archiver] 啟動連貫執行器...\n")
+# inprocess：同一個直譯器內以函式呼叫各模組，共用 RoundState，本輪結束才寫檔
+# subprocess：每個模組獨立 python3 行程（隔離備援）
+RUN_MODE = os.environ.get("KILLCORE_RUN_MODE", "inprocess")
+# dag：inprocess 模式下依各模組宣告的讀寫狀態（STATE_READS / STATE_WRITES）建階段圖，互不相依的模組、
+# 收尾（寫檔、封存、分析表）與下一輪預抓同時執行；sequential：依 modules 順序逐一執行
+STAGE_SCHEDULER = os.environ.get("KILLCORE_STAGE_SCHEDULER", "dag")
 
 killcore_path = Path("~/Killcore").expanduser()
-log = []
-
-# 依順序執行模組
-for module in modules:
-    module_path = killcore_path / module
-    if not module_path.exists():
-        print(f"[略過] 找不到模組：{module}")
-        continue
-    print(f"[執行] {module} ...")
-    t0 = time.time()
+
+# 每輪封存的狀態檔（相對於狀態根目錄）
+ARCHIVE_FILES = ["modules/king.json", "king_performance.json", "king_memory.json", "king_memory.db"]
+
+
+def run_subprocess(module_path):
     result = subprocess.run(["python3", str(module_path)], capture_output=True, text=True)
-    t1 = time.time()
     print(result.stdout)
     if result.stderr:
-        print(f"[錯誤] {module} 發生錯誤：\n{result.stderr}")
-    log.append((module, round(t1 - t0, 2)))
-
-# 建立封存資料夾
-archives_path = killcore_path / "archives"
-archives_path.mkdir(exist_ok=True)
-
-# 編號 round
-existing = [p for p in archives_path.iterdir() if p.is_dir() and p.name.startswith("round_")]
-round_num = len(existing) + 1
-round_dir = archives_path / f"round_{round_num:04d}"
-round_dir.mkdir()
-
-# 要封存的檔案
-files_to_archive = ["modules/king.json", "king_performance.json", "king_memory.json"]
-for f in files_to_archive:
-    src = killcore_path / f
-    if src.exists():
-        shutil.copy(src, round_dir / Path(f).name)
-
-# 完成報告
-print("\n[Archiver] 本輪執行完成")
-print(f"封存位置：{round_dir}")
-print(f"執行耗時：{round(time.time() - start, 2)} 秒")
-for mod, secs in log:
-    print(f" - {mod:<24} 用時 {secs} 秒")
+        print(f"[錯誤] {module_path.name} 發生錯誤：\n{result.stderr}")
+
+
+def run_inprocess(module_path, state, tracer=None, keys=None):
+    # keys：並行排程時該模組宣告讀寫的狀態，失敗時只撤回這些
+    snapshot = state.begin_stage(keys)
+    try:
+        stage = importlib.import_module(module_path.stem)
+        with tracer.stage(module_path.stem, state) if tracer else contextlib.nullcontext():
+            stage.run(state)
+            state.end_stage(keys)
+    except Exception:
+        # 模組失敗時撤回其修改（含已 save 的），與子行程模式的隔離效果一致
+        state.invalidate_clean(keys, snapshot)
+        print(f"[錯誤] {module_path.name} 發生錯誤：\n{traceback.format_exc()}")
+
+
+def prefetch_next_round(state):
+    # 下一輪的外部輸入先抓好：同步本地 K 線庫（下一輪沒有新收盤就不必再打 API），開啟行情快取時一併預抓行情
+    import requests
+    from kline_store import prefetch
+    synced, tickers = prefetch(), 0
+    if (killcore_path / "symbol_selector.py").exists():
+        from symbol_selector import prefetch_tickers
+        try:
+            tickers = prefetch_tickers(state.root)
+        except requests.RequestException as e:
+            print(f"[Prefetch] 行情預抓失敗：{e}")
+    print(f"[Prefetch] 下一輪預抓完成：同步 K 線庫 {synced} 個，行情 {tickers} 筆")
+
+
+def module_stages(state, tracer):
+    # 各模組依宣告建成階段；同一模組執行兩次時名稱加序號
+    from stage_graph import ANY, declared
+    stages = []
+    for module in modules:
+        module_path = killcore_path / module
+        if not module_path.exists():
+            print(f"[略過] 找不到模組：{module}")
+            continue
+        reads, writes = declared(importlib.import_module(module_path.stem))
+        keys = None if ANY in reads | writes else reads | writes
+        seen = sum(1 for s in stages if s["name"].split("#")[0] == module_path.stem)
+
+        def run(module_path=module_path, keys=keys):
+            print(f"[執行] {module_path.name} ...")
+            run_inprocess(module_path, state, tracer, keys)
+
+        stages.append({"name": f"{module_path.stem}#{seen + 1}" if seen else module_path.stem,
+                       "run": run, "reads": reads, "writes": writes})
+    return stages
+
+
+def closing_stages(flush, archive_round, export, prefetch):
+    # 模組之後的收尾階段：寫檔等所有寫狀態的模組，封存等寫檔，分析表等封存與記憶，預抓只避開用到 K 線與行情的模組
+    from memory_store import MEMORY_BACKEND
+    from round_state import STATE_FILES
+    return [
+        # SQLite 記憶在 flush 時提交，視為寫入記憶
+        {"name": "flush", "run": flush, "reads": set(STATE_FILES),
+         "writes": {"state_files"} | ({"memory"} if MEMORY_BACKEND == "sqlite" else set())},
+        {"name": "archive", "run": archive_round, "reads": {"state_files"}, "writes": {"archives"}},
+        {"name": "analytics", "run": export, "reads": {"archives", "memory"}, "writes": {"analytics"}},
+        {"name": "prefetch", "run": prefetch, "reads": set(), "writes": {"klines", "tickers"}},
+    ]
+
+
+if __name__ == "__main__":
+    start = time.time()
+    print("\n[Archiver] 啟動連貫執行器...\n")
+
+    sys.path.insert(0, str(killcore_path))
+    from round_metrics import TRACE_MEMORY, RoundTracer, instrument_session
+    from round_state import RoundState
+    state = None
+    if RUN_MODE == "inprocess":
+        state = RoundState(killcore_path)
+        # 各模組共用的 HTTP session 掛上量測 hook
+        for name in ("kline_store", "symbol_selector"):
+            if (killcore_path / f"{name}.py").exists():
+                instrument_session(importlib.import_module(name).session)
+    use_graph = state is not None and STAGE_SCHEDULER == "dag"
+    tracer = RoundTracer(killcore_path / "metrics", trace_memory=TRACE_MEMORY and state is not None,
+                         concurrent=use_graph)
+
+    from analytics_store import export as export_analytics
+    from round_archive import RoundArchive
+    archive = RoundArchive(killcore_path / "archives")
+    results = {}
+
+    def flush():
+        # 本輪狀態一次寫回
+        with tracer.stage("flush", state):
+            state.flush()
+
+    def archive_round():
+        # 封存：內容定址去重，每輪只寫入新的塊與一份 manifest
+        with tracer.stage("archive"):
+            results["archive"] = archive.archive({Path(f).name: killcore_path / f for f in ARCHIVE_FILES})
+
+    def export():
+        # 長期分析表：增量匯出新封存的輪次與記憶中新增的 history
+        with tracer.stage("analytics"):
+            results["exported"] = export_analytics(killcore_path, (state or RoundState(killcore_path)).memory())
+
+    def prefetch():
+        with tracer.stage("prefetch"):
+            prefetch_next_round(state)
+
+    critical = None
+    if use_graph:
+        from stage_graph import critical_path, run_graph
+        stages = module_stages(state, tracer) + closing_stages(flush, archive_round, export, prefetch)
+        timings = run_graph(stages)
+        critical = critical_path(stages, timings)
+    else:
+        # 依順序執行模組
+        for module in modules:
+            module_path = killcore_path / module
+            if not module_path.exists():
+                print(f"[略過] 找不到模組：{module}")
+                continue
+            print(f"[執行] {module} ...")
+            if state is not None:
+                run_inprocess(module_path, state, tracer)
+            else:
+                with tracer.stage(module_path.stem):
+                    run_subprocess(module_path)
+        if state is not None:
+            flush()
+        archive_round()
+        export()
+
+    round_num, manifest = results["archive"]
+    exported = results["exported"]
+    metrics = tracer.finish(round=round_num, mode=RUN_MODE, scheduler=STAGE_SCHEDULER if use_graph else "sequential")
+
+    # 完成報告
+    print("\n[Archiver] 本輪執行完成")
+    print(f"執行模式：{RUN_MODE}")
+    if critical is not None:
+        print(f"階段排程：dag ｜ 關鍵路徑 {round(critical[0], 2)} 秒：{' → '.join(critical[1])}")
+    print(f"封存輪次：{round_num}（新增 {manifest['new_bytes']} bytes）→ {archive.manifest_path(round_num)}")
+    print(f"分析表匯出：rounds +{exported['rounds']}，history +{exported['history']}")
+    print(f"執行耗時：{round(time.time() - start, 2)} 秒（指標 → {tracer.root}）")
+    for s in metrics["stages"]:
+        peak = f" ｜ 記憶體峰值 {round(s['tracemalloc_peak'] / 1024 / 1024, 2)} MB" if s["tracemalloc_peak"] is not None else ""
+        http = f" ｜ HTTP {s['http_requests']} 次 {round(s['http_seconds'], 2)} 秒" if s["http_requests"] else ""
+        print(f" - {s['stage']:<24} 用時 {round(s['wall'], 2)} 秒 ｜ CPU {round(s['cpu'], 2)} 秒{peak}{http}")
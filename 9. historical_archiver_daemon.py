@@ -1,39 +1,179 @@
+import fcntl
+import json
+import os
+import signal
 import subprocess
+import threading
 import time
-import os
 from pathlib import Path
 
 LOCK_FILE = Path("/tmp/killcore_archiver.lock")
+KILLCORE_PATH = Path("~/Killcore").expanduser()
+STATE_FILE = KILLCORE_PATH / "daemon_state.json"
+
+# candle：對齊 K 線收盤執行，輸入未變則略過；fixed：舊的固定 10 秒輪詢
+SCHEDULE_MODE = os.environ.get("KILLCORE_SCHEDULE", "candle")
+FIXED_INTERVAL_SEC = 10
+CANDLE_INTERVAL = "1m"
+CLOSE_DELAY_SEC = 2  # 收盤後稍等交易所落地 K 線
+MAX_BACKFILL_ROUNDS = 30
+
+_wake = threading.Event()
+_lock_fd = None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
 
 def is_already_running():
-    if LOCK_FILE.exists():
-        print("[Daemon] 已有執行實例在運行中，略過啟動")
+    # fcntl 鎖隨行程結束自動釋放；檔內 PID 只用來辨識與回報殘留鎖
+    global _lock_fd
+    fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    old = os.read(fd, 32).decode().strip()
+    old_pid = int(old) if old.isdigit() else None
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        if old_pid and pid_alive(old_pid):
+            print(f"[Daemon] 已有執行實例在運行中（PID {old_pid}），略過啟動")
+        else:
+            print("[Daemon] 鎖被其他行程持有，略過啟動")
         return True
-    else:
-        LOCK_FILE.write_text(str(os.getpid()))
-        return False
+    if old_pid and old_pid != os.getpid() and not pid_alive(old_pid):
+        print(f"[Daemon] 清除殘留鎖（PID {old_pid} 已不存在）")
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, str(os.getpid()).encode(), 0)
+    _lock_fd = fd
+    return False
+
 
 def clear_lock():
-    if LOCK_FILE.exists():
-        LOCK_FILE.unlink()
+    global _lock_fd
+    if _lock_fd is not None:
+        os.ftruncate(_lock_fd, 0)
+        fcntl.flock(_lock_fd, fcntl.LOCK_UN)
+        os.close(_lock_fd)
+        _lock_fd = None
+
 
-def run_one_round():
-    result = subprocess.run(["python3", str(Path("~/Killcore/historical_archiver.py").expanduser())])
+def run_one_round(as_of=None):
+    env = dict(os.environ)
+    if as_of is not None:
+        env["KILLCORE_AS_OF"] = str(as_of)
+    result = subprocess.run(["python3", str(KILLCORE_PATH / "historical_archiver.py")], env=env)
     return result.returncode == 0
 
+
+def load_daemon_state():
+    if STATE_FILE.exists():
+        try:
+            return json.loads(STATE_FILE.read_text())
+        except json.JSONDecodeError:
+            pass
+    return {"last_boundary": None, "fingerprint": None}
+
+
+def save_daemon_state(daemon_state):
+    tmp = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    tmp.write_text(json.dumps(daemon_state, indent=2))
+    os.replace(tmp, STATE_FILE)
+
+
+def input_fingerprint():
+    # 本輪的外部輸入：各本地 K 線庫最後一根與市況檔；replay 模式每輪都是新資料
+    from kline_store import KLINE_MODE, KlineStore, stores
+    if KLINE_MODE == "replay":
+        return None
+    parts = []
+    for symbol, interval in stores():
+        store = KlineStore(symbol, interval)
+        try:
+            store.sync()
+        except Exception as e:
+            print(f"[Daemon] {symbol} K 線更新失敗：{e}")
+        parts.append(f"{symbol}_{interval}:{store.last_open_time()}")
+    market = KILLCORE_PATH / "market_status.json"
+    if market.exists():
+        parts.append(f"market:{market.stat().st_mtime_ns}")
+    return "|".join(parts) or None
+
+
+def backfill_missed(daemon_state, boundary, interval_ms):
+    # 停機期間錯過的收盤逐一補跑（最多 MAX_BACKFILL_ROUNDS 輪）。每輪都會寫入記憶並進化 king，
+    # 故每補完一輪就記下進度，重啟時不重跑已補過的輪次；失敗即停，回傳 False 由下一根 K 線重試
+    last = daemon_state.get("last_boundary")
+    if last is None or boundary - last <= interval_ms:
+        return True
+    missed = list(range(last + interval_ms, boundary, interval_ms))[-MAX_BACKFILL_ROUNDS:]
+    print(f"[Daemon] 補跑錯過的 {len(missed)} 根 K 線")
+    for b in missed:
+        if not run_one_round(as_of=b - interval_ms):
+            print("[Daemon] 補跑異常，停止補跑，下一根 K 線重試")
+            return False
+        daemon_state["last_boundary"] = b
+        save_daemon_state(daemon_state)
+    return True
+
+
+def run_candle_schedule():
+    from kline_store import INTERVAL_MS
+    interval_ms = INTERVAL_MS[CANDLE_INTERVAL]
+    daemon_state = load_daemon_state()
+    signal.signal(signal.SIGUSR1, lambda *_: _wake.set())
+    print(f"[Daemon] 背景掛機啟動，對齊 {CANDLE_INTERVAL} K 線收盤執行（SIGUSR1 可提前喚醒）")
+
+    while True:
+        now_ms = int(time.time() * 1000)
+        boundary = now_ms // interval_ms * interval_ms
+        signaled = _wake.is_set()
+        _wake.clear()
+        last = daemon_state.get("last_boundary")
+
+        if last is None or boundary > last or signaled:
+            if backfill_missed(daemon_state, boundary, interval_ms):
+                fingerprint = input_fingerprint()
+                if fingerprint is not None and fingerprint == daemon_state.get("fingerprint"):
+                    print("[Daemon] 輸入未變，略過本輪")
+                else:
+                    success = run_one_round()
+                    print("[Daemon] 本輪執行完成" if success else "[Daemon] 執行異常，下一根 K 線重試")
+                    if success:
+                        daemon_state["fingerprint"] = fingerprint
+                daemon_state["last_boundary"] = boundary
+                save_daemon_state(daemon_state)
+
+        next_close = (boundary + interval_ms) / 1000 + CLOSE_DELAY_SEC
+        _wake.wait(timeout=max(next_close - time.time(), 0.5))
+
+
+def run_fixed_schedule():
+    print(f"[Daemon] 背景掛機啟動，每 {FIXED_INTERVAL_SEC} 秒執行一輪 Killcore 模組")
+    while True:
+        success = run_one_round()
+        if success:
+            print(f"[Daemon] 本輪執行完成，等待 {FIXED_INTERVAL_SEC} 秒...")
+        else:
+            print(f"[Daemon] 執行異常，等待 {FIXED_INTERVAL_SEC} 秒重試...")
+        time.sleep(FIXED_INTERVAL_SEC)
+
+
 if __name__ == "__main__":
     try:
         if is_already_running():
             exit(0)
 
-        print("[Daemon] 背景掛機啟動，每 10 秒執行一輪 Killcore 模組")
-        while True:
-            success = run_one_round()
-            if success:
-                print("[Daemon] 本輪執行完成，等待 10 秒...")
-            else:
-                print("[Daemon] 執行異常，等待 10 秒重試...")
-            time.sleep(10)
+        if SCHEDULE_MODE == "fixed":
+            run_fixed_schedule()
+        else:
+            run_candle_schedule()
 
     except KeyboardInterrupt:
         print("\n[Daemon] 偵測到中斷，準備離開...")
@@ -0,0 +1,38 @@
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import atexit
+import os
+import re
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# 模組在匯入時就展開 ~/Killcore，先把 HOME 指到暫存目錄，測試不碰真正的狀態
+os.environ["HOME"] = tempfile.mkdtemp(prefix="killcore_test_")
+atexit.register(shutil.rmtree, os.environ["HOME"], ignore_errors=True)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def deployed_name(path):
+    # 與部署相同的命名：去掉編號前綴，空白換底線、轉小寫（"8. historical_archiver.py" → historical_archiver）
+    name = re.sub(r"^\d+\.\s*", "", path.name).replace(" ", "_").lower()
+    return name[:-3] if name.endswith(".py") else name
+
+
+SCRIPTS = {deployed_name(p): p for p in ROOT.glob("[0-9]*") if p.is_file()}
+
+
+class _NumberedScripts(importlib.abc.MetaPathFinder):
+    """倉庫內的腳本以編號命名，測試時依部署後的名稱匯入。"""
+
+    def find_spec(self, name, path=None, target=None):
+        if name not in SCRIPTS:
+            return None
+        return importlib.util.spec_from_file_location(name, SCRIPTS[name],
+                                                      loader=importlib.machinery.SourceFileLoader(name, str(SCRIPTS[name])))
+
+
+sys.meta_path.insert(0, _NumberedScripts())
@@ -0,0 +1,41 @@
+import sys
+import threading
+
+from round_state import RoundState
+
+
+def test_save_while_other_stages_snapshot(tmp_path):
+    # 並行排程時其他模組持續 save，begin_stage / invalidate_clean 走訪快取不得出錯
+    state = RoundState(tmp_path)
+    stop = threading.Event()
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            state.save(f"w{n}_{i % 20000}", {"i": i})
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(30):
+            state.begin_stage({"w0_0"})
+            state.invalidate_clean({"nothing"}, {})
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        sys.setswitchinterval(interval)
+
+
+def test_failed_stage_restores_snapshot(tmp_path):
+    state = RoundState(tmp_path)
+    state.save("king", {"generation": 1})
+    snapshot = state.begin_stage({"king"})
+    state.load("king")["generation"] = 2
+    state.invalidate_clean({"king"}, snapshot)
+    assert state.load("king") == {"generation": 1}
+    assert state.is_dirty("king")
@@ -0,0 +1,114 @@
+import sys
+import threading
+
+import pytest
+
+import historical_archiver
+from round_state import RoundState
+from stage_graph import ANY, conflicts, declared, dependencies, run_graph
+
+
+def noop():
+    pass
+
+
+@pytest.fixture
+def round_stages(tmp_path, monkeypatch):
+    # 以真正的模組宣告建出整輪的階段圖（模組檔只需存在，宣告由倉庫內的原始碼匯入）
+    monkeypatch.setattr(historical_archiver, "killcore_path", tmp_path)
+    for module in historical_archiver.modules:
+        (tmp_path / module).touch()
+    stages = historical_archiver.module_stages(None, None)
+    stages += historical_archiver.closing_stages(noop, noop, noop, noop)
+    return stages
+
+
+def index(stages):
+    return {s["name"]: i for i, s in enumerate(stages)}
+
+
+def test_modules_declare_reads_and_writes(round_stages):
+    for stage in round_stages:
+        assert ANY not in stage["reads"] | stage["writes"], stage["name"]
+
+
+def test_repeated_module_is_numbered(round_stages):
+    names = [s["name"] for s in round_stages]
+    assert names.count("memory_recorder") == 1
+    assert names.index("memory_recorder") < names.index("evolution_engine") < names.index("memory_recorder#2")
+
+
+def test_dependencies_follow_declarations(round_stages):
+    deps, at = dependencies(round_stages), index(round_stages)
+    # 選幣與產生核心互不相依；模擬器要等核心寫出 king
+    assert deps[at["core_generator"]] == set()
+    assert at["core_generator"] in deps[at["live_simulator"]]
+    # 第二次記憶要等進化寫回 king 與記憶，報表要等第二次記憶
+    assert at["evolution_engine"] in deps[at["memory_recorder#2"]]
+    assert at["memory_recorder#2"] in deps[at["insight_reporter"]]
+    # 預抓會改 K 線庫與行情，不得與讀取它們的模組重疊
+    for name in ("symbol_selector", "live_simulator", "evolution_engine"):
+        assert at[name] in deps[at["prefetch"]]
+
+
+def test_flush_waits_for_every_writer(round_stages):
+    from round_state import STATE_FILES
+    deps, at = dependencies(round_stages), index(round_stages)
+    writers = {i for i, s in enumerate(round_stages[:at["flush"]]) if s["writes"] & set(STATE_FILES)}
+    assert writers
+    assert writers <= deps[at["flush"]]
+    assert at["flush"] in deps[at["archive"]]
+    assert at["archive"] in deps[at["analytics"]]
+
+
+def test_undeclared_module_conflicts_with_everything():
+    reads, writes = declared(object())
+    undeclared = {"reads": reads, "writes": writes}
+    quiet = {"reads": set(), "writes": set()}
+    reader = {"reads": {"king"}, "writes": set()}
+    assert conflicts(undeclared, reader) and conflicts(reader, undeclared)
+    assert not conflicts(quiet, undeclared)
+
+
+def test_raising_stage_stops_dependents():
+    ran, release = [], threading.Event()
+
+    def boom():
+        raise RuntimeError("boom")
+
+    def slow():
+        release.wait(5)
+        ran.append("slow")
+
+    stages = [
+        {"name": "slow", "run": slow, "reads": set(), "writes": {"a"}},
+        {"name": "boom", "run": boom, "reads": set(), "writes": {"b"}},
+        {"name": "after", "run": lambda: ran.append("after"), "reads": {"b"}, "writes": set()},
+    ]
+    threading.Timer(0.1, release.set).start()
+    with pytest.raises(RuntimeError, match="boom"):
+        run_graph(stages)
+    # 已在執行的階段跑完才拋出，相依於失敗階段的不再啟動
+    assert ran == ["slow"]
+    assert not hasattr(sys.stdout, "begin")
+
+
+def test_failing_module_stage_is_rolled_back(tmp_path, monkeypatch):
+    # 模組階段經 run_inprocess 執行：失敗時撤回它的 save，run_graph 不拋出，後續階段照跑
+    (tmp_path / "broken_stage.py").write_text(
+        "def run(state):\n"
+        "    state.save('king', {'generation': 99})\n"
+        "    raise ValueError('broken')\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    state = RoundState(tmp_path)
+    state.save("performance", {"return_pct": 1.0})
+    ran = []
+    stages = [
+        {"name": "broken_stage", "reads": {"king"}, "writes": {"king"},
+         "run": lambda: historical_archiver.run_inprocess(tmp_path / "broken_stage.py", state, keys={"king"})},
+        {"name": "after", "run": lambda: ran.append(state.load("king", None)), "reads": {"king"}, "writes": set()},
+    ]
+    run_graph(stages)
+    assert ran == [None]
+    assert not state.is_dirty("king")
+    assert state.is_dirty("performance")